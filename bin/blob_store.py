@@ -0,0 +1,123 @@
+import os
+import errno
+import shutil
+from checksum_cache import get_sha1_list
+
+BLOB_STORE_ENV = "ROSLIN_BLOB_STORE"
+BLOB_STORE_DIR_NAME = "roslin_blob_store"
+BLOB_STORE_GRIDFS = "gridfs"
+BLOB_STORE_GRIDFS_COLLECTION = "ProjectBlobs"
+BLOB_DIGEST_PREFIX = "sha1$"
+BLOB_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Project input files are stored once per content in a blob store keyed by their
+# sha1 digest ( sha1$<hex>, the same value as the checksum in the project docs ),
+# so the docs only carry digests. ROSLIN_BLOB_STORE selects the store: a
+# directory, or "gridfs" to keep the blobs in the tracking mongo database. By
+# default the blobs go in a directory of the pipeline output path, which the
+# submitting users can write to. The store is never pruned, a blob is touched
+# every time a project stores it so unused blobs can be removed by their age.
+
+def get_blob_digest(sha1):
+    return BLOB_DIGEST_PREFIX + sha1
+
+class LocalBlobStore(object):
+
+    def __init__(self,store_dir):
+        self.store_dir = os.path.abspath(store_dir)
+        self.location = self.store_dir
+
+    def get_blob_path(self,digest):
+        sha1 = digest[len(BLOB_DIGEST_PREFIX):]
+        return os.path.join(self.store_dir,sha1[:2],sha1)
+
+    def has_blob(self,digest):
+        return os.path.exists(self.get_blob_path(digest))
+
+    def put_file(self,file_path,digest):
+        blob_path = self.get_blob_path(digest)
+        if os.path.exists(blob_path):
+            try:
+                os.utime(blob_path,None)
+            except OSError:
+                # stored by another user, its age is only used for cleanup
+                pass
+            return False
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.isdir(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError:
+                # created by another submission
+                if not os.path.isdir(blob_dir):
+                    raise
+        blob_tmp_path = blob_path + "." + str(os.getpid()) + ".tmp"
+        try:
+            with open(file_path,'rb') as input_file, open(blob_tmp_path,'wb') as blob_file:
+                shutil.copyfileobj(input_file,blob_file,BLOB_COPY_BUFFER_SIZE)
+            os.chmod(blob_tmp_path,0o444)
+            os.rename(blob_tmp_path,blob_path)
+        finally:
+            if os.path.exists(blob_tmp_path):
+                os.remove(blob_tmp_path)
+        return True
+
+    def open_blob(self,digest):
+        return open(self.get_blob_path(digest),'rb')
+
+class GridFSBlobStore(object):
+
+    def __init__(self,database,collection_name=BLOB_STORE_GRIDFS_COLLECTION):
+        import gridfs
+        self.file_exists_error = gridfs.errors.FileExists
+        self.fs = gridfs.GridFS(database,collection=collection_name)
+        self.location = BLOB_STORE_GRIDFS + "://" + database.name + "/" + collection_name
+
+    def has_blob(self,digest):
+        return self.fs.exists(digest)
+
+    def put_file(self,file_path,digest):
+        if self.fs.exists(digest):
+            return False
+        # gridfs reads the file in chunks, it is never loaded whole
+        with open(file_path,'rb') as input_file:
+            try:
+                self.fs.put(input_file,_id=digest,filename=os.path.basename(file_path))
+            except self.file_exists_error:
+                # stored by another submission
+                return False
+        return True
+
+    def open_blob(self,digest):
+        return self.fs.get(digest)
+
+def get_blob_store(pipeline_settings=None):
+    store_location = os.environ.get(BLOB_STORE_ENV)
+    if store_location == BLOB_STORE_GRIDFS:
+        from track_utils import get_tracking_backend
+        tracking_backend = get_tracking_backend()
+        if not tracking_backend or not hasattr(tracking_backend,'get_database'):
+            raise ValueError(BLOB_STORE_ENV + "=" + BLOB_STORE_GRIDFS + " needs mongo tracking to be enabled")
+        return GridFSBlobStore(tracking_backend.get_database())
+    if not store_location:
+        if not pipeline_settings:
+            pipeline_settings = os.environ
+        pipeline_output_path = pipeline_settings.get('ROSLIN_PIPELINE_OUTPUT_PATH')
+        if not pipeline_output_path:
+            raise ValueError("Set " + BLOB_STORE_ENV + " to a writable directory or to " + BLOB_STORE_GRIDFS + " to store the project files")
+        store_location = os.path.join(pipeline_output_path,BLOB_STORE_DIR_NAME)
+    return LocalBlobStore(store_location)
+
+def store_files(file_path_list,blob_store=None):
+    "store the files in the blob store, returns the digest of each file"
+    if not blob_store:
+        blob_store = get_blob_store()
+    file_checksums = get_sha1_list(file_path_list)
+    file_digests = {}
+    for single_file_path in file_path_list:
+        if not file_checksums[single_file_path]:
+            raise IOError(errno.ENOENT,"Could not read project file",single_file_path)
+        single_digest = get_blob_digest(file_checksums[single_file_path])
+        blob_store.put_file(single_file_path,single_digest)
+        file_digests[single_file_path] = single_digest
+    return file_digests
@@ -0,0 +1,120 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+from multiprocessing.dummy import Pool
+
+CHECKSUM_CACHE_FILE_NAME = "roslin_checksum_cache.json"
+CHECKSUM_READ_SIZE = 8 * 1024 * 1024
+CHECKSUM_MAX_WORKERS = 4
+
+# The checksum cache maps the real path of a file to its sha1 together with the
+# (device, inode, size, mtime_ns) it was computed for. A file is only read again
+# when one of those changed. The cache lives next to the pipeline configs so it is
+# shared by every project and pipeline version, unless ROSLIN_CORE_CONFIG_PATH is
+# not set, in which case it only lasts for the current process. A file that can
+# not be read gets None as its checksum, and is not cached.
+
+checksum_cache = None
+checksum_cache_lock = threading.Lock()
+
+def read_json_cache(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+def update_json_cache(cache_path,new_entries):
+    # merge under a lock, other processes may update the same cache
+    if not cache_path or not new_entries:
+        return
+    with open(cache_path + ".lock","w") as lock_file:
+        fcntl.flock(lock_file,fcntl.LOCK_EX)
+        cache = read_json_cache(cache_path)
+        cache.update(new_entries)
+        cache_tmp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+        with open(cache_tmp_path,"w") as cache_tmp_file:
+            json.dump(cache,cache_tmp_file,default=str)
+        os.rename(cache_tmp_path,cache_path)
+
+def get_checksum_cache_path():
+    config_path = os.environ.get("ROSLIN_CORE_CONFIG_PATH")
+    if not config_path:
+        return None
+    return os.path.join(config_path,CHECKSUM_CACHE_FILE_NAME)
+
+def get_checksum_cache():
+    global checksum_cache
+    with checksum_cache_lock:
+        if checksum_cache is None:
+            checksum_cache = read_json_cache(get_checksum_cache_path())
+        return checksum_cache
+
+def get_file_key(stat_result):
+    mtime_ns = getattr(stat_result,'st_mtime_ns',None)
+    if mtime_ns is None:
+        mtime_ns = int(round(stat_result.st_mtime * 1000000000))
+    return [stat_result.st_dev, stat_result.st_ino, stat_result.st_size, mtime_ns]
+
+def compute_sha1(file_path):
+    # hashlib releases the GIL on large updates, so files are hashed in parallel
+    sha1 = hashlib.sha1()
+    try:
+        with open(file_path,'rb') as input_file:
+            while True:
+                data = input_file.read(CHECKSUM_READ_SIZE)
+                if not data:
+                    break
+                sha1.update(data)
+    except (IOError, OSError):
+        return None
+    return sha1.hexdigest()
+
+def get_sha1_list(file_path_list):
+    cache = get_checksum_cache()
+    sha1_dict = {}
+    hash_list = []
+    for single_path in set(file_path_list):
+        real_path = os.path.realpath(single_path)
+        try:
+            file_key = get_file_key(os.stat(real_path))
+        except OSError:
+            sha1_dict[single_path] = None
+            continue
+        cached_entry = cache.get(real_path)
+        if cached_entry and cached_entry['key'] == file_key:
+            sha1_dict[single_path] = cached_entry['sha1']
+        else:
+            hash_list.append((single_path, real_path, file_key))
+    if not hash_list:
+        return sha1_dict
+    if len(hash_list) == 1:
+        sha1_list = [compute_sha1(hash_list[0][1])]
+    else:
+        hash_pool = Pool(min(CHECKSUM_MAX_WORKERS,len(hash_list)))
+        try:
+            sha1_list = hash_pool.map(compute_sha1,[single_file[1] for single_file in hash_list])
+        finally:
+            hash_pool.close()
+            hash_pool.join()
+    new_entries = {}
+    for single_file, single_sha1 in zip(hash_list,sha1_list):
+        single_path, real_path, file_key = single_file
+        sha1_dict[single_path] = single_sha1
+        if single_sha1:
+            new_entries[real_path] = {'key': file_key, 'sha1': single_sha1}
+    with checksum_cache_lock:
+        cache.update(new_entries)
+    try:
+        update_json_cache(get_checksum_cache_path(),new_entries)
+    except (IOError, OSError):
+        # the checksums are still valid, they are just not cached for the next run
+        pass
+    return sha1_dict
+
+def get_sha1(file_path):
+    return get_sha1_list([file_path])[file_path]
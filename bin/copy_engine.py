@@ -0,0 +1,364 @@
+import os
+import glob
+import json
+import stat
+import time
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+import threading
+from multiprocessing.dummy import Pool
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+COPY_CHUNK_SIZE = 256 * 1024 * 1024
+COPY_CHUNK_THREADS = 4
+COPY_UNSUPPORTED_ERRORS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+COPY_MANIFEST_DIR_NAME = ".roslin_copy_manifest"
+
+PUBLISH_COPY = "copy"
+PUBLISH_REFLINK = "reflink"
+PUBLISH_HARDLINK = "hardlink"
+PUBLISH_LINK = "link"
+RESULTS_PUBLISH_MODES = [PUBLISH_COPY, PUBLISH_REFLINK, PUBLISH_LINK]
+# the ways a file is published in each mode, in the order they are tried
+PUBLISH_METHODS = {PUBLISH_COPY: [PUBLISH_COPY], PUBLISH_REFLINK: [PUBLISH_REFLINK, PUBLISH_COPY], PUBLISH_LINK: [PUBLISH_REFLINK, PUBLISH_HARDLINK, PUBLISH_COPY]}
+# linux ioctl that clones a file on filesystems with copy-on-write extents (XFS, btrfs, ...)
+FICLONE = 0x40049409
+PUBLISH_UNSUPPORTED_ERRORS = COPY_UNSUPPORTED_ERRORS + (errno.ENOTTY, errno.EPERM)
+
+# In-process replacement for "/bin/cp -r". Data is moved by the kernel with
+# copy_file_range, or sendfile, and only falls back to read/write when neither
+# works for a pair of files. Python 2 has neither call in the os module, so they
+# are called from libc through ctypes, which releases the GIL for the duration
+# of the call. Files larger than COPY_CHUNK_SIZE are split in chunks copied in
+# parallel, each chunk with its own file descriptors.
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError:
+    libc = None
+
+libc_copy_file_range = getattr(libc, "copy_file_range", None)
+if libc_copy_file_range:
+    libc_copy_file_range.restype = ctypes.c_ssize_t
+    libc_copy_file_range.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t, ctypes.c_uint]
+
+libc_sendfile = getattr(libc, "sendfile64", None) or getattr(libc, "sendfile", None)
+if libc_sendfile:
+    libc_sendfile.restype = ctypes.c_ssize_t
+    libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+
+copy_chunk_pool = None
+copy_chunk_pool_lock = threading.Lock()
+
+# publish methods that failed for a (source device, destination device) pair
+unsupported_publish_methods = {}
+unsupported_publish_methods_lock = threading.Lock()
+
+def raise_libc_error():
+    error_number = ctypes.get_errno()
+    raise OSError(error_number, os.strerror(error_number))
+
+def copy_file_range_chunk(src_fd,dst_fd,offset,length):
+    if hasattr(os,'copy_file_range'):
+        return os.copy_file_range(src_fd,dst_fd,length,offset,offset)
+    if not libc_copy_file_range:
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    src_offset = ctypes.c_longlong(offset)
+    dst_offset = ctypes.c_longlong(offset)
+    copied_bytes = libc_copy_file_range(src_fd,ctypes.byref(src_offset),dst_fd,ctypes.byref(dst_offset),length,0)
+    if copied_bytes < 0:
+        raise_libc_error()
+    return copied_bytes
+
+def sendfile_chunk(src_fd,dst_fd,offset,length):
+    # sendfile writes at the current position of the destination
+    os.lseek(dst_fd,offset,os.SEEK_SET)
+    if hasattr(os,'sendfile'):
+        return os.sendfile(dst_fd,src_fd,offset,length)
+    if not libc_sendfile:
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    src_offset = ctypes.c_longlong(offset)
+    copied_bytes = libc_sendfile(dst_fd,src_fd,ctypes.byref(src_offset),length)
+    if copied_bytes < 0:
+        raise_libc_error()
+    return copied_bytes
+
+def read_write_chunk(src_fd,dst_fd,offset,length):
+    os.lseek(src_fd,offset,os.SEEK_SET)
+    os.lseek(dst_fd,offset,os.SEEK_SET)
+    data = os.read(src_fd,min(length,COPY_BUFFER_SIZE))
+    written_bytes = 0
+    while written_bytes < len(data):
+        written_bytes = written_bytes + os.write(dst_fd,data[written_bytes:])
+    return len(data)
+
+COPY_METHODS = [copy_file_range_chunk, sendfile_chunk, read_write_chunk]
+
+def copy_range(src_fd,dst_fd,offset,length):
+    "copy length bytes at offset, returns the number of bytes copied"
+    start_offset = offset
+    end_offset = offset + length
+    copy_methods = list(COPY_METHODS)
+    while offset < end_offset:
+        copy_method = copy_methods[0]
+        try:
+            copied_bytes = copy_method(src_fd,dst_fd,offset,min(end_offset - offset,COPY_CHUNK_SIZE))
+        except OSError as copy_error:
+            if copy_error.errno in COPY_UNSUPPORTED_ERRORS and len(copy_methods) > 1:
+                copy_methods.pop(0)
+                continue
+            raise
+        if copied_bytes == 0:
+            # some filesystems ( FUSE, NFS, procfs ) return 0 before the end, like shutil try the next method
+            if len(copy_methods) > 1:
+                copy_methods.pop(0)
+                continue
+            # the source is shorter than it was when we started
+            break
+        offset = offset + copied_bytes
+    return offset - start_offset
+
+def copy_chunk(chunk):
+    src_path, dst_path, offset, length = chunk
+    src_fd = os.open(src_path,os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst_path,os.O_WRONLY)
+        try:
+            return copy_range(src_fd,dst_fd,offset,length)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+def get_copy_chunk_pool():
+    global copy_chunk_pool
+    with copy_chunk_pool_lock:
+        if copy_chunk_pool is None:
+            copy_chunk_pool = Pool(COPY_CHUNK_THREADS)
+        return copy_chunk_pool
+
+def copy_file_data(src_path,dst_path,src_stat):
+    file_size = src_stat.st_size
+    dst_fd = os.open(dst_path,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,stat.S_IMODE(src_stat.st_mode))
+    try:
+        # set the final size so chunks can be written at any offset
+        os.ftruncate(dst_fd,file_size)
+    finally:
+        os.close(dst_fd)
+    chunk_list = []
+    for offset in range(0,file_size,COPY_CHUNK_SIZE):
+        chunk_list.append((src_path,dst_path,offset,min(COPY_CHUNK_SIZE,file_size - offset)))
+    if len(chunk_list) > 1:
+        copied_bytes = sum(get_copy_chunk_pool().map(copy_chunk,chunk_list))
+    else:
+        copied_bytes = sum([copy_chunk(single_chunk) for single_chunk in chunk_list])
+    if copied_bytes != file_size:
+        # the destination was sized up front, a short copy would leave a zero-filled tail
+        raise IOError(errno.EIO, "Copied " + str(copied_bytes) + " of " + str(file_size) + " bytes",src_path)
+    os.chmod(dst_path,stat.S_IMODE(src_stat.st_mode))
+
+def reflink_file(src_path,dst_path,src_stat):
+    src_fd = os.open(src_path,os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst_path,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,stat.S_IMODE(src_stat.st_mode))
+        try:
+            fcntl.ioctl(dst_fd,FICLONE,src_fd)
+        finally:
+            os.close(dst_fd)
+    except (IOError, OSError):
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+        raise
+    finally:
+        os.close(src_fd)
+    os.chmod(dst_path,stat.S_IMODE(src_stat.st_mode))
+
+def hardlink_file(src_path,dst_path,src_stat):
+    os.link(src_path,dst_path)
+
+PUBLISH_FUNCTIONS = {PUBLISH_COPY: copy_file_data, PUBLISH_REFLINK: reflink_file, PUBLISH_HARDLINK: hardlink_file}
+
+def publish_file(src_path,dst_path,src_stat,publish_mode):
+    dst_stat = os.stat(os.path.dirname(os.path.abspath(dst_path)))
+    device_pair = (src_stat.st_dev, dst_stat.st_dev)
+    for publish_method in PUBLISH_METHODS[publish_mode]:
+        if publish_method == PUBLISH_HARDLINK and src_stat.st_dev != dst_stat.st_dev:
+            continue
+        if publish_method in unsupported_publish_methods.get(device_pair,()):
+            continue
+        if publish_method == PUBLISH_COPY:
+            copy_file_data(src_path,dst_path,src_stat)
+            return publish_method
+        try:
+            PUBLISH_FUNCTIONS[publish_method](src_path,dst_path,src_stat)
+            return publish_method
+        except (IOError, OSError) as publish_error:
+            if publish_error.errno not in PUBLISH_UNSUPPORTED_ERRORS:
+                raise
+            with unsupported_publish_methods_lock:
+                unsupported_publish_methods.setdefault(device_pair,set()).add(publish_method)
+    copy_file_data(src_path,dst_path,src_stat)
+    return PUBLISH_COPY
+
+def copy_file(src_path,dst_path,manifest=None,publish_mode=PUBLISH_COPY):
+    start_time = time.time()
+    src_stat = os.stat(src_path)
+    file_size = src_stat.st_size
+    if manifest and manifest.is_current(src_path,src_stat,dst_path):
+        return {'source': src_path, 'destination': dst_path, 'size': file_size, 'seconds': time.time() - start_time, 'skipped': True, 'method': None}
+    # never write through an old hardlink into the source of a previous publication
+    if os.path.lexists(dst_path):
+        os.remove(dst_path)
+    publish_method = publish_file(src_path,dst_path,src_stat,publish_mode)
+    if manifest:
+        manifest.record(src_path,src_stat,dst_path)
+    return {'source': src_path, 'destination': dst_path, 'size': file_size, 'seconds': time.time() - start_time, 'skipped': False, 'method': publish_method}
+
+def copy_tree(src_path,dst_path,manifest=None,publish_mode=PUBLISH_COPY):
+    copied_files = []
+    if os.path.islink(src_path):
+        # like cp -r, links are copied as links
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+        os.symlink(os.readlink(src_path),dst_path)
+    elif os.path.isdir(src_path):
+        if not os.path.isdir(dst_path):
+            os.mkdir(dst_path,stat.S_IMODE(os.stat(src_path).st_mode))
+        for single_name in sorted(os.listdir(src_path)):
+            copied_files.extend(copy_tree(os.path.join(src_path,single_name),os.path.join(dst_path,single_name),manifest,publish_mode))
+    else:
+        copied_files.append(copy_file(src_path,dst_path,manifest,publish_mode))
+    return copied_files
+
+def copy_path(src_path,dst_dir,manifest=None,publish_mode=PUBLISH_COPY):
+    # same destination as "cp -r src_path dst_dir"
+    dst_path = os.path.join(dst_dir,os.path.basename(src_path.rstrip(os.sep)))
+    return copy_tree(src_path,dst_path,manifest,publish_mode)
+
+def get_path_size(path):
+    # bytes to publish for a file, a link or every file in a folder
+    if os.path.islink(path) or not os.path.isdir(path):
+        return os.lstat(path).st_size
+    path_size = 0
+    for root, dirs, files in os.walk(path):
+        for single_file in files:
+            try:
+                path_size += os.lstat(os.path.join(root,single_file)).st_size
+            except OSError:
+                pass
+    return path_size
+
+def sort_largest_first(copy_items):
+    # copy_items are tuples that start with the source path. A pool that takes
+    # the next item whenever a thread is free ends sooner when the largest
+    # copies start first ( longest processing time first ) than with the
+    # biggest file left at the end of the queue.
+    sized_items = []
+    for single_item in copy_items:
+        try:
+            item_size = get_path_size(single_item[0])
+        except OSError:
+            item_size = 0
+        sized_items.append((item_size,single_item))
+    sized_items.sort(key=lambda sized_item: (-sized_item[0], sized_item[1][0]))
+    return [single_item for item_size, single_item in sized_items]
+
+def get_copy_rate(copied_file):
+    size_mb = copied_file['size'] / float(1024 * 1024)
+    seconds = max(copied_file['seconds'],0.000001)
+    return "{} {:.1f} MB in {:.2f}s ({:.1f} MB/s)".format(copied_file['method'],size_mb,copied_file['seconds'],size_mb / seconds)
+
+### copy manifest ###
+
+# Every copy job appends the files it copied to its own jsonl file in the
+# manifest folder of the results dir: the source, the destination and the size and
+# mtime of both. A file is only copied again when the source or the destination
+# changed since, so restarts and re-runs only move the outputs that changed.
+
+def read_copy_manifest(manifest_dir):
+    manifest_entries = {}
+    for single_manifest in glob.glob(os.path.join(manifest_dir,"*.jsonl")):
+        with open(single_manifest) as manifest_file:
+            for single_line in manifest_file:
+                try:
+                    single_entry = json.loads(single_line)
+                except ValueError:
+                    # a line cut short by a job that was killed
+                    continue
+                destination = os.path.abspath(single_entry['destination'])
+                if destination not in manifest_entries or manifest_entries[destination]['copied'] < single_entry['copied']:
+                    manifest_entries[destination] = single_entry
+    return manifest_entries
+
+def is_current_copy(manifest_entry,src_path,src_stat,dst_path):
+    if not manifest_entry or manifest_entry['source'] != src_path:
+        return False
+    if manifest_entry['size'] != src_stat.st_size or manifest_entry['mtime'] != src_stat.st_mtime:
+        return False
+    try:
+        dst_stat = os.lstat(dst_path)
+    except OSError:
+        return False
+    return manifest_entry['destination_size'] == dst_stat.st_size and manifest_entry['destination_mtime'] == dst_stat.st_mtime
+
+class CopyManifest(object):
+
+    def __init__(self,results_dir,manifest_name):
+        self.manifest_dir = os.path.join(results_dir,COPY_MANIFEST_DIR_NAME)
+        if not os.path.isdir(self.manifest_dir):
+            try:
+                os.makedirs(self.manifest_dir)
+            except OSError:
+                # created by another copy job
+                if not os.path.isdir(self.manifest_dir):
+                    raise
+        self.manifest_path = os.path.join(self.manifest_dir,manifest_name + ".jsonl")
+        self.entries = read_copy_manifest(self.manifest_dir)
+        self.lock = threading.Lock()
+
+    def is_current(self,src_path,src_stat,dst_path):
+        return is_current_copy(self.entries.get(os.path.abspath(dst_path)),src_path,src_stat,dst_path)
+
+    def record(self,src_path,src_stat,dst_path):
+        dst_stat = os.lstat(dst_path)
+        manifest_entry = {'source': src_path, 'destination': dst_path, 'size': src_stat.st_size, 'mtime': src_stat.st_mtime, 'destination_size': dst_stat.st_size, 'destination_mtime': dst_stat.st_mtime, 'copied': time.time()}
+        with self.lock:
+            self.entries[os.path.abspath(dst_path)] = manifest_entry
+            with open(self.manifest_path,"a") as manifest_file:
+                manifest_file.write(json.dumps(manifest_entry) + "\n")
+
+def prune_copy_results(results_dir):
+    # remove everything from the results dir except the copies that are still current
+    results_dir = os.path.abspath(results_dir)
+    manifest_dir = os.path.join(results_dir,COPY_MANIFEST_DIR_NAME)
+    manifest_entries = read_copy_manifest(manifest_dir)
+    kept_files = 0
+    removed_files = 0
+    for root, dirs, files in os.walk(results_dir,topdown=False):
+        if root == manifest_dir:
+            continue
+        for single_file in files:
+            file_path = os.path.join(root,single_file)
+            manifest_entry = manifest_entries.get(file_path)
+            src_stat = None
+            if manifest_entry and not os.path.islink(file_path):
+                try:
+                    src_stat = os.stat(manifest_entry['source'])
+                except OSError:
+                    src_stat = None
+            if src_stat and is_current_copy(manifest_entry,manifest_entry['source'],src_stat,file_path):
+                kept_files = kept_files + 1
+            else:
+                os.remove(file_path)
+                removed_files = removed_files + 1
+        for single_dir in dirs:
+            dir_path = os.path.join(root,single_dir)
+            if dir_path == manifest_dir:
+                continue
+            if os.path.islink(dir_path):
+                os.remove(dir_path)
+            elif not os.listdir(dir_path):
+                os.rmdir(dir_path)
+    return kept_files, removed_files
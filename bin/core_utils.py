@@ -2,10 +2,6 @@ from __future__ import print_function
 from subprocess import PIPE, Popen, STDOUT
 import os, sys, argparse
 from multiprocessing.dummy import Pool
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
 import time
 import shutil
 import filecmp
@@ -21,10 +17,21 @@ import re
 import inspect
 import stat
 import math
+import imp
+from settings_snapshot import read_settings_snapshot
+from checksum_cache import get_file_key, read_json_cache, update_json_cache
+from copy_engine import RESULTS_PUBLISH_MODES
 
 starting_log_message="------------ starting ------------"
 exiting_log_message="------------ exiting ------------"
 finished_log_message="------------ finished ------------"
+YAML_LOAD_MAX_WORKERS = 4
+CHOICES_CACHE_FILE_NAME = "roslin_choices_cache.json"
+choices_registry = {}
+LEADER_DAEMON_ENV = "ROSLIN_LEADER_DAEMON"
+LEADER_DAEMON_FILE_NAME = "leader_daemon"
+# never written to the spool, the daemon hands the jobs its own values
+LEADER_DAEMON_SECRET_ENV_WORDS = ['PASSWORD', 'SECRET', 'TOKEN', 'CREDENTIAL']
 
 ignore_lines = ['No unfinished job found','Cannot get parameter information from lsf.conf or ego.conf for LIM from']
 
@@ -82,8 +89,39 @@ def mem_format_type(value):
         exit(1)
     return value
 
-def get_choices():
-    sys.path.append(os.environ['ROSLIN_PIPELINE_BIN_PATH'])
+def find_module_file(module_name,package_file=None):
+    "find the source file of a module without importing it"
+    try:
+        module_file, module_path, module_description = imp.find_module(module_name)
+    except ImportError:
+        return None
+    if module_file:
+        module_file.close()
+    if package_file:
+        module_path = os.path.join(module_path,package_file)
+    return module_path
+
+def get_choices_key(pipeline_bin_path):
+    "the choices only change when one of the files they are read from changes"
+    track_utils_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'track_utils.py')
+    registry_path = find_module_file('toil',os.path.join('batchSystems','registry.py'))
+    choices_key = [pipeline_bin_path]
+    for single_file in [find_module_file('roslin_workflows'), track_utils_path, registry_path]:
+        if not single_file:
+            return None
+        try:
+            choices_key.append([single_file] + get_file_key(os.stat(single_file)))
+        except OSError:
+            return None
+    return choices_key
+
+def get_choices_cache_path():
+    config_path = os.environ.get("ROSLIN_CORE_CONFIG_PATH")
+    if not config_path:
+        return None
+    return os.path.join(config_path,CHOICES_CACHE_FILE_NAME)
+
+def find_choices():
     import roslin_workflows
     from track_utils import  RoslinWorkflow
     from toil.batchSystems import registry
@@ -99,7 +137,30 @@ def get_choices():
             continue
         if issubclass(class_obj,RoslinWorkflow):
             roslin_workflow_list.append(class_name)
-    return {'workflow_name':list(roslin_workflow_list),'batch_system':list(registry._UNIQUE_NAME),'cwl_batch_system':list(registry._UNIQUE_NAME)}
+    return {'workflow_name':list(roslin_workflow_list),'batch_system':list(registry._UNIQUE_NAME),'cwl_batch_system':list(registry._UNIQUE_NAME),'results_publish_mode':list(RESULTS_PUBLISH_MODES)}
+
+def get_choices():
+    # finding the choices imports roslin_workflows and toil, so they are kept
+    # for the process and cached on disk until their source files change
+    pipeline_bin_path = os.environ['ROSLIN_PIPELINE_BIN_PATH']
+    if pipeline_bin_path in choices_registry:
+        return choices_registry[pipeline_bin_path]
+    if pipeline_bin_path not in sys.path:
+        sys.path.append(pipeline_bin_path)
+    choices_cache_path = get_choices_cache_path()
+    choices_key = get_choices_key(pipeline_bin_path)
+    cached_entry = read_json_cache(choices_cache_path).get(pipeline_bin_path)
+    if choices_key and cached_entry and cached_entry['key'] == choices_key:
+        choices_dict = cached_entry['choices']
+    else:
+        choices_dict = find_choices()
+        if choices_key:
+            try:
+                update_json_cache(choices_cache_path,{pipeline_bin_path:{'key':choices_key,'choices':choices_dict}})
+            except (IOError, OSError):
+                pass
+    choices_registry[pipeline_bin_path] = choices_dict
+    return choices_dict
 
 def add_workflow_requirement(parser,requirements_list):
     choices_dict = get_choices()
@@ -164,6 +225,7 @@ def get_common_args():
         ("store",str,"project_path","--path","Path to Project files (to store in database)",False,True),
         ("store_true",bool,"test_mode","--test-mode","Run the runner in test mode",False,False),
         ("store_true",bool,"force_overwrite_results","--force-overwrite-results","Force overwrite if results folder already exists",False,False),
+        ("store",str,"results_publish_mode","--results-publish-mode","How outputs are put in the results folder: copy, reflink (copy-on-write clone where the filesystem supports it) or link (reflink, then hardlink on the same filesystem), falls back to copy (default: reflink)",False,False),
         ("store",str,"on_start","--on-start","Python script to run when the workflow starts",False,True),
         ("store",str,"on_complete","--on-complete","Python script to run when the workflow completes (either fail or succeed)",False,True),
         ("store",str,"on_fail","--on-fail","Python script to run when the workflow fails",False,True),
@@ -249,6 +311,39 @@ def get_dir_paths(project_name, project_uuid,pipeline_name,pipeline_version):
     tmp_path = os.path.join(pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'],"tmp")
     return (log_dir,work_dir,tmp_path)
 
+def get_leader_daemon_pid(output_path):
+    leader_daemon_path = os.path.join(output_path,LEADER_DAEMON_FILE_NAME)
+    if os.path.exists(leader_daemon_path):
+        with open(leader_daemon_path) as leader_daemon_file:
+            return leader_daemon_file.readline().strip()
+    return None
+
+def is_secret_env(env_name):
+    env_name = env_name.upper()
+    for single_word in LEADER_DAEMON_SECRET_ENV_WORDS:
+        if single_word in env_name:
+            return True
+    return False
+
+def get_secret_env(env_dict):
+    return dict((env_name, env_dict[env_name]) for env_name in env_dict if is_secret_env(env_name))
+
+def spool_leader_submission(spool_dir,submission_dict):
+    "hand a leader command to the leader daemon watching the spool directory"
+    if not os.path.isdir(spool_dir):
+        os.makedirs(spool_dir,0o700)
+    submission_dict = dict(submission_dict)
+    submission_dict['env'] = dict((env_name, env_value) for env_name, env_value in submission_dict['env'].items() if not is_secret_env(env_name))
+    submission_name = str(submission_dict['project_uuid']) + "-" + str(int(time.time() * 1000)) + ".json"
+    submission_path = os.path.join(spool_dir,submission_name)
+    # the daemon only reads .json files, so it never sees a partial submission
+    submission_tmp_path = submission_path + "." + str(os.getpid()) + ".tmp"
+    submission_fd = os.open(submission_tmp_path,os.O_WRONLY | os.O_CREAT | os.O_EXCL,0o600)
+    with os.fdopen(submission_fd,'w') as submission_file:
+        json.dump(submission_dict,submission_file)
+    os.rename(submission_tmp_path,submission_path)
+    return submission_path
+
 def get_jobstore_uuid(output_path):
     job_store_uuid_log = os.path.join(output_path,"job-store-uuid")
     if os.path.exists(job_store_uuid_log):
@@ -312,6 +407,11 @@ def kill_project(project_name, project_uuid, work_dir, batch_system, user_termin
     current_user = getpass.getuser()
     status_names = get_status_names()
     project_pid = get_pid(work_dir)
+    daemon_pid = get_leader_daemon_pid(work_dir)
+    if not project_pid and daemon_pid:
+        # the leader daemon has no process per project, its leader reads the termination file and exits
+        print("The project leader runs in the leader daemon ( pid " + str(daemon_pid) + " ), it will exit once it reads the kill request")
+        return
     if project_pid:
         if termination_graceful:
             try:
@@ -580,20 +680,27 @@ def list_depth(input_list):
     else:
         return 0
 
+def load_converted_yaml(yaml_path):
+    "load a yaml file with its relative paths resolved against its own directory"
+    yaml_contents = load_yaml(yaml_path)
+    return convert_dict(yaml_contents,os.path.dirname(yaml_path))
+
+def load_converted_yaml_list(yaml_list):
+    yaml_list = [single_file for single_file in yaml_list if single_file]
+    if len(yaml_list) < 2:
+        return [load_converted_yaml(single_file) for single_file in yaml_list]
+    # no file changes the working directory, so they can be loaded at the same time
+    yaml_pool = Pool(min(YAML_LOAD_MAX_WORKERS,len(yaml_list)))
+    try:
+        return yaml_pool.map(load_converted_yaml,yaml_list)
+    finally:
+        yaml_pool.close()
+        yaml_pool.join()
+
 def merge_yaml_list(yaml_list):
     result = None
-    cwd = os.getcwd()
-
-    #yaml_data = []
-
-    for single_file in yaml_list:
-        if single_file:
-            yaml_contents = load_yaml(single_file)
-            file_location = os.path.dirname(single_file)
-            os.chdir(file_location)
-            yaml_converted = convert_dict(yaml_contents)
-            os.chdir(cwd)
-            result = merge(result, yaml_converted)
+    for yaml_converted in load_converted_yaml_list(yaml_list):
+        result = merge(result, yaml_converted)
     return result
 
 
@@ -642,38 +749,35 @@ def merge(yaml1, yaml2):
 def create_roslin_yaml(output_meta_list, yaml_file_list):
 
     result = None
-    cwd = os.getcwd()
-
-    #yaml_data = []
 
     input_file_list = output_meta_list + yaml_file_list
 
-    for input_file in input_file_list:
-        if input_file:
-            yaml_contents = load_yaml(input_file)
-            file_location = os.path.dirname(input_file)
-            os.chdir(file_location)
-            yaml_converted = convert_dict(yaml_contents)
-            os.chdir(cwd)
-            result = merge(result, yaml_converted)
+    for yaml_converted in load_converted_yaml_list(input_file_list):
+        result = merge(result, yaml_converted)
     return result
 
-def convert_list(sample_list):
+def get_abs_path(file_path,base_dir=None):
+    "resolve file_path against base_dir instead of the current directory"
+    if base_dir:
+        file_path = os.path.join(base_dir,file_path)
+    return os.path.abspath(file_path)
+
+def convert_list(sample_list,base_dir=None):
     if not sample_list:
         return sample_list
     new_list = []
     for single_item in sample_list:
         if isinstance(single_item,dict):
-            new_item = convert_dict(single_item)
+            new_item = convert_dict(single_item,base_dir)
             new_list.append(new_item)
         elif isinstance(single_item,list):
-            new_item = convert_list(single_item)
+            new_item = convert_list(single_item,base_dir)
             new_list.append(new_item)
         else:
             new_list.append(single_item)
     return new_list
 
-def convert_dict(sample_dict):
+def convert_dict(sample_dict,base_dir=None):
     new_dict = {}
     location_path = ""
     file_prefix = False
@@ -684,9 +788,9 @@ def convert_dict(sample_dict):
     for single_key in sample_dict.keys():
         sample_obj = sample_dict[single_key]
         if isinstance(sample_obj,dict):
-            new_obj = convert_dict(sample_obj)
+            new_obj = convert_dict(sample_obj,base_dir)
         elif isinstance(sample_obj,list):
-            sample_obj = convert_list(sample_obj)
+            sample_obj = convert_list(sample_obj,base_dir)
         new_dict[single_key] = sample_obj
     if 'class' in new_dict:
         if new_dict['class'] == 'File' or new_dict['class'] == 'Directory':
@@ -699,7 +803,7 @@ def convert_dict(sample_dict):
                 if 'file://' in location_path:
                     file_prefix = True
                     location_path = location_path[7:]
-                abs_path = os.path.abspath(location_path)
+                abs_path = get_abs_path(location_path,base_dir)
                 new_location_path = ''
                 if file_prefix:
                     new_location_path = 'file://' + abs_path
@@ -707,23 +811,18 @@ def convert_dict(sample_dict):
                     new_location_path = abs_path
                 new_dict[file_key] = new_location_path
             if 'listing' in new_dict:
-                new_list = convert_list(new_dict['listing'])
+                new_list = convert_list(new_dict['listing'],base_dir)
                 new_dict['listing'] = new_list
     return new_dict
 
 def convert_yaml_abs_path(inputs_yaml_path,base_dir,new_inputs_yaml_path):
 
-    current_directory = os.getcwd()
+    # relative yaml paths are relative to base_dir, like the paths inside the yaml
+    yaml_contents = load_yaml(get_abs_path(inputs_yaml_path,base_dir))
 
-    os.chdir(base_dir)
+    yaml_converted = convert_dict(yaml_contents,base_dir)
 
-    yaml_contents = load_yaml(inputs_yaml_path)
-
-    yaml_converted = convert_dict(yaml_contents)
-
-    save_yaml(new_inputs_yaml_path, yaml_converted)
-
-    os.chdir(current_directory)
+    save_yaml(get_abs_path(new_inputs_yaml_path,base_dir), yaml_converted)
 
 def check_if_env_is_empty(env_value):
     if env_value and env_value != 'None':
@@ -747,19 +846,7 @@ def read_settings(pipeline_name,pipeline_version,settings_file_name):
     if not os.path.exists(settings_path):
         return None
 
-    command = 'source {} && env'.format(settings_path)
-
-    proc = Popen(command, stdout=PIPE,shell=True)
-
-    source_env = {}
-
-    for line in proc.stdout:
-        (key, _, value) = line.partition("=")
-        source_env[key] = value.rstrip()
-
-    proc.communicate()
-
-    return source_env
+    return read_settings_snapshot(settings_path)
 
 
 def read_pipeline_settings(pipeline_name, pipeline_version):
@@ -813,41 +900,6 @@ def create_file_list(src_dir, glob_patterns):
     return list(set(file_list))
 
 
-def create_parallel_cp_commands(file_list, dst_dir, num_workers, worker_threads, worker_num, worker_queue):
-    "create a parallel cp command"
-
-
-
-    cmds = list()
-    groups = list()
-
-    chunk_size = int(math.ceil(len(file_list)/float(num_workers)))
-
-    if chunk_size == 0:
-        chunk_size = 1
-
-    groups = list(chunks(file_list, chunk_size))
-
-    worker_group = None
-    cmd = None
-    group_length = 0
-
-    if worker_num < len(groups):
-        worker_group = groups[worker_num]
-
-    if worker_group:
-        group_length = len(worker_group)
-        #tempfile.tempdir=tmp_path
-        #with tempfile.NamedTemporaryFile(delete=False) as file_temp:
-        for filename in worker_group:
-            #file_temp.write(filename + "\n")
-            cmd = '/bin/cp -r {} {}'.format(filename,dst_dir)
-            cmd_obj = {'command':cmd,'queue':worker_queue}
-            cmds.append(cmd_obj)
-            #cmd = 'parallel -a ' + file_temp.name + ' -j+' + str(worker_threads) + ' yes | cp {} ' + dst_dir
-
-    return cmds
-
 def check_if_argument_file_exists(argument_value):
     if argument_value:
         if not os.path.exists(argument_value):
@@ -861,93 +913,3 @@ def add_record_argument(record,key_list):
             input_arguments[single_key] = record[single_key]
     return input_arguments
 
-def copy_worker(copy_command_dict):
-    copy_command = copy_command_dict['command']
-    copy_queue = copy_command_dict['queue']
-    copy_process = run_command(shlex.split(copy_command),None,None,False,True)
-    copy_process['command'] = copy_command
-    copy_queue.put(copy_process)
-
-def copy_outputs(params,job_params):
-    "copy output files in toil work dir to the final destination"
-    from track_utils import log, find_unique_name_in_dir, old_jobs_folder, add_file_handler, ROSLIN_COPY_OUTPUTS_LOG
-    work_dir = params['project_work_dir']
-    tmp_dir = params['work_dir']
-    log_path = params['log_folder']
-    debug_mode = params['debug_mode']
-    output_config = params['copy_outputs_config']
-    out_dir = params['results_dir']
-    folder_key = job_params['folder_key']
-    max_workers = job_params['max_workers']
-    worker_num = job_params['worker_num']
-    worker_threads = job_params['worker_threads']
-    job_name = job_params['name']
-    tmp_folder = job_name
-    tmp_path = os.path.join(tmp_dir,tmp_folder)
-    log_folder = log_path
-    if not os.path.exists(tmp_path):
-        os.mkdir(tmp_path)
-    logger = logging.getLogger(job_name)
-    log_file_path = os.path.join(log_folder,ROSLIN_COPY_OUTPUTS_LOG)
-    if debug_mode:
-        logger.setLevel(logging.DEBUG)
-        add_file_handler(logger,log_file_path,None,logging.DEBUG)
-    else:
-        logger.setLevel(logging.INFO)
-        add_file_handler(logger,log_file_path,None,logging.INFO)
-    folder_data = output_config[folder_key]
-    cmd_list = []
-    worker_queue = Queue()
-    worker_pool = Pool(worker_threads)
-    for single_folder_elem in folder_data:
-        file_patterns = single_folder_elem["patterns"]
-        dst_base_dir = os.path.join(out_dir,folder_key)
-        if "input_folder" in single_folder_elem:
-            src_folder = single_folder_elem["input_folder"]
-            src_dir = os.path.join(work_dir,src_folder)
-        else:
-            src_dir = work_dir
-        if "output_folder" in single_folder_elem:
-            dst_folder = single_folder_elem["output_folder"]
-            dst_dir = os.path.join(dst_base_dir,dst_folder)
-        else:
-            dst_dir = dst_base_dir
-        if not os.path.isdir(dst_dir):
-            try:
-                os.makedirs(dst_dir)
-            except:
-                error_message = "Make dir: " + str(dst_dir) + " failed.\n"+traceback.format_exc()
-                log(logger,"error",error_message)
-        file_list = create_file_list(src_dir,file_patterns)
-        single_folder_cmd_list = create_parallel_cp_commands(file_list,dst_dir,max_workers,worker_threads,worker_num,worker_queue)
-        cmd_list.extend(single_folder_cmd_list)
-    group_length = len(cmd_list)
-    copy_info = "[ {} threads: {} ] Copying {} file(s) from {} to {}\n".format(str(job_name),str(worker_threads),str(group_length),src_dir,dst_dir)
-    log(logger,"info",copy_info)
-    if cmd_list:
-        copy_worker(cmd_list[0])
-        try:
-            copy_results = worker_pool.map(copy_worker,cmd_list)
-        except:
-            pass
-        worker_queue.put(None)
-        for single_output in iter(worker_queue.get, None):
-            single_output_errorcode = single_output['errorcode']
-            single_output_command = single_output['command']
-            single_output_str = ""
-            if single_output['output']:
-                single_output_str = single_output['output']
-            if single_output['error']:
-                single_output_str = single_output['error']
-            single_output_id = "[ {} threads: {} ] Command:\n {}\n".format(str(job_name),str(worker_threads),str(single_output_command))
-            if single_output_errorcode != 0:
-                single_output_message = single_output_id + "Failed\n {}".format(str(single_output_str))
-                log(logger,"error",single_output_message)
-                return single_output_errorcode
-            else:
-                if debug_mode:
-                    single_output_message = single_output_id + "Finished\n {}".format(str(single_output_str))
-                    log(logger,"debug",single_output_message)
-        worker_pool.close()
-        worker_pool.join()
-    return 0
@@ -3,15 +3,15 @@
 from __future__ import print_function
 from shutil import copyfile
 import os, sys, glob, uuid, argparse, subprocess
-import hashlib
 import datetime
 import json
-import tarfile
-import base64
 import time
 import re
 import pytz
 import redis
+from checksum_cache import get_sha1_list
+from blob_store import get_blob_store, store_files
+from settings_snapshot import read_settings_snapshot
 
 DOC_VERSION = "1.0.0"
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z%z"
@@ -28,35 +28,16 @@ def get_current_utc_datetime():
     return utc_dt.strftime(DATETIME_FORMAT)
 
 
-def generate_sha1(filename):
-
-    # 64kb chunks
-    buf_size = 65536
-
-    sha1 = hashlib.sha1()
-
-    with open(filename, 'rb') as f:
-        while True:
-            data = f.read(buf_size)
-            if not data:
-                break
-            sha1.update(data)
-
-    return sha1.hexdigest()
-
-
-def targzip_project_files(cmo_project_id, cmo_project_path):
+def store_project_files(cmo_project_path):
 
     files = glob.glob(os.path.join(cmo_project_path, "*"))
-
-    tgz_path = "{}.tgz".format(os.path.join(cmo_project_path, cmo_project_id))
-    tar = tarfile.open(tgz_path, mode="w:gz", dereference=True)
-    for filename in files:
-        tar.add(filename)
-    tar.close()
-
-    with open(tgz_path, "rb") as tgz_file:
-        return base64.b64encode(tgz_file.read())
+    file_paths = [os.path.abspath(filename) for filename in files if os.path.isfile(filename)]
+    blob_store = get_blob_store()
+    file_digests = store_files(file_paths,blob_store)
+    blob_files = []
+    for single_file_path in file_paths:
+        blob_files.append({"name": os.path.basename(single_file_path), "checksum": file_digests[single_file_path]})
+    return {"store": blob_store.location, "files": blob_files}
 
 
 def convert_examples_to_use_abs_path(inputs_yaml_path):
@@ -117,7 +98,11 @@ def construct_project_metadata(cmo_project_id, cmo_project_path, job_uuid):
             or not os.path.isfile(grouping_file) or not os.path.isfile(pairing_file):
         return None
 
-    tgz_blob = targzip_project_files(cmo_project_id, cmo_project_path)
+    # the project files are stored once per content, the doc only keeps their digests
+    blobs = store_project_files(cmo_project_path)
+
+    # unchanged files come from the checksum cache, the rest are hashed in parallel
+    checksums = get_sha1_list([request_file, mapping_file, grouping_file, pairing_file])
 
     project = {
         "version": DOC_VERSION,
@@ -125,22 +110,22 @@ def construct_project_metadata(cmo_project_id, cmo_project_path, job_uuid):
         "pipelineJobId": job_uuid,
         "dateSubmitted": get_current_utc_datetime(),
         "inputFiles": {
-            "blob": tgz_blob,
+            "blobs": blobs,
             "request": {
                 "path": request_file,
-                "checksum": "sha1$" + generate_sha1(request_file)
+                "checksum": "sha1$" + checksums[request_file]
             },
             "mapping": {
                 "path": mapping_file,
-                "checksum": "sha1$" + generate_sha1(mapping_file)
+                "checksum": "sha1$" + checksums[mapping_file]
             },
             "grouping": {
                 "path": grouping_file,
-                "checksum": "sha1$" + generate_sha1(grouping_file)
+                "checksum": "sha1$" + checksums[grouping_file]
             },
             "pairing": {
                 "path": pairing_file,
-                "checksum": "sha1$" + generate_sha1(pairing_file)
+                "checksum": "sha1$" + checksums[pairing_file]
             }
         }
     }
@@ -172,19 +157,7 @@ def read_pipeline_settings(pipeline_name_version):
 
     settings_path = os.path.join(os.environ.get("ROSLIN_CORE_CONFIG_PATH"), pipeline_name_version, "settings.sh")
 
-    command = ['bash', '-c', 'source {} && env'.format(settings_path)]
-
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-
-    source_env = {}
-
-    for line in proc.stdout:
-        (key, _, value) = line.partition("=")
-        source_env[key] = value.rstrip()
-
-    proc.communicate()
-
-    return source_env
+    return read_settings_snapshot(settings_path)
 
 
 def init_project(params):
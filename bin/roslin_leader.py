@@ -2,8 +2,8 @@
 from __future__ import print_function
 import logging
 from toil.common import Toil, safeUnpickleFromStream
-from track_utils import log, ReadOnlyFileJobStore, RoslinTrack, get_current_time, add_stream_handler, add_file_handler, log, get_status_names, update_run_results_status, update_workflow_run_results, add_user_event, update_workflow_params
-from core_utils import read_pipeline_settings, kill_all_lsf_jobs, check_user_kill_signal, starting_log_message, exiting_log_message, finished_log_message, check_if_argument_file_exists, check_tmp_env, load_yaml, get_common_args, get_leader_args, parse_workflow_args, add_specific_args, get_dir_paths
+from track_utils import log, ReadOnlyFileJobStore, RoslinTrack, get_current_time, add_stream_handler, add_file_handler, log, get_status_names, update_run_results_status, update_workflow_run_results, add_user_event, update_workflow_params, flush_mongo_writes, set_mongo_spool, get_tracker_service, OutputPublisher
+from core_utils import read_pipeline_settings, kill_all_lsf_jobs, check_user_kill_signal, starting_log_message, exiting_log_message, finished_log_message, check_if_argument_file_exists, check_tmp_env, load_yaml, get_common_args, get_leader_args, parse_workflow_args, add_specific_args, get_dir_paths, LEADER_DAEMON_FILE_NAME
 from toil.common import Toil
 from toil.job import Job, JobNode
 from toil.leader import FailedJobsException
@@ -18,6 +18,7 @@ import signal
 import copy
 import argparse
 import shutil
+import pickle
 from functools import partial
 from ruamel.yaml import safe_load
 
@@ -27,6 +28,25 @@ running_status = status_name_position['running']
 done_status = status_name_position['done']
 exit_status = status_name_position['exit']
 
+class LeaderControl(object):
+    "asks a leader running in a thread of the leader daemon to stop, its tracker thread then kills the project jobs"
+
+    def __init__(self):
+        self.stop_requested = Event()
+
+    def stop(self):
+        self.stop_requested.set()
+
+class LeaderToil(Toil):
+    "hands the jobs the environment of the project instead of the one of the leader daemon"
+
+    def __init__(self,options,leader_env):
+        Toil.__init__(self,options)
+        self.leader_env = leader_env
+
+    def _serialiseEnv(self):
+        with self._jobStore.writeSharedFileStream("environment.pickle") as env_file:
+            pickle.dump(self.leader_env,env_file,pickle.HIGHEST_PROTOCOL)
 
 def cleanup(clean_up_dict, signal_num, frame):
     logger = clean_up_dict['logger']
@@ -36,10 +56,13 @@ def cleanup(clean_up_dict, signal_num, frame):
         error_message = "Cleanup failed\n"+str(traceback.format_exc())
         log(logger,'error',error_message)
     finally:
+        flush_mongo_writes(logger)
         log(logger,'info',exiting_log_message)
-        exit(1)
+        # a leader in the daemon unwinds once toil gives up on the killed jobs
+        if 'leader_control' not in clean_up_dict:
+            exit(1)
 
-def cleanup_tmp_files(workflow_params):
+def cleanup_tmp_files(logger,workflow_params):
     tmp_dir_path = workflow_params['work_dir']
     tmp_dir_list = os.listdir(tmp_dir_path)
     job_store_dir = workflow_params['tmp_dir']
@@ -78,9 +101,9 @@ def cleanup_helper(clean_up_dict, signal_num, frame):
         clean_workflow.set()
         project_killed_message = ""
         project_killed_event = {}
-        log_dir = workflow_params['log_folder']
-        work_dir = workflow_params['project_work_dir']
-        tmp_dir = workflow_params['tmp_dir']
+        log_dir = workflow.params['log_folder']
+        work_dir = workflow.params['project_work_dir']
+        tmp_dir = workflow.params['tmp_dir']
         dir_paths = (log_dir,work_dir,tmp_dir)
         user_kill_signal = check_user_kill_signal(workflow.params['project_id'], workflow.params['job_uuid'], workflow.params['pipeline_name'], workflow.params['pipeline_version'], dir_paths=dir_paths)
         if user_kill_signal and 'user_kill_signal' not in clean_up_dict:
@@ -100,26 +123,29 @@ def cleanup_helper(clean_up_dict, signal_num, frame):
             project_killed_event = {"killed_by": "batch_system", "batch_system": batch_system}
         add_user_event(logger,uuid,project_killed_event,"killed")
         log(logger,"info",project_killed_message)
-        batch_system_obj = toil_obj._batchSystem
-        if batch_system_obj:
-            issued_jobs = batch_system_obj.getIssuedBatchJobIDs()
-            job_dict = {}
-            if hasattr(batch_system_obj,'jobs'):
-                job_dict = batch_system_obj.jobs
-            if hasattr(batch_system_obj,'currentJobs'):
-                job_dict = batch_system_obj.currentJobs
-            for single_issued_job in issued_jobs:
-                job_killed_message = "Killing toil job: " + str(single_issued_job)
-                if isinstance(job_dict,dict):
-                    if single_issued_job in job_dict:
-                        job_str = job_dict[single_issued_job]
-                        job_name = job_str.split(" ")[1]
-                        job_killed_message = job_killed_message + " ( " + str(job_name) + " ) "
-                log(logger,"info",job_killed_message)
-            batch_system_obj.killBatchJobs(issued_jobs)
+        kill_issued_jobs(logger,toil_obj)
         if batch_system == 'LSF':
             kill_all_lsf_jobs(logger,uuid)
 
+def kill_issued_jobs(logger,toil_obj):
+    batch_system_obj = toil_obj._batchSystem
+    if batch_system_obj:
+        issued_jobs = batch_system_obj.getIssuedBatchJobIDs()
+        job_dict = {}
+        if hasattr(batch_system_obj,'jobs'):
+            job_dict = batch_system_obj.jobs
+        if hasattr(batch_system_obj,'currentJobs'):
+            job_dict = batch_system_obj.currentJobs
+        for single_issued_job in issued_jobs:
+            job_killed_message = "Killing toil job: " + str(single_issued_job)
+            if isinstance(job_dict,dict):
+                if single_issued_job in job_dict:
+                    job_str = job_dict[single_issued_job]
+                    job_name = job_str.split(" ")[1]
+                    job_killed_message = job_killed_message + " ( " + str(job_name) + " ) "
+            log(logger,"info",job_killed_message)
+        batch_system_obj.killBatchJobs(issued_jobs)
+
 def read_file(file_path, file_position):
     if os.path.exists(file_path):
         with open(file_path) as file_obj:
@@ -163,7 +189,7 @@ def workflow_transition(logger,roslin_workflow,job_uuid,status):
         roslin_workflow.on_success(logger)
         roslin_workflow.on_complete(logger)
         log(logger,'info',"Cleaning up tmp files")
-        cleanup_tmp_files(roslin_workflow.params)
+        cleanup_tmp_files(logger,roslin_workflow.params)
         log_workflow_output(logger,roslin_workflow,job_uuid)
         log(logger,'info',finished_log_message)
     if status == exit_status:
@@ -174,7 +200,7 @@ def workflow_transition(logger,roslin_workflow,job_uuid,status):
         log(logger,'info',exiting_log_message)
 
 
-def roslin_track(logger,toil_obj,track_leader,job_store_path,job_uuid,clean_up_dict,roslin_workflow,work_dir,tmp_dir):
+def roslin_track(logger,logger_file_monitor,toil_obj,track_leader,job_store_path,job_uuid,clean_up_dict,roslin_workflow,work_dir,tmp_dir,restart):
 
     def modify_restarted_logging(retry_jobs,log_message,job_name):
         if job_name in retry_jobs:
@@ -188,6 +214,8 @@ def roslin_track(logger,toil_obj,track_leader,job_store_path,job_uuid,clean_up_d
     workflow_log_file = workflow_params['log_file']
     run_attempt = int(workflow_params['run_attempt'])
     roslin_track = RoslinTrack(job_store_path,job_uuid,work_dir,tmp_dir,restart,run_attempt,True,logger)
+    tracker_service = get_tracker_service()
+    tracker_registration = None
     #job_store_obj = ReadOnlyFileJobStore(job_store_path)
     leader_job_id = ""
     job_list = []
@@ -197,7 +225,6 @@ def roslin_track(logger,toil_obj,track_leader,job_store_path,job_uuid,clean_up_d
     retry_jobs = []
     log_file_positon = 0
     started = False
-    job_status = {}
     while track_leader.is_set():
         if toil_obj._batchSystem:
             log_dir = workflow_params['log_folder']
@@ -209,36 +236,62 @@ def roslin_track(logger,toil_obj,track_leader,job_store_path,job_uuid,clean_up_d
                 clean_up_dict['user_kill_signal'] = user_kill_signal
                 if 'error_message' in clean_up_dict['user_kill_signal'] and clean_up_dict['user_kill_signal']['error_message'] != None:
                     cleanup(clean_up_dict,None,None)
-            new_job_status = roslin_track.check_status_change(job_status,track_leader)
-            if new_job_status:
-                job_status = copy.deepcopy(new_job_status)
-                if not started:
-                    workflow_transition(logger,roslin_workflow,job_uuid,running_status)
-                    started = True
+                elif 'leader_control' in clean_up_dict:
+                    # a leader in the daemon has no pid to signal, the termination file is the kill signal
+                    clean_up_dict['leader_control'].stop()
+            if 'leader_control' in clean_up_dict and clean_up_dict['leader_control'].stop_requested.is_set():
+                if not clean_up_dict['clean_workflow'].is_set():
+                    cleanup(clean_up_dict,signal.SIGTERM,None)
+                else:
+                    # toil retries the killed jobs, keep killing them until its leader loop fails and returns
+                    kill_issued_jobs(logger,toil_obj)
+            if not tracker_registration:
+                tracker_registration = tracker_service.register(roslin_track,1,track_leader)
+            if tracker_registration.jobs and not started:
+                workflow_transition(logger,roslin_workflow,job_uuid,running_status)
+                started = True
             log_obj = read_file(workflow_log_file,log_file_positon)
             log_file_positon = log_obj['position']
             log_contents = log_obj['contents'].rstrip()
             if log_contents:
                 log(logger_file_monitor,'info',log_contents)
             time.sleep(1)
+    if tracker_registration:
+        tracker_service.unregister(tracker_registration)
+    else:
+        roslin_track.close()
 
-if __name__ == "__main__":
+def add_leader_handler(logger,leader_log_path,log_format,logging_level):
+    if leader_log_path:
+        add_file_handler(logger,leader_log_path,log_format,logging_level)
+    else:
+        add_stream_handler(logger,log_format,logging_level)
+
+def run_leader(argv,leader_env=None,leader_control=None,leader_log_path=None):
+    "run the leader of a project, returns its exit code"
     parser = Job.Runner.getDefaultArgumentParser()
     parser_project_options = parser.add_argument_group("Roslin project options","Project options")
     common_requirements_list = get_common_args()
     leader_requirements_list = get_leader_args()
     parser_project_options = add_specific_args(parser_project_options,common_requirements_list)
     parser_project_options = add_specific_args(parser_project_options,leader_requirements_list)
-    options, other_options = parser.parse_known_args()
+    options, other_options = parser.parse_known_args(argv)
     pipeline_name = options.pipeline_name
     pipeline_version = options.pipeline_version
     log_folder = options.log_folder
     project_tmpdir = options.project_tmpdir
     project_workdir = options.project_workdir
-    logger = logging.getLogger("roslin_leader")
-    logger_file_monitor = logging.getLogger("roslin_leader_monitor")
+    if leader_control:
+        # the leaders of the daemon share its mongo spool and log to their own project
+        logger = logging.getLogger("roslin_leader." + options.project_uuid)
+        logger_file_monitor = logging.getLogger("roslin_leader_monitor." + options.project_uuid)
+    else:
+        logger = logging.getLogger("roslin_leader")
+        logger_file_monitor = logging.getLogger("roslin_leader_monitor")
+        set_mongo_spool(logger,log_folder)
     pipeline_settings = read_pipeline_settings(pipeline_name, pipeline_version)
-    sys.path.append(pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'])
+    if pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'] not in sys.path:
+        sys.path.append(pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'])
     check_tmp_env(logger)
     import roslin_workflows
     roslin_workflow_class = getattr(roslin_workflows,options.workflow_name)
@@ -247,14 +300,14 @@ if __name__ == "__main__":
     requirements_obj = roslin_workflow.add_requirement(workflow_parser)
     if requirements_obj:
         workflow_parser, requirements_list = requirements_obj
-        workflow_params = workflow_parser.parse_args()
+        workflow_params = workflow_parser.parse_args(argv)
         requirements_dict = parse_workflow_args(workflow_params,requirements_list)
         options = workflow_params
     job_store = options.jobStore
     if options.debug_mode:
         logger.setLevel(logging.DEBUG)
-        add_stream_handler(logger,None,logging.DEBUG)
-        add_stream_handler(logger_file_monitor,"%(message)s",logging.DEBUG)
+        add_leader_handler(logger,leader_log_path,None,logging.DEBUG)
+        add_leader_handler(logger_file_monitor,leader_log_path,"%(message)s",logging.DEBUG)
         log(logger,"debug","Options:\n")
         log(logger,"debug",options)
         log(logger,"debug","Extra options:\n")
@@ -263,8 +316,8 @@ if __name__ == "__main__":
         log(logger,"debug",requirements_dict)
     else:
         logger.setLevel(logging.INFO)
-        add_stream_handler(logger,None,logging.INFO)
-        add_stream_handler(logger_file_monitor,"%(message)s",logging.INFO)
+        add_leader_handler(logger,leader_log_path,None,logging.INFO)
+        add_leader_handler(logger_file_monitor,leader_log_path,"%(message)s",logging.INFO)
     track_leader = Event()
     clean_workflow = Event()
     clean_workflow.clear()
@@ -281,17 +334,27 @@ if __name__ == "__main__":
     process_pid = str(os.getpid())
     work_dir = os.path.abspath(os.path.join(options.project_output,os.pardir))
     pid_file_path = os.path.join(work_dir,'pid')
-    with open(pid_file_path,"w") as pid_file:
-        pid_file.write(process_pid)
+    leader_daemon_path = os.path.join(work_dir,LEADER_DAEMON_FILE_NAME)
+    if leader_control:
+        # roslin_kill_project must not signal the daemon, the leader reads the termination file instead
+        if os.path.exists(pid_file_path):
+            os.remove(pid_file_path)
+        with open(leader_daemon_path,"w") as leader_daemon_file:
+            leader_daemon_file.write(process_pid)
+    else:
+        if os.path.exists(leader_daemon_path):
+            os.remove(leader_daemon_path)
+        with open(pid_file_path,"w") as pid_file:
+            pid_file.write(process_pid)
     if 'file:' in job_store:
         job_store = job_store.replace('file:','')
         restart = options.restart
     else:
         log(logger,"error","Only file jobstores are supported")
-        exit(1)
+        return 1
     if os.path.exists(job_store) and not restart:
         log(logger,"error","The jobstore already exists, please remove or restart")
-        exit(1)
+        return 1
     options.batchSystem = options.batch_system
     options.retryCount = options.retry_count
     options.workDir = project_workdir
@@ -306,11 +369,19 @@ if __name__ == "__main__":
         cwl_batch_system = options.cwl_batch_system
     else:
         cwl_batch_system = options.batch_system
+    if leader_env is None:
+        leader_env = os.environ
+    else:
+        leader_env = dict(leader_env)
     if options.use_docker:
-        os.environ['ROSLIN_USE_DOCKER'] = "True"
+        leader_env['ROSLIN_USE_DOCKER'] = "True"
     if options.docker_registry:
-        os.environ['DOCKER_REGISTRY_NAME'] = options.docker_registry
-    with Toil(options) as toil_obj:
+        leader_env['DOCKER_REGISTRY_NAME'] = options.docker_registry
+    if leader_control:
+        leader_toil = LeaderToil(options,dict(leader_env))
+    else:
+        leader_toil = Toil(options)
+    with leader_toil as toil_obj:
         workflow_failed = False
         workflow_params = {}
         workflow_params_path = os.path.join(project_workdir,"workflow_params.json")
@@ -319,14 +390,20 @@ if __name__ == "__main__":
                 workflow_params = json.load(workflow_params_file)
             workflow_params['restart'] = True
         else:
-            workflow_params = {'project_id':options.project_id, 'job_uuid':options.project_uuid, 'pipeline_name':options.pipeline_name, 'pipeline_version':options.pipeline_version, 'batch_system':cwl_batch_system, 'jobstore':options.jobstore_uuid, 'restart':restart, 'debug_mode':options.debug_mode, 'output_dir':options.project_output, 'tmp_dir':project_tmpdir, 'workflow_name':options.workflow_name, 'input_yaml':options.inputs_yaml,'log_folder':options.log_folder, 'run_attempt':run_attempt, 'work_dir':project_workdir,'test_mode':options.test_mode,'num_pairs':num_pairs,'num_groups':num_groups, 'project_work_dir':work_dir, 'results_dir':options.project_results, 'force_overwrite_results':options.force_overwrite_results, 'inputs': input_yaml_data, 'workflow_params_path': workflow_params_path, 'on_start': options.on_start, 'on_complete': options.on_complete, 'on_fail': options.on_fail, 'on_success': options.on_success, 'env':dict(os.environ), 'max_mem': max_mem, 'max_cpu':max_cpu}
+            workflow_params = {'project_id':options.project_id, 'job_uuid':options.project_uuid, 'pipeline_name':options.pipeline_name, 'pipeline_version':options.pipeline_version, 'batch_system':cwl_batch_system, 'jobstore':options.jobstore_uuid, 'restart':restart, 'debug_mode':options.debug_mode, 'output_dir':options.project_output, 'tmp_dir':project_tmpdir, 'workflow_name':options.workflow_name, 'input_yaml':options.inputs_yaml,'log_folder':options.log_folder, 'run_attempt':run_attempt, 'work_dir':project_workdir,'test_mode':options.test_mode,'num_pairs':num_pairs,'num_groups':num_groups, 'project_work_dir':work_dir, 'results_dir':options.project_results, 'force_overwrite_results':options.force_overwrite_results, 'results_publish_mode':options.results_publish_mode, 'inputs': input_yaml_data, 'workflow_params_path': workflow_params_path, 'on_start': options.on_start, 'on_complete': options.on_complete, 'on_fail': options.on_fail, 'on_success': options.on_success, 'env':dict(leader_env), 'max_mem': max_mem, 'max_cpu':max_cpu}
             workflow_params = add_version_str(workflow_params)
             workflow_params['requirements'] = requirements_dict
+        if leader_control:
+            # projects running the same workflow in the daemon each get their own workflow log
+            workflow_params['logger_name'] = workflow_params['workflow_name'] + "." + options.project_uuid
         roslin_workflow = roslin_workflow_class(workflow_params)
         clean_up_dict = {'logger':logger,'toil_obj':toil_obj,'track_leader':track_leader,'clean_workflow':clean_workflow,'batch_system':options.batch_system,'uuid':options.project_uuid,'workflow':roslin_workflow}
-        signal.signal(signal.SIGINT, partial(cleanup, clean_up_dict))
-        signal.signal(signal.SIGTERM, partial(cleanup, clean_up_dict))
-        roslin_track = Thread(target=roslin_track, args=([logger, toil_obj, track_leader, job_store, options.project_uuid, clean_up_dict, roslin_workflow, project_workdir, project_tmpdir]))
+        if leader_control:
+            clean_up_dict['leader_control'] = leader_control
+        else:
+            signal.signal(signal.SIGINT, partial(cleanup, clean_up_dict))
+            signal.signal(signal.SIGTERM, partial(cleanup, clean_up_dict))
+        roslin_track_thread = Thread(target=roslin_track, args=([logger, logger_file_monitor, toil_obj, track_leader, job_store, options.project_uuid, clean_up_dict, roslin_workflow, project_workdir, project_tmpdir, restart]))
         roslin_job = roslin_workflow.run_pipeline()
         roslin_workflow_params = copy.deepcopy(roslin_workflow.params)
         del roslin_workflow_params['requirement_list']
@@ -335,10 +412,18 @@ if __name__ == "__main__":
             json.dump(roslin_workflow_params,workflow_params_file, default=lambda x: None)
         update_workflow_params(logger,options.project_uuid,roslin_workflow_params)
         update_run_results_status(logger,options.project_uuid,pending_status)
+        output_publisher = None
+        if roslin_workflow.params.get('publish_outputs'):
+            output_publisher = OutputPublisher(roslin_workflow.params,logger)
         try:
             track_leader.set()
-            roslin_track.start()
-            if restart:
+            roslin_track_thread.start()
+            if output_publisher:
+                output_publisher.start()
+            if leader_control and leader_control.stop_requested.is_set():
+                workflow_failed = True
+                log(logger,"info","The project was killed before its workflow started")
+            elif restart:
                 toil_obj.restart()
             else:
                 toil_obj.start(roslin_job)
@@ -347,10 +432,25 @@ if __name__ == "__main__":
             log(logger,"error","Workflow failed\n"+str(traceback.format_exc()))
         finally:
             track_leader.clear()
-            roslin_track.join()
+            roslin_track_thread.join()
+            if output_publisher:
+                log(logger,"info","Publishing the remaining outputs to " + str(options.project_results))
+                if output_publisher.stop() and not workflow_failed:
+                    log(logger,"error","Workflow outputs could not be published")
+                    workflow_failed = True
+            if not workflow_failed:
+                analysis_errorcode = roslin_workflow.run_analysis(logger)
+                if analysis_errorcode != 0:
+                    log(logger,"error","Roslin analysis failed with errorcode " + str(analysis_errorcode))
+                    workflow_failed = True
             if workflow_failed:
                 workflow_transition(logger,roslin_workflow,options.project_uuid,exit_status)
-                exit(1)
+                flush_mongo_writes(logger)
+                return 1
             else:
                 workflow_transition(logger,roslin_workflow,options.project_uuid,done_status)
-                exit(0)
\ No newline at end of file
+                flush_mongo_writes(logger)
+                return 0
+
+if __name__ == "__main__":
+    exit(run_leader(sys.argv[1:]))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import json
+import glob
+import signal
+import logging
+import argparse
+import traceback
+from threading import Thread, Event
+from functools import partial
+from track_utils import log, add_stream_handler, set_mongo_spool, flush_mongo_writes
+from core_utils import read_pipeline_settings, print_error, get_secret_env
+from roslin_leader import run_leader, LeaderControl
+
+LEADER_DAEMON_POLL_INTERVAL = 5
+LEADER_DAEMON_FAILED_DIR_NAME = "failed"
+
+# The leader daemon runs the leaders of many projects in one process, one thread
+# per project. roslin_submit.py and roslin_restart.py hand their leader command to
+# it through a spool directory ( ROSLIN_LEADER_DAEMON ), the projects share the
+# tracker service, the mongo writer and the settings caches of the daemon.
+# roslin_kill_project.py kills a single project through its termination file.
+# Only submissions written by the user running the daemon are run, and the
+# secrets of the environment ( e.g. ROSLIN_MONGO_PASSWORD ) come from the daemon.
+
+class ProjectLeader(Thread):
+
+    def __init__(self,submission,logger):
+        Thread.__init__(self,name="roslin_leader-" + submission['project_uuid'])
+        self.submission = submission
+        self.project_uuid = submission['project_uuid']
+        self.logger = logger
+        self.leader_control = LeaderControl()
+        self.exit_code = None
+
+    def run(self):
+        submission = self.submission
+        # same as the leader process, which gets fresh stdout and stderr logs
+        for single_log_path in [submission['stdout'], submission['stderr']]:
+            open(single_log_path,'w').close()
+        leader_env = dict(submission['env'])
+        leader_env.update(get_secret_env(os.environ))
+        try:
+            self.exit_code = run_leader(submission['leader_args'],leader_env,self.leader_control,submission['stderr'])
+        except SystemExit as leader_exit:
+            # argparse exits on invalid leader arguments
+            self.exit_code = leader_exit.code
+        except:
+            self.exit_code = 1
+            log(self.logger,"error","Leader of project " + self.project_uuid + " failed\n" + traceback.format_exc())
+        finally:
+            close_project_loggers(self.project_uuid)
+        log(self.logger,"info","Leader of project " + self.project_uuid + " exited with code " + str(self.exit_code))
+
+    def kill(self):
+        self.leader_control.stop()
+
+def close_project_loggers(project_uuid):
+    "the daemon outlives its projects, close their log files"
+    logger_suffix = "." + project_uuid
+    logger_dict = logging.Logger.manager.loggerDict
+    for single_logger_name in list(logger_dict.keys()):
+        if single_logger_name.endswith(logger_suffix):
+            single_logger = logger_dict[single_logger_name]
+            for single_handler in list(getattr(single_logger,'handlers',[])):
+                single_logger.removeHandler(single_handler)
+                single_handler.close()
+
+def get_spooled_submissions(spool_dir):
+    submission_list = glob.glob(os.path.join(spool_dir,"*.json"))
+    return sorted(submission_list, key=os.path.getmtime)
+
+def claim_submission(submission_path):
+    claimed_path = submission_path + ".claimed"
+    try:
+        os.rename(submission_path,claimed_path)
+    except OSError:
+        # claimed by another daemon on the same spool
+        return None
+    return claimed_path
+
+def reject_submission(logger,spool_dir,claimed_path,error_message):
+    log(logger,"error",error_message)
+    failed_dir = os.path.join(spool_dir,LEADER_DAEMON_FAILED_DIR_NAME)
+    if not os.path.exists(failed_dir):
+        os.mkdir(failed_dir,0o700)
+    failed_path = os.path.join(failed_dir,os.path.basename(claimed_path)[:-len(".claimed")])
+    os.rename(claimed_path,failed_path)
+
+def start_project_leader(logger,spool_dir,submission_path,pipeline_name,pipeline_version,project_leaders):
+    claimed_path = claim_submission(submission_path)
+    if not claimed_path:
+        return None
+    try:
+        submission_fd = os.open(claimed_path,os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        reject_submission(logger,spool_dir,claimed_path,"Could not open submission " + submission_path + "\n" + traceback.format_exc())
+        return None
+    with os.fdopen(submission_fd) as submission_file:
+        submission_stat = os.fstat(submission_file.fileno())
+        if submission_stat.st_uid != os.getuid():
+            # the submission runs as the daemon user, only that user may write one
+            reject_submission(logger,spool_dir,claimed_path,"Submission " + submission_path + " is owned by uid " + str(submission_stat.st_uid) + ", not by the daemon user")
+            return None
+        submission_data = submission_file.read()
+    try:
+        submission = json.loads(submission_data)
+        project_uuid = submission['project_uuid']
+        submission_pipeline = (submission['pipeline_name'],submission['pipeline_version'])
+    except (ValueError, KeyError):
+        reject_submission(logger,spool_dir,claimed_path,"Invalid submission " + submission_path + "\n" + traceback.format_exc())
+        return None
+    if submission_pipeline != (pipeline_name,pipeline_version):
+        reject_submission(logger,spool_dir,claimed_path,"Project " + project_uuid + " is for " + "/".join(submission_pipeline) + ", this daemon runs " + pipeline_name + "/" + pipeline_version)
+        return None
+    if project_uuid in project_leaders:
+        reject_submission(logger,spool_dir,claimed_path,"Project " + project_uuid + " is already running, restart it once it has exited")
+        return None
+    os.remove(claimed_path)
+    project_leader = ProjectLeader(submission,logger)
+    project_leader.start()
+    log(logger,"info","Started the leader of project " + project_uuid)
+    return project_leader
+
+def stop_leader_daemon(stop_daemon, signal_num, frame):
+    stop_daemon.set()
+
+def main():
+    "main function"
+
+    parser = argparse.ArgumentParser(description='roslin leader daemon, runs the leaders of the projects in its spool directory')
+
+    parser.add_argument(
+        "--name",
+        action="store",
+        dest="pipeline_name",
+        help="Pipeline name (e.g. variant)",
+        required=True
+    )
+
+    parser.add_argument(
+        "--version",
+        action="store",
+        dest="pipeline_version",
+        help="Pipeline version (e.g. 2.5.0)",
+        required=True
+    )
+
+    parser.add_argument(
+        "--spool",
+        action="store",
+        dest="spool_dir",
+        help="The directory projects are submitted to, set ROSLIN_LEADER_DAEMON to it when submitting",
+        required=True
+    )
+
+    parser.add_argument(
+        "--max-projects",
+        action="store",
+        dest="max_projects",
+        type=int,
+        help="The maximum number of projects running at the same time, the others wait in the spool directory",
+        required=False
+    )
+
+    options = parser.parse_args()
+    pipeline_name = options.pipeline_name
+    pipeline_version = options.pipeline_version
+    if not read_pipeline_settings(pipeline_name, pipeline_version):
+        print_error("Error "+ str(pipeline_name) + " version "+ str(pipeline_version) + " does not exist.")
+        sys.exit(1)
+    logger = logging.getLogger("roslin_leader_daemon")
+    logger.setLevel(logging.INFO)
+    add_stream_handler(logger,None,logging.INFO)
+    spool_dir = os.path.abspath(options.spool_dir)
+    if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir,0o700)
+    spool_stat = os.stat(spool_dir)
+    if spool_stat.st_uid != os.getuid() or spool_stat.st_mode & 0o077:
+        print_error("Error the spool directory " + spool_dir + " must be owned by the daemon user and only accessible to it ( chmod 700 )")
+        sys.exit(1)
+    set_mongo_spool(logger,spool_dir)
+    stop_daemon = Event()
+    signal.signal(signal.SIGINT, partial(stop_leader_daemon, stop_daemon))
+    signal.signal(signal.SIGTERM, partial(stop_leader_daemon, stop_daemon))
+    log(logger,"info","Leader daemon for " + pipeline_name + "/" + pipeline_version + " is watching " + spool_dir)
+    project_leaders = {}
+    while not stop_daemon.is_set():
+        for project_uuid in list(project_leaders.keys()):
+            if not project_leaders[project_uuid].is_alive():
+                del project_leaders[project_uuid]
+        for submission_path in get_spooled_submissions(spool_dir):
+            if options.max_projects and len(project_leaders) >= options.max_projects:
+                break
+            project_leader = start_project_leader(logger,spool_dir,submission_path,pipeline_name,pipeline_version,project_leaders)
+            if project_leader:
+                project_leaders[project_leader.project_uuid] = project_leader
+        stop_daemon.wait(LEADER_DAEMON_POLL_INTERVAL)
+    log(logger,"info","Stopping the leader daemon, killing " + str(len(project_leaders)) + " running project(s)")
+    for project_leader in project_leaders.values():
+        try:
+            project_leader.kill()
+        except:
+            log(logger,"error","Could not kill project " + project_leader.project_uuid + "\n" + traceback.format_exc())
+    for project_leader in project_leaders.values():
+        project_leader.join()
+    flush_mongo_writes(logger)
+
+if __name__ == "__main__":
+
+    main()
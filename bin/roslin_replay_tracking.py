@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import logging
+import argparse
+from core_utils import print_error
+from track_utils import replay_mongo_spool, spool_has_updates, add_stream_handler, MONGO_SPOOL_FILE_NAME, MONGO_SPOOL_FAILED_SUFFIX, ConnectionFailure, get_tracking_backend
+
+
+def main():
+    "main function"
+
+    parser = argparse.ArgumentParser(description='roslin replay tracking updates spooled while mongo was unreachable', add_help=False)
+
+    parser.add_argument(
+        "--log-dir",
+        action="store",
+        dest="log_dir",
+        help="The log directory of the project (e.g. /juno/work/pi/Proj_5088_B/<uuid>/log)",
+        required=True
+    )
+
+    options = parser.parse_args()
+    spool_path = os.path.join(options.log_dir,MONGO_SPOOL_FILE_NAME)
+    if not get_tracking_backend():
+        print_error("ERROR: Tracking is disabled, unset ROSLIN_MONGO_DISABLE to replay " + spool_path)
+        sys.exit(1)
+    if not spool_has_updates(spool_path):
+        print("No spooled tracking updates found in " + spool_path)
+        return
+    logger = logging.getLogger("roslin_replay_tracking")
+    logger.setLevel(logging.INFO)
+    add_stream_handler(logger,None,logging.INFO)
+    try:
+        replayed_updates = replay_mongo_spool(logger,spool_path)
+    except ConnectionFailure:
+        print_error("ERROR: Could not connect to the tracking database, the spooled updates are kept in " + spool_path)
+        sys.exit(1)
+    print("Replayed " + str(replayed_updates) + " tracking update(s) from " + spool_path)
+    failed_path = spool_path + MONGO_SPOOL_FAILED_SUFFIX
+    if spool_has_updates(failed_path):
+        print("Some tracking updates were rejected and are kept in " + failed_path + ", move them back to " + spool_path + " once the cause is fixed to replay them")
+
+if __name__ == "__main__":
+
+    main()
@@ -10,17 +10,12 @@ import uuid
 import json
 import subprocess
 from collections import defaultdict
+from settings_snapshot import read_settings_snapshot
 
 def read_pipeline_settings(pipeline_name_version):
     "read the Roslin Pipeline settings"
     settings_path = os.path.join(os.environ.get("ROSLIN_CORE_CONFIG_PATH"), pipeline_name_version, "settings.sh")
-    command = ['bash', '-c', 'source {} && env'.format(settings_path)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    source_env = {}
-    for line in proc.stdout:
-        (key, _, value) = line.partition("=")
-        source_env[key] = value.rstrip()
-    proc.communicate()
+    source_env = read_settings_snapshot(settings_path)
     roslin_pipeline_resource_path = source_env['ROSLIN_PIPELINE_RESOURCE_PATH']
     roslin_virtualenv_path = os.path.join(roslin_pipeline_resource_path,"virtualenv","bin","activate_this.py")
     execfile(roslin_virtualenv_path, dict(__file__=roslin_virtualenv_path))
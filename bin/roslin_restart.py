@@ -4,7 +4,7 @@ import os, sys
 import logging
 import argparse
 import json
-from roslin_submit import  JOBSTORE_UUID_FILE_NAME, INPUT_YAML_FILE_NAME, WORKFLOW_PARAMS_FILE_NAME, submit, get_pipeline_name_and_versions, get_input_metadata, targzip_project_files
+from roslin_submit import  JOBSTORE_UUID_FILE_NAME, INPUT_YAML_FILE_NAME, WORKFLOW_PARAMS_FILE_NAME, submit, get_pipeline_name_and_versions, get_input_metadata, store_project_files
 
 if 'ROSLIN_CORE_BIN_PATH' not in os.environ:
     print("Roslin core settings not loaded")
@@ -130,7 +130,7 @@ def main():
         os.rename(inputs_yaml_work_dir,input_yaml_path)
 
     if project_path:
-        input_files_blob = targzip_project_files(project_id, project_path)
+        input_files_blob = store_project_files(project_id, project_path, pipeline_settings)
 
     requirements_list = []
     for single_workflow in workflow_params_data['workflows']:
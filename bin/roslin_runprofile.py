@@ -2,13 +2,15 @@
 
 import os
 import subprocess
-import hashlib
 import json
 import argparse
 import re
 import ruamel.yaml
 import redis
 import logging
+from multiprocessing.dummy import Pool
+from checksum_cache import get_sha1, get_sha1_list, read_json_cache, update_json_cache
+from settings_snapshot import read_settings_snapshot
 
 
 logger = logging.getLogger("roslin_runprofile")
@@ -30,6 +32,25 @@ DOC_VERSION = "1.0.0"
 IMG_METADATA_CACHE = {}
 CWL_METADATA_CACHE = {}
 
+# image metadata shared by all projects and pipeline versions
+IMG_METADATA_CACHE_FILE_NAME = "roslin_img_metadata_cache.json"
+IMG_METADATA_MAX_WORKERS = 8
+
+# reference files that get a checksum in the run profile
+REFERENCE_DB_FILES = [
+    "hapmap", "dbsnp", "indels_1000g", "snps_1000g", "cosmic",
+    "refseq", "hotspot_list", "exac_filter"
+]
+
+CWLTOIL_LOG_CHECKPOINT_SUFFIX = ".runprofile.checkpoint"
+CWLTOIL_LOG_CHECKPOINT_VERSION = 1
+CWLTOIL_LOG_MAX_RECORD_LINES = 10000
+
+TOIL_LOG_LEVEL_REGEX = re.compile(r"'toil' logger at level '(.*?)'")
+INFO_ISSUED_JOB_REGEX = re.compile(r"Issued job '(.*?)'.*(\w\/\w\/job\w{6})")
+DEBUG_JOB_START_REGEX = re.compile(r"INFO:cwltool:(\[job .*?\])")
+DEBUG_JOB_END_REGEX = re.compile(r"\w    [\w\[]")
+
 
 def item(path, version, checksum_method, checksum_value):
 
@@ -70,7 +91,7 @@ def get_references(inputs_yaml_path):
         ruamel.yaml.RoundTripLoader
     )
 
-    if "runparms" not in yaml or "db_files" not in yaml:
+    if "runparams" not in yaml or "db_files" not in yaml:
         return {}
 
     runparams = yaml["runparams"]
@@ -79,68 +100,16 @@ def get_references(inputs_yaml_path):
     if "genome" in runparams:
         references["genome"] = runparams["genome"]
 
-    if "hapmap" in db_files:
-        references["hapmap"] = item(
-            path=db_files["hapmap"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["hapmap"]["path"])
-        )
-
-    if "dbsnp" in db_files:
-        references["dbsnp"] = item(
-            path=db_files["dbsnp"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["dbsnp"]["path"])
-        )
-
-    if "indels_1000g" in db_files:
-        references["indels_1000g"] = item(
-            path=db_files["indels_1000g"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["indels_1000g"]["path"])
-        )
-
-    if "snps_1000g" in db_files:
-        references["snps_1000g"] = item(
-            path=db_files["snps_1000g"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["snps_1000g"]["path"])
-        )
-
-    if "cosmic" in db_files:
-        references["cosmic"] = item(
-            path=db_files["cosmic"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["cosmic"]["path"])
-        )
-
-    if "refseq" in db_files:
-        references["refseq"] = item(
-            path=db_files["refseq"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["refseq"]["path"])
-        )
-
-    if "hotspot_list" in db_files:
-        references["hotspot_list"] = item(
-            path=db_files["hotspot_list"]["path"],
-            version="x.y.z",
-            checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["hotspot_list"]["path"])
-        )
+    # hash all the references at once, unchanged files come from the checksum cache
+    reference_list = [name for name in REFERENCE_DB_FILES if name in db_files]
+    checksums = get_sha1_list([db_files[name]["path"] for name in reference_list])
 
-    if "exac_filter" in db_files:
-        references["exac_filter"] = item(
-            path=db_files["exac_filter"]["path"],
+    for name in reference_list:
+        references[name] = item(
+            path=db_files[name]["path"],
             version="x.y.z",
             checksum_method="sha1",
-            checksum_value=generate_sha1(db_files["exac_filter"]["path"])
+            checksum_value=checksums[db_files[name]["path"]]
         )
 
     if "vep_data" in db_files:
@@ -169,42 +138,17 @@ def run(cmd, shell=False, strip_newline=True):
     return stdout, stderr, process.returncode
 
 
-# fixme: common.lib
 def generate_sha1(filename):
-    "generate SHA1 hash out of file"
-
-    # 64kb chunks
-    buf_size = 65536
-
-    sha1 = hashlib.sha1()
-
-    with open(filename, 'rb') as f:
-        while True:
-            data = f.read(buf_size)
-            if not data:
-                break
-            sha1.update(data)
+    "generate SHA1 hash out of file, unchanged files come from the checksum cache"
 
-    return sha1.hexdigest()
+    return get_sha1(filename)
 
 
 # fixme: common.lib
 def read_pipeline_settings(settings_path):
     "read the Roslin Pipeline settings"
 
-    command = ['bash', '-c', 'source {} && env'.format(settings_path)]
-
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-
-    source_env = {}
-
-    for line in proc.stdout:
-        (key, _, value) = line.partition("=")
-        source_env[key] = value.rstrip()
-
-    proc.communicate()
-
-    return source_env
+    return read_settings_snapshot(settings_path)
 
 
 def get_singularity_info(pipeline_settings):
@@ -379,6 +323,116 @@ def get_img_metadata(pipeline_settings_path, sing_cmdline):
     return out
 
 
+def get_img_path(pipeline_settings, sing_cmdline):
+    "get the path of the singularity image that sing.sh runs for a command-line"
+
+    sing_args = sing_cmdline.split()
+    bin_path = pipeline_settings.get("ROSLIN_PIPELINE_BIN_PATH")
+
+    if len(sing_args) < 3 or not bin_path:
+        return None
+
+    # same layout as sing.sh
+    tool_name = sing_args[1]
+    tool_version = sing_args[2]
+
+    return os.path.join(bin_path, "img", tool_name, tool_version, tool_name + ".sif")
+
+
+def get_img_metadata_cache_path():
+    "get the path of the on-disk image metadata cache"
+
+    config_path = os.environ.get("ROSLIN_CORE_CONFIG_PATH")
+
+    if not config_path:
+        return None
+
+    return os.path.join(config_path, IMG_METADATA_CACHE_FILE_NAME)
+
+
+def read_img_metadata_cache(cache_path):
+    "read the on-disk image metadata cache"
+
+    return read_json_cache(cache_path)
+
+
+def write_img_metadata_cache(cache_path, new_entries):
+    "merge new entries into the on-disk image metadata cache"
+
+    try:
+        update_json_cache(cache_path, new_entries)
+    except (IOError, OSError) as error:
+        logger.error("Could not write image metadata cache %s: %s", cache_path, error)
+
+
+def get_img_metadata_list(pipeline_settings_path, pipeline_settings, sing_cmdline_list):
+    """
+    get singularity image metadata for a list of sing.sh command-lines
+    images are looked up in the on-disk cache by path, size and mtime,
+    the ones missing or changed are inspected in parallel
+    """
+
+    cache_path = get_img_metadata_cache_path()
+    disk_cache = read_img_metadata_cache(cache_path)
+
+    img_metadata = {}
+    img_stat = {}
+    inspect_list = []
+
+    for sing_cmdline in set(sing_cmdline_list):
+
+        cache_key = " ".join(sing_cmdline.split(" ")[:3])
+        if cache_key in IMG_METADATA_CACHE:
+            img_metadata[sing_cmdline] = IMG_METADATA_CACHE[cache_key]
+            continue
+
+        img_path = get_img_path(pipeline_settings, sing_cmdline)
+        try:
+            stat_result = os.stat(img_path)
+            img_stat[sing_cmdline] = {
+                "path": img_path,
+                "size": stat_result.st_size,
+                "mtime": stat_result.st_mtime
+            }
+        except (OSError, TypeError):
+            inspect_list.append(sing_cmdline)
+            continue
+
+        cached = disk_cache.get(img_path)
+        if cached and cached["size"] == img_stat[sing_cmdline]["size"] and cached["mtime"] == img_stat[sing_cmdline]["mtime"]:
+            IMG_METADATA_CACHE[cache_key] = cached["metadata"]
+            img_metadata[sing_cmdline] = cached["metadata"]
+        else:
+            inspect_list.append(sing_cmdline)
+
+    if not inspect_list:
+        return img_metadata
+
+    worker_pool = Pool(min(IMG_METADATA_MAX_WORKERS, len(inspect_list)))
+    try:
+        inspect_results = worker_pool.map(
+            lambda sing_cmdline: get_img_metadata(pipeline_settings_path, sing_cmdline),
+            inspect_list
+        )
+    finally:
+        worker_pool.close()
+        worker_pool.join()
+
+    new_entries = {}
+
+    for sing_cmdline, metadata in zip(inspect_list, inspect_results):
+        img_metadata[sing_cmdline] = metadata
+        # only keep images that were inspected successfully
+        if sing_cmdline in img_stat and "error" not in metadata:
+            new_entry = dict(img_stat[sing_cmdline])
+            new_entry["metadata"] = metadata
+            new_entries[new_entry["path"]] = new_entry
+
+    write_img_metadata_cache(cache_path, new_entries)
+
+    return img_metadata
+
+
 def lookup_cmo_sing_cmdline(pipeline_settings, cmd0, version):
     """
     for a given cmo command and version, get sing command-line by looking up roslin_resources.json
@@ -457,33 +511,206 @@ def get_cwl_metadata(pipeline_settings, cwl_filename, version):
 def get_toil_log_level(log):
     "get toil log level"
 
-    match = re.search(r"'toil' logger at level '(.*?)'", log)
+    match = TOIL_LOG_LEVEL_REGEX.search(log)
 
     if match:
         return match.group(1)
     else:
         return None
 
-# fixme: let's use some design pattern
 
+class CwltoilLogParser(object):
+    """
+    streaming parser for cwltoil.log
+    reads the log one line at a time and keeps a byte offset checkpoint next to the log,
+    so that profiling the same (or a still growing) log only parses the newly appended lines
+    """
+
+    def __init__(self, pipeline_settings_path, pipeline_settings, cwltoil_log):
+
+        self.pipeline_settings_path = pipeline_settings_path
+        self.pipeline_settings = pipeline_settings
+        self.cwltoil_log = cwltoil_log
+        self.checkpoint_path = cwltoil_log + CWLTOIL_LOG_CHECKPOINT_SUFFIX
+        self.reset(None)
+
+    def reset(self, log_id):
+        "start over from the beginning of the log"
+
+        self.log_id = log_id
+        self.offset = 0
+        self.log_level = None
+        self.sw_list = {}
+        self.already_processed = {}
+        # lines of the DEBUG job record currently being collected
+        self.record_lines = None
+        self.record_offset = None
+        # entries waiting for their image metadata
+        self.pending_img = []
+
+    def load_checkpoint(self, log_stat):
+        "load the checkpoint, ignore it if the log was replaced or truncated"
+
+        log_id = [log_stat.st_dev, log_stat.st_ino]
+        self.reset(log_id)
+
+        if not os.path.exists(self.checkpoint_path):
+            return
+
+        try:
+            checkpoint = json.loads(read_file(self.checkpoint_path))
+        except (IOError, ValueError):
+            return
+
+        if checkpoint.get("version") != CWLTOIL_LOG_CHECKPOINT_VERSION:
+            return
+        if checkpoint.get("log_id") != log_id:
+            return
+        if checkpoint.get("offset", 0) > log_stat.st_size:
+            return
+
+        self.offset = checkpoint["offset"]
+        self.log_level = checkpoint["log_level"]
+        self.sw_list = checkpoint["sw_list"]
+        self.already_processed = dict.fromkeys(checkpoint["already_processed"], "1")
+
+    def save_checkpoint(self):
+        "write the checkpoint atomically"
+
+        # a job record that is still being written is parsed again next time
+        offset = self.offset
+        if self.record_offset is not None:
+            offset = self.record_offset
+
+        checkpoint = {
+            "version": CWLTOIL_LOG_CHECKPOINT_VERSION,
+            "log_id": self.log_id,
+            "offset": offset,
+            "log_level": self.log_level,
+            "sw_list": self.sw_list,
+            "already_processed": self.already_processed.keys()
+        }
+
+        checkpoint_tmp_path = self.checkpoint_path + ".tmp"
+        try:
+            write_file(checkpoint_tmp_path, json.dumps(checkpoint, default=str))
+            os.rename(checkpoint_tmp_path, self.checkpoint_path)
+        except (IOError, OSError) as error:
+            logger.error("Could not write checkpoint %s: %s", self.checkpoint_path, error)
+
+    def parse(self):
+        "parse the log from the checkpoint to the last complete line"
+
+        try:
+            log_stat = os.stat(self.cwltoil_log)
+        except OSError:
+            return {}
+
+        self.load_checkpoint(log_stat)
+
+        with open(self.cwltoil_log, 'rb') as log_file:
+            log_file.seek(self.offset)
+            # readline keeps tell() and our offset in sync, file iteration reads ahead
+            for line in iter(log_file.readline, ''):
+                # the last line is still being written
+                if not line.endswith("\n"):
+                    break
+                self.parse_line(self.offset, line.rstrip("\r\n"))
+                self.offset = self.offset + len(line)
+
+        self.add_img_metadata()
+
+        self.save_checkpoint()
+
+        if self.log_level not in ("INFO", "DEBUG"):
+            return {}
+
+        return self.sw_list
+
+    def add_img_metadata(self):
+        "get the image metadata of all new entries at once"
+
+        if not self.pending_img:
+            return
 
-def get_bioinfo_software_info_loglevel_info(pipeline_settings_path, pipeline_settings, log):
-    "get bioinformatics software info when log level is set to INFO"
+        img_metadata = get_img_metadata_list(
+            self.pipeline_settings_path,
+            self.pipeline_settings,
+            [sing_cmdline for _, sing_cmdline in self.pending_img]
+        )
+
+        for entry, sing_cmdline in self.pending_img:
+            entry["img"] = img_metadata[sing_cmdline]
+
+        self.pending_img = []
+
+    def parse_line(self, line_offset, line):
+        "feed one line to the parser of the current log level"
+
+        if self.log_level is None:
+            self.log_level = get_toil_log_level(line)
+        elif self.log_level == "INFO":
+            self.parse_line_loglevel_info(line)
+        elif self.log_level == "DEBUG":
+            self.parse_line_loglevel_debug(line_offset, line)
 
-    sw_list = {}
+    def parse_line_loglevel_info(self, line):
+        "every issued job is logged on a single line when log level is set to INFO"
 
-    already_processed = {}
+        match1 = INFO_ISSUED_JOB_REGEX.search(line)
+        if match1:
+            self.add_software_entry_loglevel_info(match1.group(1))
 
-    matches = re.finditer(r"Issued job '(.*?)'.*(\w\/\w\/job\w{6})", log)
+    def parse_line_loglevel_debug(self, line_offset, line):
+        """
+        a job record starts at INFO:cwltool:[job ...] and spans the continuation lines
+        until the next line that is not indented (see add_software_entry_loglevel_debug)
+        """
+
+        position = 0
+
+        while True:
+
+            if self.record_lines is None:
+                match_start = DEBUG_JOB_START_REGEX.search(line, position)
+                if not match_start:
+                    return
+                self.record_lines = []
+                self.record_offset = line_offset
+                position = match_start.start(1)
+                end_position = match_start.end()
+            else:
+                end_position = position
 
-    for match1 in matches:
+            match_end = DEBUG_JOB_END_REGEX.search(line, end_position)
 
-        base_cmd = match1.group(1)
+            if not match_end:
+                self.record_lines.append(line[position:])
+                # never found the end of this record, drop it to keep memory bounded
+                if len(self.record_lines) > CWLTOIL_LOG_MAX_RECORD_LINES:
+                    self.record_lines = None
+                    self.record_offset = None
+                return
+
+            self.record_lines.append(line[position:match_end.end() - 1])
+            raw_cmd = "\n".join(self.record_lines)
+            self.record_lines = None
+            self.record_offset = None
+
+            self.add_software_entry_loglevel_debug(raw_cmd)
+
+            position = match_end.end()
+
+    def add_software_entry_loglevel_info(self, base_cmd):
+        "get bioinformatics software info when log level is set to INFO"
+
+        sw_list = self.sw_list
+        already_processed = self.already_processed
 
         # skip if already processed,
         # otherwise mark as processed so that we don't reprocess again next round
         if base_cmd in already_processed:
-            continue
+            return
         else:
             already_processed[base_cmd] = "1"
 
@@ -521,61 +748,51 @@ def get_bioinfo_software_info_loglevel_info(pipeline_settings_path, pipeline_set
 
         # if this is the first time this version appears for this software
         if cmd0.startswith("sing.sh"):
-            entry["img"] = get_img_metadata(pipeline_settings_path, base_cmd)
+            self.pending_img.append((entry, base_cmd))
         elif cmd0.startswith("cmo_"):
-            sing_cmdline = lookup_cmo_sing_cmdline(pipeline_settings, cmd0, version)
+            sing_cmdline = lookup_cmo_sing_cmdline(self.pipeline_settings, cmd0, version)
             if sing_cmdline:
-                entry["img"] = get_img_metadata(pipeline_settings_path, sing_cmdline)
+                self.pending_img.append((entry, sing_cmdline))
 
         sw_list[software_name].append(entry)
 
-    return sw_list
-
-
-# fixme: let's use some design pattern
-def get_bioinfo_software_info_loglevel_debug(pipeline_settings_path, pipeline_settings, log):
-    "get bioinformatics software info when log level is set to DEBUG"
-
-    sw_list = {}
-
-    # this method can cover non-cmo-pkg tools
-    # e.g.
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    [job cmo-bwa-mem.cwl] /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpje5c7F$ cmo_bwa_mem \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq1 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stgcfbf51cd-dc37-4e11-a7df-96c8f96facc1/DU874145-T_R1.chunk000_cl.fastq.gz \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq2 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stg0f06777c-eeae-4dd4-89e1-99bdbb2dd844/DU874145-T_R2.chunk000_cl.fastq.gz \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --genome \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        GRCh37 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --output \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        DU874145-T.chunk000.bam \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --version \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        default
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    INFO:cwltool:[job cmo-bwa-mem.cwl] /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpje5c7F$ cmo_bwa_mem \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq1 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stgcfbf51cd-dc37-4e11-a7df-96c8f96facc1/DU874145-T_R1.chunk000_cl.fastq.gz \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq2 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stg0f06777c-eeae-4dd4-89e1-99bdbb2dd844/DU874145-T_R2.chunk000_cl.fastq.gz \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --genome \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        GRCh37 \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --output \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        DU874145-T.chunk000.bam \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --version \
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        default
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    [job cmo-bwa-mem.cwl] completed success
-    #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    INFO:cwltool:[job cmo-bwa-mem.cwl] completed success
-
-    already_processed = {}
-
-    matches = re.finditer(r"INFO:cwltool:(\[job .*?\].*?\w    )[\w\[]", log, re.DOTALL)
-
-    for match1 in matches:
-        raw_cmd = match1.group(1)
+    def add_software_entry_loglevel_debug(self, raw_cmd):
+        "get bioinformatics software info when log level is set to DEBUG"
+
+        sw_list = self.sw_list
+        already_processed = self.already_processed
+
+        # this method can cover non-cmo-pkg tools
+        # e.g.
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    [job cmo-bwa-mem.cwl] /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpje5c7F$ cmo_bwa_mem \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq1 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stgcfbf51cd-dc37-4e11-a7df-96c8f96facc1/DU874145-T_R1.chunk000_cl.fastq.gz \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq2 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stg0f06777c-eeae-4dd4-89e1-99bdbb2dd844/DU874145-T_R2.chunk000_cl.fastq.gz \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --genome \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        GRCh37 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --output \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        DU874145-T.chunk000.bam \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --version \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        default
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    INFO:cwltool:[job cmo-bwa-mem.cwl] /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpje5c7F$ cmo_bwa_mem \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq1 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stgcfbf51cd-dc37-4e11-a7df-96c8f96facc1/DU874145-T_R1.chunk000_cl.fastq.gz \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --fastq2 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        /ifs/work/chunj/prism-proto/ifs/prism/outputs/35cd528a/35cd528a-50a0-11e7-817f-645106efb11c/outputs/tmpDv9yQE/stg0f06777c-eeae-4dd4-89e1-99bdbb2dd844/DU874145-T_R2.chunk000_cl.fastq.gz \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --genome \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        GRCh37 \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --output \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        DU874145-T.chunk000.bam \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        --version \
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_        default
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    [job cmo-bwa-mem.cwl] completed success
+        #'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    INFO:cwltool:[job cmo-bwa-mem.cwl] completed success
 
         # fixme: toil has a logging bug that repeats the same log message over and over again
         # in general module-1-2-3.chunk.cwl generates 2MB, but we experienced 412MB log file.
-        # this causes profiling forever
-        # so, extract unique temp dir assigned to each job
+        # the log is streamed, but still
+        # extract unique temp dir assigned to each job
         # and use this to not repeat already processed job
         # e.g.
         # x/z/job9Tx8l_ in 'cmo_bwa_mem' cmo_bwa_mem x/z/job9Tx8l_    [job
@@ -589,101 +806,73 @@ def get_bioinfo_software_info_loglevel_debug(pipeline_settings_path, pipeline_se
         # skip if already processed,
         # otherwise mark as processed so that we don't reprocess again next round
         if job_tmp_dir in already_processed:
-            continue
+            return
         else:
             already_processed[job_tmp_dir] = "1"
 
-        # the regex captures extra that contains "completed success". ignore.
+        # the record that contains "completed success" is not a command. ignore.
         if "completed success" in raw_cmd:
-            continue
+            return
 
         # command constructor
         match2 = re.search(r"\[job (.*?)\].*?\$\s(.*)", raw_cmd)
-        if match2:
-
-            # get software name (e.g. cmo-bwa-mem.cwl)
-            cwl_filename = match2.group(1)
-
-            # remove .cwl
-            # replace . with - (MongoDB doesn't allow . in the field name)
-            software_name = cwl_filename.replace(".cwl", "").replace(".", "-")
+        if not match2:
+            return
 
-            # if this is the first time this software appears
-            if not software_name in sw_list:
-                sw_list[software_name] = []
-
-            entry = {
-                "cmdline": None,
-                "img": None,
-                "cwl": None
-            }
+        # get software name (e.g. cmo-bwa-mem.cwl)
+        cwl_filename = match2.group(1)
 
-            # this is the very first arg
-            # either "sing.sh" or "cmo_*"
-            cmd0 = match2.group(2).rstrip("\\")
+        # remove .cwl
+        # replace . with - (MongoDB doesn't allow . in the field name)
+        software_name = cwl_filename.replace(".cwl", "").replace(".", "-")
 
-            # extract only the arguments
-            match3 = re.finditer(r"$.*?\s{2,}(.*?)$", raw_cmd, re.DOTALL | re.MULTILINE)
-            args = [arg.group(1).rstrip(" \\") for arg in match3]
+        # if this is the first time this software appears
+        if not software_name in sw_list:
+            sw_list[software_name] = []
 
-            # construct the finall command line
-            final_command_line = (cmd0 + " ".join(args)).rstrip()
-            entry["cmdline"] = final_command_line
+        entry = {
+            "cmdline": None,
+            "img": None,
+            "cwl": None
+        }
 
-            # extract version from command-line args
-            version = get_bioinformatics_software_version(cmd0, final_command_line)
+        # this is the very first arg
+        # either "sing.sh" or "cmo_*"
+        cmd0 = match2.group(2).rstrip("\\")
 
-            # if this is the first time this version appears for this software
-            if cmd0.startswith("sing.sh"):
-                entry["img"] = get_img_metadata(pipeline_settings_path, final_command_line)
-            elif cmd0.startswith("cmo_"):
-                sing_cmdline = lookup_cmo_sing_cmdline(pipeline_settings, cmd0, version)
-                if sing_cmdline:
-                    entry["img"] = get_img_metadata(pipeline_settings_path, sing_cmdline)
+        # extract only the arguments
+        match3 = re.finditer(r"$.*?\s{2,}(.*?)$", raw_cmd, re.DOTALL | re.MULTILINE)
+        args = [arg.group(1).rstrip(" \\") for arg in match3]
 
-            if cwl_filename + version in CWL_METADATA_CACHE:
-                entry["cwl"] = CWL_METADATA_CACHE[cwl_filename + version]
-            else:
-                entry["cwl"] = get_cwl_metadata(pipeline_settings, cwl_filename, version)
+        # construct the finall command line
+        final_command_line = (cmd0 + " ".join(args)).rstrip()
+        entry["cmdline"] = final_command_line
 
-            sw_list[software_name].append(entry)
+        # extract version from command-line args
+        version = get_bioinformatics_software_version(cmd0, final_command_line)
 
-    # this only works for cmo-pkg tools
-    # matches = re.finditer(r"'(.*?)'.*?call_cmd.*?:\s+(.*)", log, re.MULTILINE)
+        # if this is the first time this version appears for this software
+        if cmd0.startswith("sing.sh"):
+            self.pending_img.append((entry, final_command_line))
+        elif cmd0.startswith("cmo_"):
+            sing_cmdline = lookup_cmo_sing_cmdline(self.pipeline_settings, cmd0, version)
+            if sing_cmdline:
+                self.pending_img.append((entry, sing_cmdline))
 
-    # for match in matches:
-    #     software_name = match.group(1)
-    #     command = match.group(2)
-    #     if software_name in sw_list:
-    #         sw_list[software_name].append(command)
-    #     else:
-    #         sw_list[software_name] = [command]
+        if cwl_filename + version in CWL_METADATA_CACHE:
+            entry["cwl"] = CWL_METADATA_CACHE[cwl_filename + version]
+        else:
+            entry["cwl"] = get_cwl_metadata(self.pipeline_settings, cwl_filename, version)
 
-    return sw_list
+        sw_list[software_name].append(entry)
 
 
-# fixme: let's use some design pattern
 def get_bioinfo_software_info(pipeline_settings_path, pipeline_settings, cwltoil_log):
     "get bioinformatics software info"
 
-    log = read_file(cwltoil_log)
-
-    log_level = get_toil_log_level(log)
+    log_parser = CwltoilLogParser(pipeline_settings_path, pipeline_settings, cwltoil_log)
 
-    if log_level == "INFO":
-        return get_bioinfo_software_info_loglevel_info(
-            pipeline_settings_path,
-            pipeline_settings,
-            log
-        )
-    elif log_level == "DEBUG":
-        return get_bioinfo_software_info_loglevel_debug(
-            pipeline_settings_path,
-            pipeline_settings,
-            log
-        )
-    else:
-        return {}
+    return log_parser.parse()
 
 
 def make_runprofile(job_uuid, work_dir, cwltoil_log_path):
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+from subprocess import PIPE, Popen
+
+if 'ROSLIN_CORE_BIN_PATH' not in os.environ:
+    print("Roslin core settings not loaded")
+ROSLIN_CORE_BIN_PATH = os.environ['ROSLIN_CORE_BIN_PATH']
+
+STARTUP_BUDGET = 1.5
+STARTUP_RUNS = 5
+STARTUP_SCRIPTS = ['roslin_submit.py', 'roslin_restart.py']
+
+def time_command(command):
+    start_time = time.time()
+    single_process = Popen(command, stdout=PIPE, stderr=PIPE)
+    output, error = single_process.communicate()
+    elapsed_time = time.time() - start_time
+    return (elapsed_time, single_process.returncode, error)
+
+def benchmark_script(script_name,pipeline_name,pipeline_version,num_runs):
+    script_path = os.path.join(ROSLIN_CORE_BIN_PATH,script_name)
+    command = [sys.executable, script_path, '--name', pipeline_name, '--version', pipeline_version, '--help']
+    run_times = []
+    for single_run in range(0,num_runs):
+        elapsed_time, errorcode, error = time_command(command)
+        if errorcode != 0:
+            print("ERROR: " + " ".join(command) + " failed with errorcode " + str(errorcode) + "\n" + error, file=sys.stderr)
+            sys.exit(1)
+        run_times.append(elapsed_time)
+    # the first run fills the settings snapshot and choices caches, the rest show the usual startup
+    first_run = run_times[0]
+    warm_runs = sorted(run_times[1:]) or [first_run]
+    median_run = warm_runs[len(warm_runs) // 2]
+    return (first_run, median_run)
+
+def main():
+    "main function"
+
+    parser = argparse.ArgumentParser(description='roslin startup benchmark, fails if the cli startup time is over budget')
+
+    parser.add_argument(
+        "--name",
+        action="store",
+        dest="pipeline_name",
+        help="Pipeline name",
+        required=True
+    )
+
+    parser.add_argument(
+        "--version",
+        action="store",
+        dest="pipeline_version",
+        help="Pipeline version",
+        required=True
+    )
+
+    parser.add_argument(
+        "--budget",
+        action="store",
+        dest="budget",
+        type=float,
+        default=STARTUP_BUDGET,
+        help="The maximum median startup time in seconds"
+    )
+
+    parser.add_argument(
+        "--runs",
+        action="store",
+        dest="runs",
+        type=int,
+        default=STARTUP_RUNS,
+        help="The number of times each script is started"
+    )
+
+    options = parser.parse_args()
+    over_budget = []
+    for single_script in STARTUP_SCRIPTS:
+        first_run, median_run = benchmark_script(single_script,options.pipeline_name,options.pipeline_version,options.runs)
+        print("{}: first run {:.3f}s, median {:.3f}s ( budget {:.3f}s )".format(single_script,first_run,median_run,options.budget))
+        if median_run > options.budget:
+            over_budget.append(single_script)
+    if over_budget:
+        print("ERROR: startup time over budget for " + ", ".join(over_budget), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+
+    main()
@@ -1,11 +1,9 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import os, sys, glob, uuid, argparse, subprocess
-import hashlib
 import datetime
+import hashlib
 import json
-import tarfile
-import base64
 import time
 import re
 from subprocess import PIPE, Popen
@@ -22,7 +20,9 @@ if 'ROSLIN_CORE_BIN_PATH' not in os.environ:
 ROSLIN_CORE_BIN_PATH = os.environ['ROSLIN_CORE_BIN_PATH']
 ROSLIN_CORE_CONFIG_PATH = os.environ['ROSLIN_CORE_CONFIG_PATH']
 sys.path.append(ROSLIN_CORE_BIN_PATH)
-from core_utils import load_pipeline_settings, copy_ignore_same_file, run_command, run_command_realtime, print_error, send_user_kill_signal, check_if_argument_file_exists, check_yaml_boolean_value, load_yaml, save_yaml, check_tmp_env, get_common_args, parse_workflow_args, get_submission_args, add_specific_args, get_leader_args, get_args_dict
+from core_utils import load_pipeline_settings, copy_ignore_same_file, run_command, run_command_realtime, print_error, send_user_kill_signal, check_if_argument_file_exists, check_yaml_boolean_value, load_yaml, save_yaml, check_tmp_env, get_common_args, parse_workflow_args, get_submission_args, add_specific_args, get_leader_args, get_args_dict, spool_leader_submission, LEADER_DAEMON_ENV
+from blob_store import get_blob_store, store_files
+from checksum_cache import get_sha1_list
 
 GB_SIZE_MB = 1024
 MB_SIZE_B = (float(GB_SIZE_MB) ** 2)
@@ -30,6 +30,12 @@ MAX_META_FILE_SIZE = 5 * MB_SIZE_B
 JOBSTORE_UUID_FILE_NAME = 'jobstore_uuid'
 INPUT_YAML_FILE_NAME = 'inputs.yaml'
 WORKFLOW_PARAMS_FILE_NAME = 'workflow_params.json'
+CWL_OVERLAY_DIR_NAME = 'roslin_cwl_overlays'
+CWL_OVERLAY_CACHE_ENV = 'ROSLIN_CWL_OVERLAY_CACHE'
+CWL_OVERLAY_MAX_AGE = 30 * 24 * 60 * 60
+CWL_MISSING_FILE_CHECKSUM = 'missing'
+CWL_OVERLAY_REFS_SUFFIX = '.refs'
+BATCH_POLL_INTERVAL = 30
 
 logger = logging.getLogger("roslin_submit")
 
@@ -44,46 +50,197 @@ def cleanup(clean_up_tuple, signal_num, frame):
     send_user_kill_signal(*clean_up_tuple)
 
 
+def limit_cwl_resources(yaml_contents,max_memory,max_cpu):
+    changed = False
+    if 'requirements' in yaml_contents:
+        resource_requirement = None
+        requirements_obj = yaml_contents['requirements']
+        if type(requirements_obj) is list:
+            for single_item in requirements_obj:
+                if 'class' in single_item:
+                    if single_item['class'] == 'ResourceRequirement':
+                        resource_requirement = single_item
+        if type(requirements_obj) is dict:
+            if 'ResourceRequirement' in yaml_contents['requirements']:
+                resource_requirement = yaml_contents['requirements']['ResourceRequirement']
+        if resource_requirement:
+            if 'ramMin' in resource_requirement:
+                if type(resource_requirement['ramMin']) is int:
+                    if int(resource_requirement['ramMin']) > max_memory:
+                        resource_requirement['ramMin'] = max_memory
+                        changed = True
+            if 'coresMin' in resource_requirement:
+                if type(resource_requirement['coresMin']) is int:
+                    if int(resource_requirement['coresMin']) > max_cpu:
+                        resource_requirement['coresMin'] = max_cpu
+                        changed = True
+    return changed
+
+def get_cwl_tree_digest(cwl_directory):
+    cwl_file_list = []
+    for root, dirnames, filenames in os.walk(cwl_directory,followlinks=True):
+        for single_file in filenames:
+            cwl_file_list.append(os.path.join(root,single_file))
+    cwl_file_list.sort()
+    # unchanged files come from the checksum cache
+    file_checksums = get_sha1_list(cwl_file_list)
+    tree_digest = hashlib.sha1()
+    for single_file in cwl_file_list:
+        file_checksum = file_checksums[single_file]
+        if file_checksum is None:
+            # a broken link, or a file removed while walking the cwl
+            print_error("Warning: Could not read " + single_file + " in the cwl directory")
+            file_checksum = CWL_MISSING_FILE_CHECKSUM
+        tree_digest.update(os.path.relpath(single_file,cwl_directory) + "\0" + file_checksum + "\0")
+    return tree_digest.hexdigest()
+
+def build_cwl_overlay(cwl_directory,overlay_directory,max_memory,max_cpu,debug_mode):
+    # only the cwl files with a lower resource requirement are written, everything else links to the original
+    for root, dirnames, filenames in os.walk(cwl_directory,followlinks=True):
+        overlay_root = os.path.join(overlay_directory,os.path.relpath(root,cwl_directory))
+        if not os.path.isdir(overlay_root):
+            os.makedirs(overlay_root)
+        for single_file in filenames:
+            cwl_file_path = os.path.join(root,single_file)
+            overlay_file_path = os.path.join(overlay_root,single_file)
+            changed = False
+            if '.cwl' in single_file:
+                yaml_contents = load_yaml(cwl_file_path)
+                if isinstance(yaml_contents,dict):
+                    changed = limit_cwl_resources(yaml_contents,max_memory,max_cpu)
+            if changed:
+                if debug_mode:
+                    print('Modiying: '+ cwl_file_path)
+                save_yaml(overlay_file_path,yaml_contents)
+                os.chmod(overlay_file_path,0o444)
+            else:
+                os.symlink(os.path.abspath(cwl_file_path),overlay_file_path)
+
+def get_cwl_overlay_cache_directory():
+    return os.environ.get(CWL_OVERLAY_CACHE_ENV) or os.path.join(ROSLIN_CORE_CONFIG_PATH,CWL_OVERLAY_DIR_NAME)
+
+# Every project work dir that links to a shared overlay leaves a link back to
+# its cwl link in the refs folder next to the overlay. An overlay is in use while
+# one of these still resolves to it, links of deleted work dirs are removed
+# when the overlay is checked for pruning.
+
+def add_cwl_overlay_ref(overlay_directory,work_cwl_directory):
+    refs_directory = overlay_directory + CWL_OVERLAY_REFS_SUFFIX
+    work_cwl_directory = os.path.abspath(work_cwl_directory)
+    ref_path = os.path.join(refs_directory,hashlib.sha1(work_cwl_directory).hexdigest())
+    try:
+        if not os.path.isdir(refs_directory):
+            try:
+                os.makedirs(refs_directory)
+            except OSError:
+                # created by another submission
+                if not os.path.isdir(refs_directory):
+                    raise
+        if not os.path.lexists(ref_path):
+            os.symlink(work_cwl_directory,ref_path)
+        # the mtime is the last use, old overlays are pruned on it
+        os.utime(overlay_directory,None)
+    except OSError as ref_error:
+        print_error("Warning: Could not record the use of the cwl cache " + overlay_directory + " ( " + str(ref_error) + " )")
+
+def is_cwl_overlay_used(overlay_directory):
+    refs_directory = overlay_directory + CWL_OVERLAY_REFS_SUFFIX
+    overlay_real_path = os.path.realpath(overlay_directory)
+    overlay_used = False
+    try:
+        ref_list = os.listdir(refs_directory)
+    except OSError:
+        return False
+    for single_ref in ref_list:
+        ref_path = os.path.join(refs_directory,single_ref)
+        if os.path.realpath(ref_path) == overlay_real_path:
+            overlay_used = True
+            continue
+        try:
+            os.remove(ref_path)
+        except OSError:
+            pass
+    return overlay_used
+
+def refresh_cwl_overlay(work_dir):
+    "mark the shared overlay the project cwl links to as used, when restarting a project"
+    work_cwl_directory = os.path.join(work_dir,'cwl')
+    if not os.path.islink(work_cwl_directory):
+        return
+    overlay_directory = os.path.realpath(work_cwl_directory)
+    if not os.path.isdir(overlay_directory):
+        print_error("Warning: The cwl of the project links to " + overlay_directory + " which no longer exists")
+        return
+    add_cwl_overlay_ref(overlay_directory,work_cwl_directory)
+
+def prune_cwl_overlays(overlay_cache_directory,tree_digest):
+    "remove the overlays of other cwl trees that no project uses and have not been used for CWL_OVERLAY_MAX_AGE"
+    current_time = time.time()
+    for single_overlay in os.listdir(overlay_cache_directory):
+        if single_overlay.startswith(tree_digest + "-") or single_overlay.endswith(CWL_OVERLAY_REFS_SUFFIX):
+            continue
+        overlay_path = os.path.join(overlay_cache_directory,single_overlay)
+        try:
+            if current_time - os.stat(overlay_path).st_mtime <= CWL_OVERLAY_MAX_AGE:
+                continue
+        except OSError:
+            continue
+        if is_cwl_overlay_used(overlay_path):
+            continue
+        shutil.rmtree(overlay_path,ignore_errors=True)
+        shutil.rmtree(overlay_path + CWL_OVERLAY_REFS_SUFFIX,ignore_errors=True)
+
+def build_shared_cwl_overlay(cwl_directory,overlay_directory,max_memory,max_cpu,debug_mode):
+    overlay_cache_directory = os.path.dirname(overlay_directory)
+    if not os.path.isdir(overlay_cache_directory):
+        os.makedirs(overlay_cache_directory)
+    overlay_tmp_directory = overlay_directory + "." + str(os.getpid()) + ".tmp"
+    try:
+        build_cwl_overlay(cwl_directory,overlay_tmp_directory,max_memory,max_cpu,debug_mode)
+        try:
+            os.rename(overlay_tmp_directory,overlay_directory)
+        except OSError:
+            # built by another submission
+            if not os.path.isdir(overlay_directory):
+                raise
+    finally:
+        if os.path.exists(overlay_tmp_directory):
+            shutil.rmtree(overlay_tmp_directory)
+
+def get_cwl_overlay(cwl_directory,work_cwl_directory,max_memory,max_cpu,debug_mode):
+    "returns the shared overlay of the cwl, or work_cwl_directory when the cache can not be written"
+    tree_digest = get_cwl_tree_digest(cwl_directory)
+    overlay_cache_directory = get_cwl_overlay_cache_directory()
+    overlay_name = "{}-mem{}-cpu{}".format(tree_digest,max_memory,max_cpu)
+    overlay_directory = os.path.join(overlay_cache_directory,overlay_name)
+    if os.path.isdir(overlay_directory):
+        print("Using cached cwl for max memory " + str(max_memory) + " and max cpu " + str(max_cpu) + ": " + overlay_directory)
+        try:
+            # the mtime is the last use, old overlays are pruned on it
+            os.utime(overlay_directory,None)
+        except OSError:
+            pass
+        return overlay_directory
+    print("Creating a cache for cwl with max memory " + str(max_memory) + " and max cpu " + str(max_cpu) + ": " + overlay_directory)
+    try:
+        build_shared_cwl_overlay(cwl_directory,overlay_directory,max_memory,max_cpu,debug_mode)
+    except (IOError, OSError) as cache_error:
+        print_error("Warning: Could not write the cwl cache in " + overlay_cache_directory + " ( " + str(cache_error) + " ), the cwl is written to the project work dir")
+        build_cwl_overlay(cwl_directory,work_cwl_directory,max_memory,max_cpu,debug_mode)
+        return work_cwl_directory
+    prune_cwl_overlays(overlay_cache_directory,tree_digest)
+    return overlay_directory
+
 def handle_change_max_memory(work_dir,max_memory_str,max_cpu_str,input_yaml_path,debug_mode):
     max_memory = int(max_memory_str[:-1]) * GB_SIZE_MB
     max_cpu = int(max_cpu_str)
     cwl_directory = os.environ['ROSLIN_PIPELINE_CWL_PATH']
     new_cwl_directory = os.path.join(work_dir,'cwl')
-    print("Creating a cache for cwl to modify: " + new_cwl_directory)
-    shutil.copytree(cwl_directory,new_cwl_directory)
-    print("Setting cwl to max memory " + str(max_memory) + " and max cpu " + str(max_cpu))
-    for root, dirnames, filenames in os.walk(new_cwl_directory):
-        for single_file in filenames:
-            if '.cwl' in single_file:
-                cwl_file_path = os.path.join(root,single_file)
-                yaml_contents = load_yaml(cwl_file_path)
-                changed = False
-                if 'requirements' in yaml_contents:
-                    resource_requirement = None
-                    requirements_obj = yaml_contents['requirements']
-                    if type(requirements_obj) is list:
-                        for single_item in requirements_obj:
-                            if 'class' in single_item:
-                                if single_item['class'] == 'ResourceRequirement':
-                                    resource_requirement = single_item
-                    if type(requirements_obj) is dict:
-                        if 'ResourceRequirement' in yaml_contents['requirements']:
-                            resource_requirement = yaml_contents['requirements']['ResourceRequirement']
-                    if resource_requirement:
-                        if 'ramMin' in resource_requirement:
-                            if type(resource_requirement['ramMin']) is int:
-                                if int(resource_requirement['ramMin']) > max_memory:
-                                    resource_requirement['ramMin'] = max_memory
-                                    changed = True
-                        if 'coresMin' in resource_requirement:
-                            if type(resource_requirement['coresMin']) is int:
-                                if int(resource_requirement['coresMin']) > max_cpu:
-                                    resource_requirement['coresMin'] = max_cpu
-                                    changed = True
-                if changed:
-                    if debug_mode:
-                        print('Modiying: '+ cwl_file_path)
-                    save_yaml(cwl_file_path,yaml_contents)
+    # the overlay is shared by every project with the same cwl and limits, and never modified once built
+    overlay_directory = get_cwl_overlay(cwl_directory,new_cwl_directory,max_memory,max_cpu,debug_mode)
+    if overlay_directory != new_cwl_directory:
+        os.symlink(overlay_directory,new_cwl_directory)
+        add_cwl_overlay_ref(overlay_directory,new_cwl_directory)
     input_yaml_contents = load_yaml(input_yaml_path)
     abra_ram_min = input_yaml_contents['runparams']['abra_ram_min']
     if abra_ram_min > max_memory:
@@ -93,8 +250,8 @@ def handle_change_max_memory(work_dir,max_memory_str,max_cpu_str,input_yaml_path
     os.environ['ROSLIN_PIPELINE_CWL_PATH'] = new_cwl_directory
 
 
-def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, work_dir, inputs_yaml, pipeline_settings, input_files_blob, requirements_dict,submission_requirements_dict,workflow_args):
-    from track_utils import  construct_project_doc, submission_file_name, get_current_time, add_user_event, update_run_result_doc, update_project_doc, construct_run_results_doc, update_latest_project, find_unique_name_in_dir, termination_file_name, old_jobs_folder, update_run_results_restart, update_run_profile_doc, construct_run_profile_doc
+def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, work_dir, inputs_yaml, pipeline_settings, input_files_blob, requirements_dict,submission_requirements_dict,workflow_args,launch=True):
+    from track_utils import  construct_project_doc, submission_file_name, get_current_time, add_user_event, update_run_result_doc, update_project_doc, construct_run_results_doc, update_latest_project, find_unique_name_in_dir, termination_file_name, old_jobs_folder, update_run_results_restart, update_run_profile_doc, construct_run_profile_doc, set_mongo_spool, MONGO_SPOOL_FILE_NAME
     leader_args = get_leader_args()
     common_args = get_common_args()
     leader_args_dict = get_args_dict(leader_args)
@@ -146,6 +303,10 @@ def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, wor
         old_log_folder = os.path.join(old_jobs_folder_path,log_folder_basename)
         shutil.move(log_folder,old_log_folder)
         os.mkdir(log_folder)
+        old_spool_path = os.path.join(old_log_folder,MONGO_SPOOL_FILE_NAME)
+        if os.path.exists(old_spool_path):
+            shutil.move(old_spool_path,os.path.join(log_folder,MONGO_SPOOL_FILE_NAME))
+    set_mongo_spool(logger,log_folder)
     if not os.path.exists(roslin_output_path):
         os.mkdir(roslin_output_path)
     if not os.path.exists(roslin_work_path):
@@ -201,6 +362,7 @@ def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, wor
     if restart:
         roslin_leader_command.append('--restart')
         user_event_name = "restart"
+        refresh_cwl_overlay(work_dir)
     leader_job_store = jobstore_uuid
     leader_job_store_path = "file:" +os.path.join(roslin_leader_tmp_path,leader_job_store)
     roslin_leader_command.append(leader_job_store_path)
@@ -236,6 +398,8 @@ def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, wor
     if debug_mode:
         print("Leader command:")
         print(roslin_leader_command)
+    if not launch:
+        return (roslin_leader_command, log_path_stdout, log_path_stderr, running_command_str)
     if foreground_mode:
         clean_up_tuple = (project_id, job_uuid, pipeline_name, pipeline_version, True)
         signal.signal(signal.SIGINT, partial(cleanup, clean_up_tuple))
@@ -254,51 +418,39 @@ def submit(pipeline_name, pipeline_version,job_uuid, jobstore_uuid, restart, wor
         with open(log_path_stderr,"w") as log_stderr:
             log_stderr.write(error)
         exit(exit_code)
+    elif os.environ.get(LEADER_DAEMON_ENV):
+        leader_info = (roslin_leader_command, log_path_stdout, log_path_stderr, running_command_str)
+        spool_leader(os.environ[LEADER_DAEMON_ENV],pipeline_name,pipeline_version,job_uuid,leader_info,dict(os.environ))
     else:
         leader_process = run_command(roslin_leader_command,log_path_stdout,log_path_stderr,False,False)
         print(running_command_str)
 
-def generate_sha1(filename):
-
-    # 64kb chunks
-    buf_size = 65536
-
-    sha1 = hashlib.sha1()
-
-    with open(filename, 'rb') as f:
-        while True:
-            data = f.read(buf_size)
-            if not data:
-                break
-            sha1.update(data)
+def spool_leader(leader_daemon_spool,pipeline_name,pipeline_version,job_uuid,leader_info,leader_env):
+    "hand the project to the leader daemon instead of starting a leader process"
+    roslin_leader_command, log_path_stdout, log_path_stderr, running_command_str = leader_info
+    submission_dict = {"project_uuid":job_uuid,"pipeline_name":pipeline_name,"pipeline_version":pipeline_version,"leader_args":roslin_leader_command[2:],"env":leader_env,"stdout":log_path_stdout,"stderr":log_path_stderr}
+    spool_leader_submission(leader_daemon_spool,submission_dict)
+    print(running_command_str)
 
-    return sha1.hexdigest()
-
-def targzip_project_files(project_id, project_path):
+def store_project_files(project_id, project_path, pipeline_settings=None):
 
     files = glob.glob(os.path.join(project_path, "*"))
     input_files = {}
     input_file_objs = []
-    tgz_path = "{}.tgz".format(os.path.join(project_path, project_id))
-    tar = tarfile.open(tgz_path, mode="w:gz", dereference=True)
+    meta_file_paths = []
     for filename in files:
         single_file_path = os.path.abspath(filename)
-        if os.path.isfile(single_file_path):
-            single_file_name = os.path.basename(filename)
-            single_file_size = os.path.getsize(filename)
-            single_file_sha1 = "sha1$" + generate_sha1(filename)
-            if single_file_size < MAX_META_FILE_SIZE:
-                tar.add(single_file_path, arcname=single_file_name)
-                file_obj = {"path": single_file_path,"checksum": single_file_sha1, "name":single_file_name}
-                input_file_objs.append(file_obj)
-    tar.close()
-
-    tgz_blob = None
-
-    with open(tgz_path, "rb") as tgz_file:
-        tgz_blob = base64.b64encode(tgz_file.read())
-
-    input_files['blob'] = tgz_blob
+        if os.path.isfile(single_file_path) and os.path.getsize(single_file_path) < MAX_META_FILE_SIZE:
+            meta_file_paths.append(single_file_path)
+    # each file is streamed into the blob store once, the project doc only keeps the digests
+    blob_store = get_blob_store(pipeline_settings)
+    file_digests = store_files(meta_file_paths,blob_store)
+    for single_file_path in meta_file_paths:
+        single_file_name = os.path.basename(single_file_path)
+        file_obj = {"path": single_file_path,"checksum": file_digests[single_file_path], "name":single_file_name}
+        input_file_objs.append(file_obj)
+
+    input_files['store'] = blob_store.location
     input_files['files'] = input_file_objs
     return input_files
 
@@ -340,63 +492,10 @@ def get_pipeline_name_and_versions():
 
     return {'pipeline_name_choices':pipeline_name_choices,'pipeline_version_choices':pipeline_version_choices,'pipeline_name_help':pipeline_name_help,'pipeline_version_help':pipeline_version_help}
 
-def main():
-    "main function"
-
-    preparser = argparse.ArgumentParser(description='roslin submit', add_help=False)
-
-    pipeline_name_and_version = get_pipeline_name_and_versions()
-
-
-    preparser.add_argument(
-        "--name",
-        action="store",
-        dest="pipeline_name",
-        help=pipeline_name_and_version['pipeline_name_help'],
-        choices=pipeline_name_and_version['pipeline_name_choices'],
-        required=True
-    )
-
-    preparser.add_argument(
-        "--version",
-        action="store",
-        dest="pipeline_version",
-        help=pipeline_name_and_version['pipeline_version_help'],
-        choices=pipeline_name_and_version['pipeline_version_choices'],
-        required=True
-    )
-
-    name_and_version, _ = preparser.parse_known_args()
-    pipeline_name = name_and_version.pipeline_name
-    pipeline_version = name_and_version.pipeline_version
-    # load the Roslin Pipeline settings
-    pipeline_settings = load_pipeline_settings(pipeline_name, pipeline_version)
-    if not pipeline_settings:
-        print_error("Error "+ str(pipeline_name) + " version "+ str(pipeline_version) + " does not exist.")
-        exit(1)
-    sys.path.append(pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'])
-    from track_utils import  construct_project_doc, submission_file_name, get_current_time, add_user_event, update_run_result_doc, update_project_doc, construct_run_results_doc, update_latest_project
-    from core_utils import convert_yaml_abs_path
-    import roslin_workflows
-    parser = argparse.ArgumentParser(parents=[ preparser ], add_help=True, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    common_requirements_list = get_common_args()
-    submission_requirements_list = get_submission_args()
-    parser = add_specific_args(parser,common_requirements_list)
-    parser = add_specific_args(parser,submission_requirements_list)
-    params, _ = parser.parse_known_args()
-    requirements_dict = parse_workflow_args(params, common_requirements_list)
-    submission_requirements_dict = parse_workflow_args(params, submission_requirements_list)
-    project_id = requirements_dict['project_id']
-    work_base_dir = os.path.abspath(pipeline_settings["ROSLIN_PIPELINE_OUTPUT_PATH"])
-    inputs_yaml = None
-    # create a new unique job uuid
-    jobstore_uuid = str(uuid.uuid1())
-    job_uuid = str(uuid.uuid1())
-    restart = False
-    inputs_yaml = os.path.abspath(params.inputs_yaml)
-    inputs_yaml_dirname = os.path.dirname(inputs_yaml)
-    inputs_yaml_basename = os.path.basename(inputs_yaml)
-    check_tmp_env(None)
+def parse_project_args(parser,roslin_workflows,argv):
+    params, _ = parser.parse_known_args(argv)
+    requirements_dict = parse_workflow_args(params, get_common_args())
+    submission_requirements_dict = parse_workflow_args(params, get_submission_args())
     roslin_workflow_class = getattr(roslin_workflows,requirements_dict['workflow_name'])
     roslin_workflow = roslin_workflow_class(None)
     workflow_parser = argparse.ArgumentParser(parents=[ parser ], add_help=False, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -404,18 +503,30 @@ def main():
     requirements_list = None
     if requirements_obj:
         workflow_parser, requirements_list = requirements_obj
-        workflow_params = workflow_parser.parse_args()
+        workflow_params = workflow_parser.parse_args(argv)
         requirements_dict.update(parse_workflow_args(workflow_params,requirements_list))
 
     if requirements_dict['force_overwrite_results'] and not requirements_dict['results_dir']:
         print_error("ERROR: You need to specify an output directory to force overwrite")
         sys.exit(1)
+    return (requirements_dict, submission_requirements_dict, requirements_list)
+
+def create_project(pipeline_settings,parser,requirements_dict,submission_requirements_dict):
+    from core_utils import convert_yaml_abs_path
+    project_id = requirements_dict['project_id']
+    work_base_dir = os.path.abspath(pipeline_settings["ROSLIN_PIPELINE_OUTPUT_PATH"])
+    # create a new unique job uuid
+    jobstore_uuid = str(uuid.uuid1())
+    job_uuid = str(uuid.uuid1())
+    inputs_yaml = requirements_dict['inputs_yaml']
+    inputs_yaml_basename = os.path.basename(inputs_yaml)
 
     work_dir = os.path.join(work_base_dir, job_uuid[:8], job_uuid)
     # create only if work_dir does not exist
     if not os.path.exists(work_dir):
         os.makedirs(work_dir)
 
+    input_files_blob = None
     if requirements_dict['project_path']:
         project_path = os.path.abspath(requirements_dict['project_path'])
         input_metadata_filenames = get_input_metadata(project_path)
@@ -426,7 +537,6 @@ def main():
                 copy_ignore_same_file(input_metadata_location,input_metadata_work_dir_location)
     else:
         project_path = None
-        input_files_blob = None
 
     jobstore_uuid_path = os.path.join(work_dir,JOBSTORE_UUID_FILE_NAME)
     input_yaml_path = os.path.join(work_dir,INPUT_YAML_FILE_NAME)
@@ -444,11 +554,187 @@ def main():
         os.rename(inputs_yaml_work_dir,input_yaml_path)
 
     if project_path:
-        input_files_blob = targzip_project_files(project_id, project_path)
+        input_files_blob = store_project_files(project_id, project_path, pipeline_settings)
 
     if submission_requirements_dict['max_mem'] != parser.get_default('max_mem') or submission_requirements_dict['max_cpu'] != parser.get_default('max_cpu'):
         handle_change_max_memory(work_dir,submission_requirements_dict['max_mem'],submission_requirements_dict['max_cpu'],inputs_yaml_work_dir,requirements_dict['debug_mode'])
 
+    return (job_uuid, jobstore_uuid, work_dir, inputs_yaml_work_dir, input_files_blob)
+
+def get_manifest_args(manifest_args):
+    "turn the options of a manifest entry into command line arguments"
+    argv = []
+    for single_option in sorted(manifest_args):
+        option_value = manifest_args[single_option]
+        option_name = "--" + str(single_option)
+        if isinstance(option_value, bool):
+            if option_value:
+                argv.append(option_name)
+        elif isinstance(option_value, list):
+            for single_value in option_value:
+                argv.extend([option_name,str(single_value)])
+        elif option_value != None:
+            argv.extend([option_name,str(option_value)])
+    return argv
+
+def stop_batch_launch(signal_num, frame):
+    # unwinds launch_leaders, which marks the projects it has not started as failed
+    sys.exit(1)
+
+def fail_unlaunched_projects(job_uuid_list):
+    from track_utils import update_run_results_status, get_status_names, flush_mongo_writes
+    if not job_uuid_list:
+        return
+    status_name_dict = get_status_names()
+    for job_uuid in job_uuid_list:
+        update_run_results_status(logger,job_uuid,status_name_dict['exit'])
+    flush_mongo_writes(logger)
+    print_error("ERROR: The batch stopped before starting " + str(len(job_uuid_list)) + " project(s), they are marked as failed and need to be submitted again: " + ", ".join(job_uuid_list))
+
+def launch_leaders(leader_list,job_uuid_list,max_concurrent):
+    running_leaders = []
+    launched_leaders = 0
+    if max_concurrent:
+        signal.signal(signal.SIGTERM, stop_batch_launch)
+        signal.signal(signal.SIGHUP, stop_batch_launch)
+    try:
+        for roslin_leader_command, log_path_stdout, log_path_stderr, running_command_str, leader_env in leader_list:
+            while max_concurrent and len(running_leaders) >= max_concurrent:
+                running_leaders = [single_leader for single_leader in running_leaders if single_leader.poll() == None]
+                if len(running_leaders) >= max_concurrent:
+                    time.sleep(BATCH_POLL_INTERVAL)
+            with open(log_path_stdout,'w') as log_stdout, open(log_path_stderr,'w') as log_stderr:
+                leader_process = Popen(roslin_leader_command, stdout=log_stdout, stderr=log_stderr, env=leader_env)
+            launched_leaders = launched_leaders + 1
+            running_leaders.append(leader_process)
+            print(running_command_str)
+        if max_concurrent:
+            # the cap holds until the last leader is done
+            for single_leader in running_leaders:
+                single_leader.wait()
+    finally:
+        fail_unlaunched_projects(job_uuid_list[launched_leaders:])
+
+def submit_batch(pipeline_name, pipeline_version, pipeline_settings, parser, manifest_path, max_concurrent):
+    from track_utils import flush_mongo_writes
+    import roslin_workflows
+    manifest = load_yaml(manifest_path)
+    if not isinstance(manifest, dict) or not manifest.get('projects'):
+        print_error("ERROR: No projects found in batch manifest " + manifest_path)
+        sys.exit(1)
+    manifest_defaults = manifest.get('defaults') or {}
+    check_tmp_env(None)
+    # validate every project before anything is submitted
+    project_list = []
+    failed_projects = []
+    for project_num, single_project in enumerate(manifest['projects']):
+        project_args = dict(manifest_defaults)
+        project_args.update(single_project)
+        argv = sys.argv[1:] + get_manifest_args(project_args)
+        project_name = str(project_args.get('id','project ' + str(project_num + 1)))
+        try:
+            requirements_dict, submission_requirements_dict, requirements_list = parse_project_args(parser,roslin_workflows,argv)
+        except SystemExit:
+            failed_projects.append(project_name)
+            continue
+        if submission_requirements_dict['foreground_mode']:
+            print_error("ERROR: --foreground-mode can not be used in batch mode ( " + project_name + " )")
+            failed_projects.append(project_name)
+            continue
+        project_list.append((requirements_dict, submission_requirements_dict, requirements_list))
+    if failed_projects:
+        print_error("ERROR: Batch manifest " + manifest_path + " has invalid projects: " + ", ".join(failed_projects) + ", nothing was submitted")
+        sys.exit(1)
+    # the settings, workflows and tracking client are shared, each project starts from the same environment
+    base_env = dict(os.environ)
+    leader_list = []
+    job_uuid_list = []
+    for requirements_dict, submission_requirements_dict, requirements_list in project_list:
+        os.environ.clear()
+        os.environ.update(base_env)
+        job_uuid, jobstore_uuid, work_dir, inputs_yaml_work_dir, input_files_blob = create_project(pipeline_settings,parser,requirements_dict,submission_requirements_dict)
+        leader_info = submit(pipeline_name, pipeline_version, job_uuid, jobstore_uuid, False, work_dir, inputs_yaml_work_dir, pipeline_settings, input_files_blob, requirements_dict, submission_requirements_dict,requirements_list,False)
+        leader_list.append(leader_info + (dict(os.environ),))
+        job_uuid_list.append(job_uuid)
+    os.environ.clear()
+    os.environ.update(base_env)
+    # the tracking documents of all the projects are written before the leaders update them
+    flush_mongo_writes(logger)
+    leader_daemon_spool = os.environ.get(LEADER_DAEMON_ENV)
+    if leader_daemon_spool:
+        # the daemon caps the number of running projects with its own --max-projects
+        for job_uuid, single_leader in zip(job_uuid_list,leader_list):
+            spool_leader(leader_daemon_spool,pipeline_name,pipeline_version,job_uuid,single_leader[:4],single_leader[4])
+    else:
+        launch_leaders(leader_list,job_uuid_list,max_concurrent)
+
+def main():
+    "main function"
+
+    preparser = argparse.ArgumentParser(description='roslin submit', add_help=False)
+
+    pipeline_name_and_version = get_pipeline_name_and_versions()
+
+
+    preparser.add_argument(
+        "--name",
+        action="store",
+        dest="pipeline_name",
+        help=pipeline_name_and_version['pipeline_name_help'],
+        choices=pipeline_name_and_version['pipeline_name_choices'],
+        required=True
+    )
+
+    preparser.add_argument(
+        "--version",
+        action="store",
+        dest="pipeline_version",
+        help=pipeline_name_and_version['pipeline_version_help'],
+        choices=pipeline_name_and_version['pipeline_version_choices'],
+        required=True
+    )
+
+    preparser.add_argument(
+        "--batch",
+        action="store",
+        dest="batch_manifest",
+        help="Submit all the projects in a yaml manifest, each project lists the options of a single submission (e.g. id, inputs, path) and the defaults section the options they share",
+        required=False
+    )
+
+    preparser.add_argument(
+        "--batch-concurrency",
+        action="store",
+        dest="batch_concurrency",
+        type=int,
+        help="The maximum number of project leaders running at the same time in batch mode, all the leaders are started at once if not set",
+        required=False
+    )
+
+    name_and_version, _ = preparser.parse_known_args()
+    pipeline_name = name_and_version.pipeline_name
+    pipeline_version = name_and_version.pipeline_version
+    # load the Roslin Pipeline settings
+    pipeline_settings = load_pipeline_settings(pipeline_name, pipeline_version)
+    if not pipeline_settings:
+        print_error("Error "+ str(pipeline_name) + " version "+ str(pipeline_version) + " does not exist.")
+        exit(1)
+    sys.path.append(pipeline_settings['ROSLIN_PIPELINE_BIN_PATH'])
+    parser = argparse.ArgumentParser(parents=[ preparser ], add_help=True, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    common_requirements_list = get_common_args()
+    submission_requirements_list = get_submission_args()
+    parser = add_specific_args(parser,common_requirements_list)
+    parser = add_specific_args(parser,submission_requirements_list)
+    if name_and_version.batch_manifest:
+        submit_batch(pipeline_name, pipeline_version, pipeline_settings, parser, name_and_version.batch_manifest, name_and_version.batch_concurrency)
+        return
+    params, _ = parser.parse_known_args()
+    # imported after parsing, so --help and argument errors do not wait for toil and the workflows
+    import roslin_workflows
+    check_tmp_env(None)
+    requirements_dict, submission_requirements_dict, requirements_list = parse_project_args(parser,roslin_workflows,None)
+    job_uuid, jobstore_uuid, work_dir, inputs_yaml_work_dir, input_files_blob = create_project(pipeline_settings,parser,requirements_dict,submission_requirements_dict)
+
     # submit
     submit(pipeline_name, pipeline_version, job_uuid, jobstore_uuid, False, work_dir, inputs_yaml_work_dir, pipeline_settings, input_files_blob, requirements_dict, submission_requirements_dict,requirements_list)
 
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import hashlib
+import subprocess
+
+SETTINGS_SNAPSHOT_SUFFIX = ".snapshot.json"
+SETTINGS_SNAPSHOT_VERSION = 2
+SETTINGS_ENV_REFERENCE = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+SETTINGS_ENV_UNSET = re.compile(r"\bunset[ \t]+([A-Za-z_][A-Za-z0-9_ \t]*)")
+SETTINGS_BASE_ENV = ["PATH", "HOME", "USER"]
+SETTINGS_ENV_PREFIX = "ROSLIN_"
+SETTINGS_SHELL_ENV = ["PWD", "OLDPWD", "SHLVL", "_"]
+SETTINGS_DYNAMIC_CODE = re.compile(r"(^|[;&|(]|\s)(source|\.|module|eval)\s|\$\(|`", re.MULTILINE)
+
+# Sourcing a settings.sh in bash costs a shell startup per call, and RoslinJob.run
+# does it in every toil job. The variables a settings file sets are compiled once
+# into a json snapshot next to it and reused until the settings file changes.
+# The file is sourced with only the environment it can depend on: the variables
+# it references or unsets, the ROSLIN_ variables and a few base ones. Their values are part
+# of the snapshot fingerprint with the file content, the variables it sets or
+# unsets are applied over the current environment. A settings file that sources
+# other files, runs commands or loads modules depends on more than that, it is
+# sourced every time in the current environment instead of being snapshotted.
+
+settings_snapshots = {}
+
+def get_settings_input_env(settings_content):
+    input_env_names = set(SETTINGS_BASE_ENV)
+    input_env_names.update(SETTINGS_ENV_REFERENCE.findall(settings_content))
+    for unset_names in SETTINGS_ENV_UNSET.findall(settings_content):
+        input_env_names.update(unset_names.split())
+    for single_env in os.environ:
+        if single_env.startswith(SETTINGS_ENV_PREFIX):
+            input_env_names.add(single_env)
+    input_env = {}
+    for single_env in input_env_names:
+        if single_env in os.environ:
+            input_env[single_env] = os.environ[single_env]
+    return input_env
+
+def get_settings_fingerprint(settings_content,input_env):
+    fingerprint = hashlib.sha1(settings_content)
+    for single_env in sorted(input_env):
+        fingerprint.update("\0" + single_env + "=" + input_env[single_env])
+    return fingerprint.hexdigest()
+
+def is_dynamic_settings(settings_content):
+    return SETTINGS_DYNAMIC_CODE.search(settings_content) != None
+
+def run_settings_source(settings_path,input_env):
+    command = ['bash', '-c', 'source {} && env'.format(settings_path)]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, env=input_env)
+    source_env = {}
+    for line in proc.stdout:
+        (key, _, value) = line.partition("=")
+        source_env[key] = value.rstrip()
+    proc.communicate()
+    return source_env
+
+def source_settings(settings_path,input_env):
+    source_env = run_settings_source(settings_path,input_env)
+    # only keep what the settings file set or unset
+    settings_env = {}
+    for single_env in source_env:
+        if single_env in SETTINGS_SHELL_ENV:
+            continue
+        if input_env.get(single_env) != source_env[single_env]:
+            settings_env[single_env] = source_env[single_env]
+    unset_env = []
+    for single_env in input_env:
+        if single_env not in source_env:
+            unset_env.append(single_env)
+    return (settings_env, unset_env)
+
+def get_snapshot_path(settings_path):
+    settings_dir, settings_file_name = os.path.split(os.path.abspath(settings_path))
+    return os.path.join(settings_dir, "." + settings_file_name + SETTINGS_SNAPSHOT_SUFFIX)
+
+def read_snapshot(snapshot_path):
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (IOError, ValueError):
+        return None
+    if snapshot.get('version') != SETTINGS_SNAPSHOT_VERSION:
+        return None
+    settings_env = {}
+    for single_env in snapshot['settings']:
+        settings_env[single_env.encode('utf-8')] = snapshot['settings'][single_env].encode('utf-8')
+    snapshot['settings'] = settings_env
+    snapshot['unset'] = [single_env.encode('utf-8') for single_env in snapshot['unset']]
+    return snapshot
+
+def write_snapshot(snapshot_path,snapshot):
+    snapshot_tmp_path = snapshot_path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(snapshot_tmp_path,"w") as snapshot_file:
+            json.dump(snapshot,snapshot_file)
+        os.rename(snapshot_tmp_path,snapshot_path)
+    except (IOError, OSError):
+        # read only config, the snapshot is kept for this process only
+        pass
+
+def is_valid_snapshot(snapshot,fingerprint,settings_mtime):
+    if not snapshot:
+        return False
+    return snapshot['fingerprint'] == fingerprint and snapshot['mtime'] == settings_mtime
+
+def read_settings_snapshot(settings_path):
+    settings_mtime = os.stat(settings_path).st_mtime
+    with open(settings_path) as settings_file:
+        settings_content = settings_file.read()
+    if is_dynamic_settings(settings_content):
+        return run_settings_source(settings_path,dict(os.environ))
+    input_env = get_settings_input_env(settings_content)
+    fingerprint = get_settings_fingerprint(settings_content,input_env)
+    snapshot = settings_snapshots.get(settings_path)
+    if not is_valid_snapshot(snapshot,fingerprint,settings_mtime):
+        snapshot_path = get_snapshot_path(settings_path)
+        snapshot = read_snapshot(snapshot_path)
+        if not is_valid_snapshot(snapshot,fingerprint,settings_mtime):
+            settings_env, unset_env = source_settings(settings_path,input_env)
+            snapshot = {'version': SETTINGS_SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'mtime': settings_mtime, 'settings': settings_env, 'unset': unset_env}
+            write_snapshot(snapshot_path,snapshot)
+        settings_snapshots[settings_path] = snapshot
+    pipeline_settings = dict(os.environ)
+    for single_env in snapshot['unset']:
+        pipeline_settings.pop(single_env,None)
+    pipeline_settings.update(snapshot['settings'])
+    return pipeline_settings
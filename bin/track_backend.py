@@ -0,0 +1,181 @@
+from __future__ import print_function
+import os
+import json
+import sqlite3
+import threading
+try:
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import ConnectionFailure
+except ImportError:
+    MongoClient = None
+    UpdateOne = None
+    class ConnectionFailure(Exception):
+        pass
+
+INDEX_KEY = 'pipelineJobId'
+PROJECT_KEY = 'projectId'
+TRACKING_COLLECTIONS = ["RunResults", "Projects", "RunProfiles", "RunData"]
+SQLITE_TIMEOUT = 30
+
+# A tracking backend stores one document per pipelineJobId in each collection.
+# update_documents takes a list of (doc_id, set_fields, upsert) where the keys of
+# set_fields may be dotted paths, like a mongo $set, and raises ConnectionFailure
+# when the store can not be reached so the caller can retry or spool the updates.
+
+def apply_set_fields(document,set_fields):
+    for single_path in set_fields:
+        path_parts = single_path.split(".")
+        nested_dict = document
+        for single_part in path_parts[:-1]:
+            if not isinstance(nested_dict.get(single_part), dict):
+                nested_dict[single_part] = {}
+            nested_dict = nested_dict[single_part]
+        nested_dict[path_parts[-1]] = set_fields[single_path]
+    return document
+
+def project_document(document,projection):
+    if not document or not projection:
+        return document
+    projected_document = {}
+    for single_field in projection:
+        if projection[single_field] and single_field in document:
+            projected_document[single_field] = document[single_field]
+    return projected_document
+
+class MongoBackend(object):
+
+    def __init__(self,mongo_url,database_name):
+        if not MongoClient:
+            raise ImportError("pymongo is required for the mongo tracking backend")
+        self.client = MongoClient(mongo_url, connect=False)
+        self.database_name = database_name
+        self.indexed_collections = set()
+
+    def get_database(self):
+        return self.client[self.database_name]
+
+    def get_collection(self,collection_name):
+        db = self.get_database()
+        if collection_name not in self.indexed_collections:
+            db[collection_name].create_index(INDEX_KEY)
+            self.indexed_collections.add(collection_name)
+        return db[collection_name]
+
+    def get_document(self,collection_name,doc_id,projection=None):
+        collection = self.get_collection(collection_name)
+        return collection.find_one({INDEX_KEY: doc_id},projection=projection)
+
+    def find_documents(self,collection_name,field_name,field_value):
+        collection = self.get_collection(collection_name)
+        return list(collection.find({field_name: field_value}))
+
+    def update_documents(self,collection_name,update_list,ordered=False):
+        if not update_list:
+            return 0
+        bulk_operations = []
+        for doc_id, set_fields, upsert in update_list:
+            bulk_operations.append(UpdateOne({INDEX_KEY: doc_id},{"$set":set_fields},upsert=upsert))
+        collection = self.get_collection(collection_name)
+        collection.bulk_write(bulk_operations,ordered=ordered)
+        return len(bulk_operations)
+
+class SqliteBackend(object):
+
+    def __init__(self,database_path):
+        database_dir = os.path.dirname(os.path.abspath(database_path))
+        if not os.path.exists(database_dir):
+            os.makedirs(database_dir)
+        self.database_path = database_path
+        self.local = threading.local()
+        self.created_collections = set()
+        for single_collection in TRACKING_COLLECTIONS:
+            self.create_collection(single_collection)
+
+    def get_connection(self):
+        connection = getattr(self.local,'connection',None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def create_collection(self,collection_name):
+        if collection_name in self.created_collections:
+            return
+        table_name = get_table_name(collection_name)
+        connection = self.get_connection()
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS " + table_name + " (" + INDEX_KEY + " TEXT PRIMARY KEY, " + PROJECT_KEY + " TEXT, document TEXT NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS " + get_table_name(collection_name + "_" + PROJECT_KEY) + " ON " + table_name + " (" + PROJECT_KEY + ")")
+        except sqlite3.OperationalError as sqlite_error:
+            raise ConnectionFailure("Could not create " + collection_name + " in " + self.database_path + ": " + str(sqlite_error))
+        self.created_collections.add(collection_name)
+
+    def get_document(self,collection_name,doc_id,projection=None):
+        self.create_collection(collection_name)
+        connection = self.get_connection()
+        try:
+            row = connection.execute("SELECT document FROM " + get_table_name(collection_name) + " WHERE " + INDEX_KEY + " = ?", (doc_id,)).fetchone()
+        except sqlite3.OperationalError as sqlite_error:
+            raise ConnectionFailure("Could not read " + collection_name + " from " + self.database_path + ": " + str(sqlite_error))
+        if not row:
+            return None
+        return project_document(json.loads(row[0]),projection)
+
+    def find_documents(self,collection_name,field_name,field_value):
+        self.create_collection(collection_name)
+        connection = self.get_connection()
+        table_name = get_table_name(collection_name)
+        try:
+            if field_name in (INDEX_KEY, PROJECT_KEY):
+                row_list = connection.execute("SELECT document FROM " + table_name + " WHERE " + field_name + " = ?", (field_value,)).fetchall()
+            else:
+                row_list = connection.execute("SELECT document FROM " + table_name).fetchall()
+        except sqlite3.OperationalError as sqlite_error:
+            raise ConnectionFailure("Could not read " + collection_name + " from " + self.database_path + ": " + str(sqlite_error))
+        document_list = []
+        for single_row in row_list:
+            single_document = json.loads(single_row[0])
+            if single_document.get(field_name) == field_value:
+                document_list.append(single_document)
+        return document_list
+
+    def update_documents(self,collection_name,update_list,ordered=False):
+        # all updates of a batch are applied in one transaction
+        if not update_list:
+            return 0
+        self.create_collection(collection_name)
+        connection = self.get_connection()
+        table_name = get_table_name(collection_name)
+        updated_documents = 0
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for doc_id, set_fields, upsert in update_list:
+                    row = connection.execute("SELECT document FROM " + table_name + " WHERE " + INDEX_KEY + " = ?", (doc_id,)).fetchone()
+                    if row:
+                        document = json.loads(row[0])
+                    elif upsert:
+                        document = {INDEX_KEY: doc_id}
+                    else:
+                        continue
+                    apply_set_fields(document,set_fields)
+                    project_id = document.get(PROJECT_KEY)
+                    if project_id is not None:
+                        project_id = str(project_id)
+                    connection.execute("INSERT OR REPLACE INTO " + table_name + " (" + INDEX_KEY + ", " + PROJECT_KEY + ", document) VALUES (?, ?, ?)", (doc_id, project_id, json.dumps(document,default=str)))
+                    updated_documents = updated_documents + 1
+                connection.execute("COMMIT")
+            except:
+                try:
+                    connection.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    pass
+                raise
+        except sqlite3.OperationalError as sqlite_error:
+            raise ConnectionFailure("Could not write " + collection_name + " to " + self.database_path + ": " + str(sqlite_error))
+        return updated_documents
+
+def get_table_name(collection_name):
+    return '"' + collection_name.replace('"','') + '"'
@@ -9,7 +9,6 @@ logging.getLogger("toil.jobStores.abstractJobStore").disabled = True
 logging.getLogger("toil.toilState").setLevel(logging.WARNING)
 from toil.common import Toil, safeUnpickleFromStream
 from toil.jobStores.fileJobStore import FileJobStore
-from toil.toilState import ToilState as toil_state
 from toil.job import Job
 from threading import Thread, Event
 from toil.cwl.cwltoil import CWL_INTERNAL_JOBS
@@ -22,9 +21,11 @@ import datetime
 import time
 import copy
 from subprocess import PIPE, Popen
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-from core_utils import read_pipeline_settings, run_command, print_error, create_roslin_yaml, convert_yaml_abs_path, check_if_env_is_empty, copy_outputs, save_yaml, load_yaml, merge_yaml_list, convert_to_snake_case, add_workflow_requirement
+from track_backend import MongoBackend, SqliteBackend, ConnectionFailure
+from track_watcher import create_worker_watcher, find_job_state_files, get_modification_time, ScandirWorkerWatcher, SharedWorkerWatcher, WORKER_APPEARED, WORKER_MODIFIED, WORKER_REMOVED
+from copy_engine import prune_copy_results, copy_path, get_copy_rate, sort_largest_first, CopyManifest, PUBLISH_REFLINK, COPY_MANIFEST_DIR_NAME
+from checksum_cache import read_json_cache, update_json_cache
+from core_utils import read_pipeline_settings, run_command, print_error, create_roslin_yaml, convert_yaml_abs_path, check_if_env_is_empty, create_file_list, save_yaml, load_yaml, merge_yaml_list, convert_to_snake_case, add_workflow_requirement
 import dill
 import json
 import sys
@@ -33,6 +34,11 @@ import copy
 import traceback
 import re
 import glob
+import threading
+import atexit
+import fcntl
+from collections import OrderedDict
+from multiprocessing.dummy import Pool as ThreadPool
 time_format="%Y-%m-%d %H:%M:%S"
 log_format="(%(current_time)s) [%(name)s:%(levelname)s] %(message)s"
 termination_file_name = "killed-by-user.json"
@@ -59,59 +65,499 @@ RUN_PROFILES_COLLECTION = "RunProfiles"
 RUN_DATA_COLLECTION = "RunData"
 ROSLIN_COPY_OUTPUTS_LOG = "roslin_copy_outputs.log"
 disable_mongo_logging = False
-client = None
+tracking_backend = None
+tracking_backend_lock = threading.Lock()
+run_data_info_cache = {}
+mongo_writer = None
+mongo_writer_lock = threading.Lock()
+MONGO_WRITE_QUEUE_SIZE = 5000
+MONGO_WRITE_MAX_RETRIES = 5
+MONGO_WRITE_RETRY_DELAY = 0.5
+MONGO_WRITE_MAX_RETRY_DELAY = 30
+MONGO_SPOOL_FILE_NAME = "roslin_mongo_spool.jsonl"
+MONGO_SPOOL_REPLAY_BATCH_SIZE = 1000
+MONGO_SPOOL_FAILED_SUFFIX = ".failed"
+tracker_service = None
+tracker_service_lock = threading.Lock()
+TRACKER_SERVICE_MAX_WORKERS = 8
+JOB_STORE_RESUME_DELAY = 5
+OUTPUT_PUBLISH_POLL_INTERVAL = 10
+OUTPUT_PUBLISH_MAX_WORKERS = 8
+OUTPUT_PUBLISH_MANIFEST_NAME = "roslin_output_publisher"
+OUTPUT_PUBLISH_STATE_FILE_NAME = "published_outputs.json"
 if 'ROSLIN_MONGO_DISABLE' in os.environ:
     ROSLIN_MONGO_DISABLE = os.environ['ROSLIN_MONGO_DISABLE']
     if not check_if_env_is_empty(ROSLIN_MONGO_DISABLE):
         disable_mongo_logging = True
-if not disable_mongo_logging:
-    client = MongoClient(MONGO_URL, connect=False)
+TRACKING_SQLITE_PATH = os.environ.get('ROSLIN_TRACKING_SQLITE')
 
-copy_outputs_resource_config = {"bam": (None, 4), "vcf": (None, 3), "maf": (1,2) , "qc": (2,2), "log": (1,1), "inputs": (1,1), "facets": (1,1)}
+# the results folders the publisher fills, all of them share its OUTPUT_PUBLISH_MAX_WORKERS threads
+copy_outputs_folders = ["bam", "vcf", "maf", "qc", "log", "inputs", "facets"]
 
 ### mongo wrappers ###
 
-def get_mongo_collection(logger,collection_name):
-    if client:
+def get_tracking_backend():
+    # created on first use, so importing track_utils does not set up a mongo client
+    global tracking_backend
+    if tracking_backend:
+        return tracking_backend
+    if disable_mongo_logging and check_if_env_is_empty(TRACKING_SQLITE_PATH):
+        return None
+    with tracking_backend_lock:
+        if not tracking_backend:
+            if not check_if_env_is_empty(TRACKING_SQLITE_PATH):
+                tracking_backend = SqliteBackend(TRACKING_SQLITE_PATH)
+            else:
+                tracking_backend = MongoBackend(MONGO_URL, MONGO_DATABASE)
+    return tracking_backend
+
+def merge_mongo_set_fields(pending_fields,new_fields):
+    # a whole field replaces its pending dotted children, a dotted path is folded into a pending parent
+    for single_path in new_fields:
+        single_value = new_fields[single_path]
+        path_prefix = single_path + "."
+        for pending_path in list(pending_fields.keys()):
+            if pending_path.startswith(path_prefix):
+                del pending_fields[pending_path]
+        path_parts = single_path.split(".")
+        parent_length = None
+        for part_index in range(1,len(path_parts)):
+            parent_path = ".".join(path_parts[:part_index])
+            if parent_path in pending_fields and isinstance(pending_fields[parent_path], dict):
+                parent_length = part_index
+                break
+        if parent_length:
+            nested_dict = pending_fields[".".join(path_parts[:parent_length])]
+            for single_part in path_parts[parent_length:-1]:
+                if not isinstance(nested_dict.get(single_part), dict):
+                    nested_dict[single_part] = {}
+                nested_dict = nested_dict[single_part]
+            nested_dict[path_parts[-1]] = single_value
+        else:
+            pending_fields[single_path] = single_value
+    return pending_fields
+
+class MongoWriter(object):
+
+    def __init__(self,max_queue_size=MONGO_WRITE_QUEUE_SIZE,max_retries=MONGO_WRITE_MAX_RETRIES):
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.pending = OrderedDict()
+        self.in_flight = set()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        self.logger = None
+        self.spool_path = None
+        self.spool_pending = False
+        self.mongo_down = False
+        self.reconnect_delay = MONGO_WRITE_RETRY_DELAY
+        self.reconnect_time = 0
+        self.metrics = {'queue_depth':0,'max_queue_depth':0,'queued':0,'coalesced':0,'written':0,'spooled':0,'failed':0,'retries':0,'batches':0,'last_write_latency':None,'total_write_latency':0.0}
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping = False
+        self.in_flight = set()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self,logger,collection_name,doc_id,set_fields,upsert):
+        if not set_fields:
+            return
+        set_fields = copy.deepcopy(set_fields)
+        set_fields.pop('_id',None)
+        doc_key = (collection_name,doc_id)
+        with self.condition:
+            self.start()
+            if logger:
+                self.logger = logger
+            while doc_key not in self.pending and len(self.pending) >= self.max_queue_size and self.thread.is_alive():
+                self.condition.wait(1)
+            if doc_key in self.pending:
+                pending_update = self.pending[doc_key]
+                merge_mongo_set_fields(pending_update['fields'],set_fields)
+                pending_update['upsert'] = pending_update['upsert'] or upsert
+                self.metrics['coalesced'] = self.metrics['coalesced'] + 1
+            else:
+                self.pending[doc_key] = {'fields':set_fields,'upsert':upsert}
+            self.metrics['queued'] = self.metrics['queued'] + 1
+            self.update_queue_depth()
+            self.condition.notify_all()
+
+    def update_queue_depth(self):
+        queue_depth = len(self.pending)
+        self.metrics['queue_depth'] = queue_depth
+        if queue_depth > self.metrics['max_queue_depth']:
+            self.metrics['max_queue_depth'] = queue_depth
+
+    def flush(self,collection_name=None,doc_id=None,timeout=None):
+        doc_key = (collection_name,doc_id)
+        end_time = None
+        if timeout:
+            end_time = time.time() + timeout
+        with self.condition:
+            while True:
+                if collection_name:
+                    is_pending = doc_key in self.pending or doc_key in self.in_flight
+                else:
+                    is_pending = self.pending or self.in_flight
+                if not is_pending or not self.thread or not self.thread.is_alive():
+                    return not is_pending
+                if end_time:
+                    remaining_time = end_time - time.time()
+                    if remaining_time <= 0:
+                        return False
+                    self.condition.wait(min(remaining_time,1))
+                else:
+                    self.condition.wait(1)
+
+    def stop(self,timeout=None):
+        self.flush(timeout=timeout)
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def replay_due(self):
+        if self.stopping or not self.spool_path:
+            return False
+        return (self.mongo_down or self.spool_pending) and time.time() >= self.reconnect_time
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping and not self.replay_due():
+                    self.condition.wait(1)
+                if not self.pending and self.stopping:
+                    return
+                write_batch = self.pending
+                self.pending = OrderedDict()
+                self.in_flight = set(write_batch.keys())
+                self.update_queue_depth()
+                logger = self.logger
+                self.condition.notify_all()
+            try:
+                self.write_batch(logger,write_batch)
+            except:
+                error_message = "Mongo writer failed to write " + str(len(write_batch)) + " document update(s)\n" + traceback.format_exc()
+                log(logger,"error",error_message)
+            with self.condition:
+                self.in_flight = set()
+                self.condition.notify_all()
+
+    def write_batch(self,logger,write_batch):
+        collection_updates = OrderedDict()
+        for single_key in write_batch:
+            collection_name, doc_id = single_key
+            pending_update = write_batch[single_key]
+            if collection_name not in collection_updates:
+                collection_updates[collection_name] = []
+            collection_updates[collection_name].append((doc_id,pending_update['fields'],pending_update['upsert']))
+        if not self.spool_path:
+            for collection_name in collection_updates:
+                self.write_operations(logger,collection_name,collection_updates[collection_name],self.max_retries)
+            return
+        if self.mongo_down and (self.stopping or time.time() < self.reconnect_time):
+            self.spool_updates(logger,collection_updates)
+            return
         try:
-            db = client[MONGO_DATABASE]
-            db[collection_name].create_index(index_key)
-            return db[collection_name]
+            if self.mongo_down or self.spool_pending or spool_has_updates(self.spool_path):
+                replay_mongo_spool(logger,self.spool_path)
+                self.set_mongo_up(logger)
+            for collection_name in list(collection_updates.keys()):
+                self.write_operations(logger,collection_name,collection_updates[collection_name],0)
+                del collection_updates[collection_name]
         except ConnectionFailure:
-            error_message = "Failed to get collection "+ collection_name + "\n" + traceback.format_exc()
+            self.set_mongo_down(logger)
+            self.spool_updates(logger,collection_updates)
+
+    def write_operations(self,logger,collection_name,update_list,max_retries):
+        retry_delay = MONGO_WRITE_RETRY_DELAY
+        retry_count = 0
+        while True:
+            write_start = time.time()
+            try:
+                get_tracking_backend().update_documents(collection_name,update_list)
+                write_latency = time.time() - write_start
+                with self.condition:
+                    self.metrics['written'] = self.metrics['written'] + len(update_list)
+                    self.metrics['batches'] = self.metrics['batches'] + 1
+                    self.metrics['last_write_latency'] = write_latency
+                    self.metrics['total_write_latency'] = self.metrics['total_write_latency'] + write_latency
+                return
+            except ConnectionFailure:
+                if self.spool_path:
+                    raise
+                if retry_count >= max_retries or self.stopping:
+                    error_message = "Failed to connect and write " + str(len(update_list)) + " mongo document update(s) to collection " + collection_name + " after " + str(retry_count) + " retries\n" + traceback.format_exc()
+                    break
+                retry_count = retry_count + 1
+                with self.condition:
+                    self.metrics['retries'] = self.metrics['retries'] + 1
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2,MONGO_WRITE_MAX_RETRY_DELAY)
+            except:
+                error_message = "Failed to write " + str(len(update_list)) + " mongo document update(s) to collection " + collection_name
+                write_error = traceback.format_exc()
+                if self.spool_path:
+                    error_message = error_message + self.keep_failed_updates(collection_name,update_list)
+                error_message = error_message + "\n" + write_error
+                break
+        with self.condition:
+            self.metrics['failed'] = self.metrics['failed'] + len(update_list)
+        log(logger,"error",error_message)
+
+    def keep_failed_updates(self,collection_name,update_list):
+        # rejected updates are kept next to the spool instead of being dropped
+        failed_path = self.spool_path + MONGO_SPOOL_FAILED_SUFFIX
+        try:
+            append_mongo_spool(failed_path,get_spool_records(collection_name,update_list))
+        except (IOError, OSError) as spool_error:
+            return ", could not keep them in " + failed_path + ": " + str(spool_error)
+        return ", kept them in " + failed_path
+
+    def spool_updates(self,logger,collection_updates):
+        spool_records = []
+        for collection_name in collection_updates:
+            spool_records.extend(get_spool_records(collection_name,collection_updates[collection_name]))
+        if not spool_records:
+            return
+        try:
+            append_mongo_spool(self.spool_path,spool_records)
+        except (IOError, OSError):
+            error_message = "Failed to spool " + str(len(spool_records)) + " mongo document update(s) to " + self.spool_path + "\n" + traceback.format_exc()
             log(logger,"error",error_message)
+            with self.condition:
+                self.metrics['failed'] = self.metrics['failed'] + len(spool_records)
+            return
+        with self.condition:
+            self.metrics['spooled'] = self.metrics['spooled'] + len(spool_records)
+
+    def set_mongo_down(self,logger):
+        if not self.mongo_down:
+            self.mongo_down = True
+            self.reconnect_delay = MONGO_WRITE_RETRY_DELAY
+            warning_message = "Mongo is unreachable, spooling tracking updates to " + self.spool_path + "\n" + traceback.format_exc()
+            log(logger,"warning",warning_message)
+        else:
+            self.reconnect_delay = min(self.reconnect_delay * 2,MONGO_WRITE_MAX_RETRY_DELAY)
+        self.reconnect_time = time.time() + self.reconnect_delay
+
+    def set_mongo_up(self,logger):
+        self.spool_pending = False
+        if self.mongo_down:
+            self.mongo_down = False
+            log(logger,"info","Mongo is reachable again, replayed spooled tracking updates from " + self.spool_path)
+
+    def get_metrics(self):
+        with self.condition:
+            metrics = dict(self.metrics)
+        metrics['average_write_latency'] = None
+        if metrics['batches']:
+            metrics['average_write_latency'] = metrics['total_write_latency'] / metrics['batches']
+        return metrics
+
+def spool_has_updates(spool_path):
+    try:
+        return os.path.getsize(spool_path) > 0
+    except OSError:
+        return False
+
+def get_spool_records(collection_name,update_list):
+    spool_records = []
+    for doc_id, set_fields, upsert in update_list:
+        spool_records.append({'collection':collection_name,'id':doc_id,'set':set_fields,'upsert':upsert,'time':get_current_time()})
+    return spool_records
+
+def append_mongo_spool(spool_path,spool_records):
+    spool_lines = []
+    for single_record in spool_records:
+        spool_lines.append(json.dumps(single_record,default=str) + "\n")
+    append_mongo_spool_lines(spool_path,spool_lines)
+
+def append_mongo_spool_lines(spool_path,spool_lines):
+    # one line per update, appended under a lock so the leader and its jobs can share a spool
+    if not spool_lines:
+        return
+    with open(spool_path,"a") as spool_file:
+        fcntl.flock(spool_file,fcntl.LOCK_EX)
+        try:
+            spool_file.write("".join(spool_lines))
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+        finally:
+            fcntl.flock(spool_file,fcntl.LOCK_UN)
+
+def rewrite_mongo_spool(spool_file,spool_lines):
+    spool_file.seek(0)
+    spool_file.write("".join(spool_lines))
+    spool_file.truncate()
+    spool_file.flush()
+    os.fsync(spool_file.fileno())
+
+def replay_mongo_spool(logger,spool_path):
+    # $set updates are idempotent, so a replay interrupted by another outage only keeps
+    # the updates it has not written yet. The updates mongo rejects, and unreadable
+    # lines, are moved to <spool>.failed so the spool does not retry them forever
+    if not get_tracking_backend() or not spool_has_updates(spool_path):
+        return 0
+    replayed_updates = 0
+    failed_path = spool_path + MONGO_SPOOL_FAILED_SUFFIX
+    with open(spool_path,"r+") as spool_file:
+        fcntl.flock(spool_file,fcntl.LOCK_EX)
+        try:
+            spool_lines = []
+            for single_line in spool_file:
+                # a line cut by a crash must not swallow the next appended update
+                if not single_line.endswith("\n"):
+                    single_line = single_line + "\n"
+                spool_lines.append(single_line)
+            written_lines = 0
+            collection_name = None
+            update_list = []
+            update_lines = []
+            unreadable_lines = []
+            try:
+                for line_number, single_line in enumerate(spool_lines):
+                    if not single_line.strip():
+                        continue
+                    try:
+                        single_record = json.loads(single_line)
+                    except ValueError:
+                        log(logger,"warning","Moving unreadable line " + str(line_number + 1) + " in " + spool_path + " to " + failed_path)
+                        unreadable_lines.append(single_line)
+                        continue
+                    if single_record['collection'] != collection_name or len(update_list) >= MONGO_SPOOL_REPLAY_BATCH_SIZE:
+                        replayed_updates = replayed_updates + write_spooled_updates(logger,failed_path,collection_name,update_list,update_lines)
+                        append_mongo_spool_lines(failed_path,unreadable_lines)
+                        written_lines = line_number
+                        collection_name = single_record['collection']
+                        update_list = []
+                        update_lines = []
+                        unreadable_lines = []
+                    update_list.append((single_record['id'],single_record['set'],single_record['upsert']))
+                    update_lines.append(single_line)
+                replayed_updates = replayed_updates + write_spooled_updates(logger,failed_path,collection_name,update_list,update_lines)
+                append_mongo_spool_lines(failed_path,unreadable_lines)
+            except ConnectionFailure:
+                rewrite_mongo_spool(spool_file,spool_lines[written_lines:])
+                raise
+            rewrite_mongo_spool(spool_file,[])
+        finally:
+            fcntl.flock(spool_file,fcntl.LOCK_UN)
+    return replayed_updates
+
+def write_spooled_updates(logger,failed_path,collection_name,update_list,spool_lines):
+    if not update_list:
+        return 0
+    try:
+        get_tracking_backend().update_documents(collection_name,update_list,ordered=True)
+    except ConnectionFailure:
+        raise
+    except:
+        error_message = "Failed to replay " + str(len(update_list)) + " spooled mongo document update(s) to collection " + collection_name + ", moved them to " + failed_path + "\n" + traceback.format_exc()
+        log(logger,"error",error_message)
+        append_mongo_spool_lines(failed_path,spool_lines)
+        return 0
+    return len(update_list)
+
+def get_mongo_writer():
+    global mongo_writer
+    if not get_tracking_backend():
+        return
+    with mongo_writer_lock:
+        if not mongo_writer:
+            mongo_writer = MongoWriter()
+    return mongo_writer
+
+def queue_mongo_update(logger,collection_name,doc_id,set_fields,upsert):
+    writer = get_mongo_writer()
+    if writer:
+        writer.put(logger,collection_name,doc_id,set_fields,upsert)
+
+def set_mongo_spool(logger,log_folder):
+    writer = get_mongo_writer()
+    if not writer or not log_folder:
+        return
+    with writer.condition:
+        if logger:
+            writer.logger = logger
+        writer.spool_path = os.path.join(log_folder,MONGO_SPOOL_FILE_NAME)
+        if spool_has_updates(writer.spool_path):
+            writer.spool_pending = True
+            writer.start()
+        writer.condition.notify_all()
+
+def flush_mongo_writes(logger=None,timeout=None):
+    if not mongo_writer:
+        return True
+    flushed = mongo_writer.flush(timeout=timeout)
+    if logger:
+        log_mongo_writer_metrics(logger)
+    return flushed
+
+def get_mongo_writer_metrics():
+    if not mongo_writer:
+        return None
+    return mongo_writer.get_metrics()
+
+def log_mongo_writer_metrics(logger):
+    metrics = get_mongo_writer_metrics()
+    if not metrics:
+        return
+    average_latency = metrics['average_write_latency']
+    if average_latency != None:
+        average_latency = round(average_latency,3)
+    metrics_message = "Mongo writer: queue depth " + str(metrics['queue_depth']) + " (max " + str(metrics['max_queue_depth']) + "), " + str(metrics['written']) + " written, " + str(metrics['spooled']) + " spooled, " + str(metrics['coalesced']) + " coalesced, " + str(metrics['failed']) + " failed, " + str(metrics['retries']) + " retries, average write latency " + str(average_latency) + "s"
+    log(logger,"debug",metrics_message)
+
+def stop_mongo_writer():
+    if mongo_writer:
+        mongo_writer.stop()
+
+atexit.register(stop_mongo_writer)
 
 def get_mongo_document(logger,collection_name,project_uuid):
-    if client:
+    backend = get_tracking_backend()
+    if backend:
+        if mongo_writer:
+            mongo_writer.flush(collection_name,project_uuid)
         try:
-            db, single_doc_query = get_db_and_doc_query(logger,collection_name,project_uuid)
-            single_doc = db[collection_name].find_one(single_doc_query)
+            single_doc = backend.get_document(collection_name,project_uuid)
             return single_doc
         except ConnectionFailure:
             error_message = "Failed to update mongo document for project [ " + project_uuid + " ] to collection "+ collection_name + "\n" + traceback.format_exc()
             log(logger,"error",error_message)
 
 def update_mongo_document(logger,collection_name,project_uuid,updated_document):
-    if client and isinstance(updated_document, dict):
+    if get_tracking_backend() and isinstance(updated_document, dict):
         if updated_document:
             mongo_safe_dict = make_mongo_safe_dict(logger,updated_document)
-            try:
-                mongo_doc_id = None
-                db, single_doc_query = get_db_and_doc_query(logger,collection_name,project_uuid)
-                single_doc = get_mongo_document(logger,collection_name,project_uuid)
-                if mongo_safe_dict:
-                    if single_doc == None:
-                        mongo_doc_id = db[collection_name].replace_one(filter=single_doc_query,upsert=True,replacement=mongo_safe_dict)
-                    else:
-                        mongo_doc_id = db[collection_name].update_one(filter=single_doc_query, update={"$set":mongo_safe_dict})
-                return mongo_doc_id
-            except ConnectionFailure:
-                error_message = "Failed to connect and update mongo document for project [ " + project_uuid + " ] to collection "+ collection_name + "\n" + traceback.format_exc()
-                log(logger,"error",error_message)
-            except:
-                error_message = "Failed to update mongo document for project [ " + project_uuid + " ] to collection "+ collection_name + "\n" + str(mongo_safe_dict) + "\n" + traceback.format_exc()
-                log(logger,"error",error_message)
-                sys.exit(1)
+            queue_mongo_update(logger,collection_name,project_uuid,mongo_safe_dict,True)
+
+def bulk_update_mongo_documents(logger,collection_name,document_updates,upsert):
+    # document_updates maps a document id to the fields to $set, keys may be dotted paths
+    if get_tracking_backend() and document_updates:
+        for single_doc_id in document_updates:
+            set_fields = {}
+            for single_path, single_value in document_updates[single_doc_id].items():
+                set_fields[single_path] = make_mongo_safe_value(logger,single_value)
+            queue_mongo_update(logger,collection_name,single_doc_id,set_fields,upsert)
+
+def make_mongo_safe_value(logger,value):
+    if isinstance(value, dict):
+        return make_mongo_safe_dict(logger,value)
+    if isinstance(value, tuple):
+        return make_mongo_safe_tuple(logger,value)
+    if isinstance(value, list):
+        return make_mongo_safe_list(logger,value)
+    if isinstance(value, (str, unicode, float, int, bool)):
+        return value
+    return None
 
 def make_mongo_key_safe(key):
     return key.replace("$","").replace(".","")
@@ -171,14 +617,6 @@ def make_mongo_safe_dict(logger,dict_obj):
         dict_obj.update(updated_dict)
     return dict_obj
 
-def get_db_and_doc_query(logger,collection_name,project_uuid):
-    if client:
-        db = client[MONGO_DATABASE]
-        collection = get_mongo_collection(logger,collection_name)
-        single_doc_id = project_uuid
-        single_doc_query = {index_key: single_doc_id}
-        return db,single_doc_query
-
 ### logging wrappers ###
 
 def add_stream_handler(logger,stream_format,logging_level):
@@ -243,6 +681,20 @@ def get_time_difference(first_time,second_time):
     return time_difference
 
 
+def epoch_to_time_string(epoch_time):
+    if epoch_time == None:
+        return None
+    return datetime.datetime.fromtimestamp(epoch_time).strftime(time_format)
+
+def time_to_epoch(time_value):
+    if time_value == None or isinstance(time_value, (int, float)):
+        return time_value
+    time_obj = datetime.datetime.strptime(time_value,time_format)
+    return time.mktime(time_obj.timetuple())
+
+def get_epoch_duration(first_epoch,second_epoch):
+    return abs(int(second_epoch - first_epoch))
+
 def get_time_difference_from_now(time_obj_str):
     current_time_str = get_current_time()
     time_difference = get_time_difference(current_time_str,time_obj_str)
@@ -262,11 +714,10 @@ def time_difference_to_string(time_difference,max_number_of_time_units):
 
 def track_job(track_job_flag,params,job_params,restart,logger):
     try:
-        track_job_helper(track_job_flag,params,job_params,restart,logger)
+        return track_job_helper(track_job_flag,params,job_params,restart,logger)
     except:
         error_message = "Tracker failed.\n"+traceback.format_exc()
         log(logger,"error",error_message)
-        sys.exit(error_message)
 
 
 def track_job_helper(track_job_flag,params,job_params,restart,logger):
@@ -278,45 +729,56 @@ def track_job_helper(track_job_flag,params,job_params,restart,logger):
     run_attempt = params['run_attempt']
     full_job_store_path = os.path.join(tmp_dir,job_store_path)
     poll_interval = job_params['poll_interval']
+    set_mongo_spool(logger,params['log_folder'])
     roslin_track = RoslinTrack(job_store_path,project_uuid,work_dir,tmp_dir,restart,run_attempt,False,logger)
-    roslin_track.check_status(poll_interval,track_job_flag)
+    return get_tracker_service().register(roslin_track,poll_interval,track_job_flag)
 
 
-def update_batch_system_run_results(logger,project_uuid,status_change,job_dict):
-    run_result_doc = get_mongo_document(logger,RUN_RESULTS_COLLECTION,project_uuid)
-    if not run_result_doc:
+def get_run_data_info(logger,project_uuid):
+    if project_uuid in run_data_info_cache:
+        return run_data_info_cache[project_uuid]
+    backend = get_tracking_backend()
+    if not backend:
         return
-    run_data_doc = construct_run_data_doc(project_uuid,run_result_doc['pipelineJobStoreId'],run_result_doc['pipelineVersion'],run_result_doc['projectId'])
+    run_data_fields = {'pipelineJobStoreId':1,'pipelineVersion':1,'projectId':1}
+    try:
+        run_data_info = backend.get_document(RUN_RESULTS_COLLECTION,project_uuid,run_data_fields)
+    except ConnectionFailure:
+        error_message = "Failed to get run info for project [ " + project_uuid + " ] from collection "+ RUN_RESULTS_COLLECTION + "\n" + traceback.format_exc()
+        log(logger,"error",error_message)
+        return
+    if run_data_info:
+        run_data_info_cache[project_uuid] = run_data_info
+    return run_data_info
+
+def update_batch_system_run_results(logger,project_uuid,status_change):
+    run_data_info = get_run_data_info(logger,project_uuid)
+    if not run_data_info:
+        return
+    run_data_updates = {}
+    run_result_update = {}
     for single_job_key in status_change:
         single_job_obj = status_change[single_job_key]['job_obj']
-        single_tool_status = single_job_obj['single_tool_status']
-        job_name = single_job_obj['job_name']
-        job_id = single_job_obj['job_id']
         status = single_job_obj['status']
-        tool_status = job_dict[job_name]
-        job_id, job_doc = construct_job_doc(tool_status,job_name,job_id,status)
+        job_id, job_doc = construct_job_doc(single_job_obj['job_record'],status)
         job_info = job_doc.pop("jobInfo")
         job_run_data_id = str(project_uuid) + "_" + str(job_id)
-        job_run_data_doc = copy.deepcopy(run_data_doc)
+        job_run_data_doc = construct_run_data_doc(project_uuid,run_data_info['pipelineJobStoreId'],run_data_info['pipelineVersion'],run_data_info['projectId'])
         job_run_data_doc['jobData'] = job_info
-        try:
-            update_mongo_document(logger,RUN_DATA_COLLECTION,job_run_data_id,job_run_data_doc)
-        except:
-            pass
-        run_result_doc['batchSystemJobs'][job_id] = job_doc
-    run_result_doc['timestamp']['lastUpdated'] = get_current_time()
-    update_mongo_document(logger,RUN_RESULTS_COLLECTION,project_uuid,run_result_doc)
+        run_data_updates[job_run_data_id] = job_run_data_doc
+        run_result_update['batchSystemJobs.' + job_id] = job_doc
+    run_result_update['timestamp.lastUpdated'] = get_current_time()
+    bulk_update_mongo_documents(logger,RUN_DATA_COLLECTION,run_data_updates,True)
+    bulk_update_mongo_documents(logger,RUN_RESULTS_COLLECTION,{project_uuid:run_result_update},False)
 
 def update_workflow_run_results(logger,project_uuid,workflow_jobs_dict):
-    run_result_doc = get_mongo_document(logger,RUN_RESULTS_COLLECTION,project_uuid)
-    if not run_result_doc:
-        return
+    run_result_update = {}
     for single_workflow_job_key in workflow_jobs_dict:
         single_workflow_job = workflow_jobs_dict[single_workflow_job_key]
         job_id, job_doc = construct_workflow_run_results_doc(single_workflow_job)
-        run_result_doc['workflowJobs'][job_id] = job_doc
-    run_result_doc['timestamp']['lastUpdated'] = get_current_time()
-    update_mongo_document(logger,RUN_RESULTS_COLLECTION,project_uuid,run_result_doc)
+        run_result_update['workflowJobs.' + job_id] = job_doc
+    run_result_update['timestamp.lastUpdated'] = get_current_time()
+    bulk_update_mongo_documents(logger,RUN_RESULTS_COLLECTION,{project_uuid:run_result_update},False)
 
 def modify_all_running_or_pending_jobs(job_dict,updated_status):
     status_name_dict = get_status_names()
@@ -414,11 +876,13 @@ def construct_workflow_run_results_doc(single_job_info):
     finished_time = single_job_info['finished_time']
     duration = None
     job_params = single_job_info['job_params']
-    if started_time and finished_time:
-        duration = get_time_difference(started_time, finished_time)['total_seconds']
+    started_epoch = time_to_epoch(started_time)
+    finished_epoch = time_to_epoch(finished_time)
+    if started_epoch and finished_epoch:
+        duration = get_epoch_duration(started_epoch, finished_epoch)
     else:
-        if started_time:
-            duration = get_time_difference_from_now(started_time)['total_seconds']
+        if started_epoch:
+            duration = get_epoch_duration(started_epoch, time.time())
     workflow_run_result = {
         "name": name,
         "status": status,
@@ -429,9 +893,9 @@ def construct_workflow_run_results_doc(single_job_info):
         "logFile": None,
         "restarts": [],
         "timestamp": {
-            "started": started_time,
-            "finished": finished_time,
-            "submitted": submitted_time,
+            "started": epoch_to_time_string(started_epoch),
+            "finished": epoch_to_time_string(finished_epoch),
+            "submitted": epoch_to_time_string(time_to_epoch(submitted_time)),
             "lastUpdated": get_current_time(),
             "duration": duration
         }
@@ -499,10 +963,15 @@ def construct_run_data_doc(job_uuid,jobstore_uuid,pipeline_version,project_id):
 
 def construct_project_doc(logger,pipeline_name, pipeline_version, project_id, project_path, job_uuid, jobstore_uuid, work_dir, workflow, input_files, restart, project_results):
 
-    project_collection = get_mongo_collection(logger,PROJECTS_COLLECTION)
-    if not project_collection:
+    backend = get_tracking_backend()
+    if not backend:
         return
-    previous_projects = project_collection.find({'projectId':project_id})
+    try:
+        previous_projects = backend.find_documents(PROJECTS_COLLECTION,'projectId',project_id)
+    except ConnectionFailure:
+        error_message = "Failed to get previous runs of project [ " + project_id + " ] from collection "+ PROJECTS_COLLECTION + "\n" + traceback.format_exc()
+        log(logger,"error",error_message)
+        previous_projects = []
     previous_runs = []
     for single_project in previous_projects:
         previous_runs.append(single_project['pipelineJobId'])
@@ -585,55 +1054,39 @@ def get_status_names():
     status_name_dict = {'running':'RUN','pending':'PEND','done':'DONE','exit':'EXIT','unknown':'UNKWN'}
     return status_name_dict
 
-def construct_job_doc(single_tool_status,job_name,job_id,status):
+def construct_job_doc(job_record,status):
 
-    worker_obj = single_tool_status['workers'][job_id]
-    submitted_dict = single_tool_status['submitted']
-    done_dict = single_tool_status['done']
-    exit_dict = single_tool_status['exit']
-    started_time = None
-    finished_time = None
-    submitted_time = None
-    last_updated = None
+    job_id = job_record.job_id
+    started_time = job_record.started
+    finished_time = job_record.finished
+    submitted_time = job_record.submitted
+    last_updated = job_record.last_modified
     duration = None
-    job_info = None
-    if "started" in worker_obj:
-        started_time = worker_obj["started"]
-    if "last_modified" in worker_obj:
-        last_updated = worker_obj["last_modified"]
-    else:
-        last_updated = get_current_time()
-    if job_id in done_dict:
-        finished_time = done_dict[job_id]
-    if job_id in  submitted_dict:
-        submitted_time = submitted_dict[job_id]
-    if job_id in exit_dict:
-        finished_time = exit_dict[job_id]
-    if 'job_info' in worker_obj:
-        job_info = worker_obj['job_info']
+    if last_updated == None:
+        last_updated = time.time()
     if started_time and finished_time:
-        duration = get_time_difference(started_time, finished_time)['total_seconds']
+        duration = get_epoch_duration(started_time, finished_time)
     else:
         if started_time:
-            duration = get_time_difference_from_now(started_time)['total_seconds']
+            duration = get_epoch_duration(started_time, time.time())
         if finished_time:
             started_time = finished_time
-            duration = get_time_difference(started_time, finished_time)['total_seconds']
+            duration = 0
     job_doc = {
-        "name": job_name,
+        "name": job_record.tool_key,
         "status": status,
-        "memory_requested": worker_obj['memory'],
-        "memory": worker_obj['job_memory'],
-        "cpu": worker_obj['job_cpu'],
-        "disk": worker_obj['disk'],
-        "cores_requested": worker_obj['cores'],
-        "jobInfo": job_info,
+        "memory_requested": job_record.memory,
+        "memory": job_record.job_memory,
+        "cpu": job_record.job_cpu,
+        "disk": job_record.disk,
+        "cores_requested": job_record.cores,
+        "jobInfo": job_record.job_info,
         "logFile": None,
         "timestamp": {
-            "started": started_time,
-            "finished": finished_time,
-            "submitted": submitted_time,
-            "lastUpdated": last_updated,
+            "started": epoch_to_time_string(started_time),
+            "finished": epoch_to_time_string(finished_time),
+            "submitted": epoch_to_time_string(submitted_time),
+            "lastUpdated": epoch_to_time_string(last_updated),
             "duration": duration
         }
 
@@ -741,7 +1194,7 @@ class RoslinWorkflow(object):
                     logging_level = logging.DEBUG
                 else:
                     logging_level = logging.INFO
-                logger = logging.getLogger(workflow_name)
+                logger = logging.getLogger(params.get('logger_name',workflow_name))
                 log_file = workflow_name +".log"
                 log_path = os.path.join(log_folder,log_file)
                 logger.setLevel(logging_level)
@@ -788,8 +1241,6 @@ class RoslinWorkflow(object):
         results_path = params['results_dir']
         if results_path:
             logger = dill.loads(params['logger'])
-            num_groups = int(params['num_groups'])
-            num_pairs = int(params['num_pairs'])
             restart = params['restart']
             results_overwrite = params['force_overwrite_results']
             project_id = params['project_id']
@@ -801,9 +1252,13 @@ class RoslinWorkflow(object):
                     log(logger,"error",error_message)
                     sys.exit(1)
                 else:
-                    info_message = "Removing folder: " + results_path
+                    # keep the copies that are still current, the publisher skips them
+                    kept_files, removed_files = prune_copy_results(results_path)
+                    info_message = "Removed " + str(removed_files) + " outdated file(s) from folder: " + results_path + ", kept " + str(kept_files) + " unchanged file(s)"
                     log(logger,"info",info_message)
-                    shutil.rmtree(results_path)
+                    publish_state_path = get_publish_state_path(results_path)
+                    if os.path.exists(publish_state_path):
+                        os.remove(publish_state_path)
             if not os.path.exists(results_path):
                 os.makedirs(results_path)
             log_file = ROSLIN_COPY_OUTPUTS_LOG
@@ -815,30 +1270,8 @@ class RoslinWorkflow(object):
                 archive_log = find_unique_name_in_dir(log_file_path,log_error_folder)
                 log_failed = os.path.join(log_error_folder,archive_log)
                 shutil.move(log_file_path,log_failed)
-            copy_outputs_config = params['copy_outputs_config']
-            for single_key in copy_outputs_resource_config.keys():
-                if single_key not in copy_outputs_config:
-                    continue
-                num_workers, num_threads = copy_outputs_resource_config[single_key]
-                job_params = self.set_default_job_params()
-                job_params['copy_output_dir'] = results_path
-                job_params['folder_key'] = single_key
-                if single_key == 'bam':
-                    num_workers = num_groups
-                if single_key == 'vcf':
-                    num_workers = num_pairs
-                job_params['max_workers'] = num_workers
-                job_params['worker_threads'] = num_threads
-                job_params['cores'] = num_threads
-                job_params['memory'] = '2G'
-                for single_worker_num in range(0,num_workers):
-                    worker_job_params = copy.deepcopy(job_params)
-                    job_name = "roslin_copy_outputs_"+single_key+"_"+str(single_worker_num)
-                    worker_job_params['name'] = job_name
-                    worker_job_params['worker_num'] = single_worker_num
-                    roslin_job_obj = RoslinJob(copy_outputs,params,worker_job_params)
-                    roslin_job_obj.__dict__['jobName'] = job_name
-                    last_workflow_job.addChild(roslin_job_obj)
+            # the outputs are published by the OutputPublisher in the leader as each sub workflow finishes
+            params['publish_outputs'] = True
         return last_workflow_job
 
     def roslin_analysis(self,last_workflow_job):
@@ -864,13 +1297,8 @@ class RoslinWorkflow(object):
         '--sample_summary',sample_summary_glob]
         if debug_mode:
             roslin_analysis_command.append('--debug')
-        job_params = self.set_default_job_params()
-        job_name = "roslin_analysis"
-        job_params['name'] = job_name
-        job_params['shell'] = False
-        job_params['command'] = roslin_analysis_command
-        roslin_analysis_job = self.create_job(self.run_process,params,job_params,job_name)
-        last_workflow_job.addFollowOn(roslin_analysis_job)
+        # the analysis reads the results dir, the leader runs it once the publisher is done
+        params['analysis_command'] = roslin_analysis_command
         return last_workflow_job
 
     def set_default_job_params(self):
@@ -1026,12 +1454,13 @@ class RoslinWorkflow(object):
         if test_mode:
             roslin_runner_command.extend(["-t"])
         track_job_flag = Event()
-        roslin_track_worker = Thread(target=track_job, args=(track_job_flag,params,job_params,job_restart,logger))
         track_job_flag.set()
-        roslin_track_worker.start()
+        tracker_registration = track_job(track_job_flag,params,job_params,job_restart,logger)
         cwl_process_ret_code = self.run_process_helper(roslin_runner_command,False,job_name)
         track_job_flag.clear()
-        roslin_track_worker.join()
+        if tracker_registration:
+            get_tracker_service().unregister(tracker_registration)
+        flush_mongo_writes(logger)
         error_code = cwl_process_ret_code
         return error_code
 
@@ -1041,6 +1470,13 @@ class RoslinWorkflow(object):
         job_name = job_params['name']
         return self.run_process_helper(command,shell,job_name)
 
+    def run_analysis(self,logger):
+        analysis_command = self.params.get('analysis_command')
+        if not analysis_command:
+            return 0
+        log(logger,'info',"Running roslin analysis on " + str(self.params['results_dir']))
+        return self.run_process_helper(analysis_command,False,"roslin_analysis")
+
     def run_process_helper(self,command,shell,job_name):
         params = self.params
         logger = dill.loads(params['logger'])
@@ -1362,6 +1798,8 @@ class ReadOnlyFileJobStore(FileJobStore):
         self.default_retry_count = 1
         self.retry_jobs = []
         self.job_cache = {}
+        self.job_file_stats = {}
+        self.changed_job_ids = []
         self.stats_cache = {}
         self.job_store_path = path
         self.logger = None
@@ -1382,18 +1820,60 @@ class ReadOnlyFileJobStore(FileJobStore):
             job = pickle.load(file_handle)
         return job
 
+    def get_job_file_stat(self,job_file):
+        try:
+            job_file_stat = os.stat(job_file)
+        except OSError:
+            return None
+        return (job_file_stat.st_mtime, job_file_stat.st_size, job_file_stat.st_ino)
+
     def setJobCache(self):
-        job_cache = {}
-        for single_job in self.jobs():
+        self.job_cache = {}
+        self.job_file_stats = {}
+        return self.updateJobCache()
+
+    def updateJobCache(self):
+        job_cache = self.job_cache
+        job_file_stats = self.job_file_stats
+        failed_jobs = []
+        retry_jobs = []
+        changed_job_ids = []
+        seen_job_ids = set()
+        for temp_dir in self._tempDirectories():
+            job_store_id = self._getRelativePath(temp_dir)
+            job_file = self._getJobFileName(job_store_id)
+            job_file_stat = self.get_job_file_stat(job_file)
+            if not job_file_stat:
+                continue
+            seen_job_ids.add(job_store_id)
+            if job_file_stats.get(job_store_id) == job_file_stat:
+                continue
+            try:
+                with open(job_file, 'rb') as file_handle:
+                    single_job = pickle.load(file_handle)
+            except Exception:
+                # the leader may be rewriting the job, pick it up on the next scan
+                continue
+            job_file_stats[job_store_id] = job_file_stat
             job_id = single_job.jobStoreID
             job_cache[job_id] = single_job
+            changed_job_ids.append(job_id)
             if single_job.logJobStoreFileID != None:
                 failed_job = copy.deepcopy(single_job)
-                self.failed_jobs.append(failed_job)
+                failed_jobs.append(failed_job)
             if single_job.remainingRetryCount == self.default_retry_count:
                 retry_job = copy.deepcopy(single_job)
-                self.retry_jobs.append(retry_job)
-        self.job_cache = job_cache
+                retry_jobs.append(retry_job)
+        for job_store_id in list(job_file_stats.keys()):
+            if job_store_id not in seen_job_ids:
+                del job_file_stats[job_store_id]
+                if job_store_id in job_cache:
+                    del job_cache[job_store_id]
+                changed_job_ids.append(job_store_id)
+        self.failed_jobs = failed_jobs
+        self.retry_jobs = retry_jobs
+        self.changed_job_ids = changed_job_ids
+        return changed_job_ids
 
     def getFailedJobs(self):
         return self.failed_jobs
@@ -1427,8 +1907,14 @@ class ReadOnlyFileJobStore(FileJobStore):
                         self.stats_cache[stats_file_path] = None
         return stats_file_list
 
+    def forgetStatsFile(self, stats_file_path):
+        if stats_file_path in self.stats_cache:
+            del self.stats_cache[stats_file_path]
+
     def delete(self,job_store_id):
-        del self.job_cache[job_store_id]
+        # forget the file stat too, so the job is read again if it shows up on the next scan
+        self.job_cache.pop(job_store_id,None)
+        self.job_file_stats.pop(job_store_id,None)
 
     def deleteFile(self, jobStoreFileID):
         pass
@@ -1466,6 +1952,118 @@ class ReadOnlyFileJobStore(FileJobStore):
     def _getTempFile(self, jobStoreID=None):
         pass
 
+# The jobs toil would process next, the same as the updatedJobs of a ToilState
+# built from the root job, but never touching the job graphs and only walking
+# again the part of the graph above the jobs whose files changed. The ready jobs
+# under each job are kept, a changed job drops its own and the ones of its
+# predecessors. Successors of a job that were deleted are ignored, as clean()
+# would remove them from the stack.
+class TrackedToilState(object):
+
+    def __init__(self):
+        self.subtree_cache = {}
+        self.predecessor_ids = {}
+        self.updatedJobs = set()
+
+    def invalidate(self,changed_job_ids):
+        invalidated_ids = set()
+        pending_ids = list(changed_job_ids)
+        while pending_ids:
+            job_id = pending_ids.pop()
+            if job_id in invalidated_ids:
+                continue
+            invalidated_ids.add(job_id)
+            self.subtree_cache.pop(job_id,None)
+            pending_ids.extend(self.predecessor_ids.get(job_id,()))
+
+    def get_subtree(self,job_graph,job_cache):
+        job_id = job_graph.jobStoreID
+        if job_id in self.subtree_cache:
+            return self.subtree_cache[job_id]
+        ready_jobs = {}
+        waiting_jobs = {}
+        job_stack = job_graph.stack
+        if job_graph.command is None:
+            for successor_list in job_stack:
+                for successor_node in successor_list:
+                    self.predecessor_ids.setdefault(successor_node.jobStoreID,set()).add(job_id)
+            job_stack = [[x for x in successor_list if x.jobStoreID in job_cache] for successor_list in job_stack]
+            job_stack = [x for x in job_stack if x]
+        if job_graph.command is not None or job_graph.checkpoint is not None or job_graph.services or not job_stack:
+            ready_jobs[job_id] = job_graph
+        else:
+            for successor_node in job_stack[-1]:
+                successor_id = successor_node.jobStoreID
+                if successor_node.predecessorNumber > 1:
+                    # ready once all its predecessors are done, resolved from the root
+                    waiting_jobs.setdefault(successor_id,set()).add(job_id)
+                    continue
+                successor_ready_jobs, successor_waiting_jobs = self.get_subtree(job_cache[successor_id],job_cache)
+                ready_jobs.update(successor_ready_jobs)
+                merge_waiting_jobs(waiting_jobs,successor_waiting_jobs)
+        subtree = (ready_jobs, waiting_jobs)
+        self.subtree_cache[job_id] = subtree
+        return subtree
+
+    def update(self,root_job,job_cache,changed_job_ids):
+        self.invalidate(changed_job_ids)
+        root_ready_jobs, root_waiting_jobs = self.get_subtree(root_job,job_cache)
+        ready_jobs = dict(root_ready_jobs)
+        waiting_jobs = {}
+        merge_waiting_jobs(waiting_jobs,root_waiting_jobs)
+        scheduled_ids = set()
+        scheduled_new_job = True
+        while scheduled_new_job:
+            scheduled_new_job = False
+            for successor_id in list(waiting_jobs.keys()):
+                if successor_id in scheduled_ids or successor_id not in job_cache:
+                    continue
+                successor_graph = job_cache[successor_id]
+                finished_predecessors = waiting_jobs[successor_id] | set(successor_graph.predecessorsFinished)
+                if len(finished_predecessors) < successor_graph.predecessorNumber:
+                    continue
+                scheduled_ids.add(successor_id)
+                scheduled_new_job = True
+                successor_ready_jobs, successor_waiting_jobs = self.get_subtree(successor_graph,job_cache)
+                ready_jobs.update(successor_ready_jobs)
+                merge_waiting_jobs(waiting_jobs,successor_waiting_jobs)
+        self.updatedJobs = set([(job_graph, 0) for job_graph in ready_jobs.values()])
+        return self.updatedJobs
+
+def merge_waiting_jobs(waiting_jobs,new_waiting_jobs):
+    for successor_id in new_waiting_jobs:
+        if successor_id not in waiting_jobs:
+            waiting_jobs[successor_id] = set()
+        waiting_jobs[successor_id].update(new_waiting_jobs[successor_id])
+
+
+JOB_PENDING = 0
+JOB_RUNNING = 1
+JOB_DONE = 2
+JOB_EXIT = 3
+JOB_STATE_NAMES = ('pending','running','done','exit')
+
+class RoslinJobRecord(object):
+    # timestamps are epoch floats, they are only formatted when a document is built
+    __slots__ = ('tool_key','job_id','state','reported_state','submitted','started','finished','last_modified','disk','memory','cores','job_stream','job_info','job_memory','job_cpu','log_path')
+
+    def __init__(self,tool_key,job_id,submitted,disk,memory,cores,job_stream,job_info):
+        self.tool_key = tool_key
+        self.job_id = job_id
+        self.state = None
+        self.reported_state = None
+        self.submitted = submitted
+        self.started = None
+        self.finished = None
+        self.last_modified = None
+        self.disk = disk
+        self.memory = memory
+        self.cores = cores
+        self.job_stream = job_stream
+        self.job_info = job_info
+        self.job_memory = None
+        self.job_cpu = None
+        self.log_path = None
 
 class RoslinTrack():
 
@@ -1473,18 +2071,29 @@ class RoslinTrack():
         self.job_store_path = job_store_path
         self.work_dir = work_dir
         self.tmp_dir = tmp_dir
-        self.jobs_path = {}
+        self.stream_jobs = {}
         self.job_info_to_update = {}
         self.run_attempt = run_attempt
         self.workflow_id = ''
         self.jobs = {}
         self.retry_job_ids = {}
-        self.current_jobs = []
-        self.failed_jobs = []
+        self.current_jobs = set()
+        self.active_jobs = {}
+        self.changed_jobs = OrderedDict()
+        self.failed_jobs = set()
         self.worker_jobs = {}
+        self.job_stream_index = {}
+        self.pending_stats = {}
+        self.worker_watcher = None
+        self.unresolved_workers = {}
         self.project_uuid = project_uuid
         self.job_store_obj = None
+        self.root_job = None
+        self.toil_state_obj = None
+        self.pending_job_ids = []
         self.job_store_resume_attempts = 5000
+        self.job_store_resume_attempt = 0
+        self.job_store_resume_time = 0
         self.restart = restart
         self.restart_num = 2
         self.logger = logger
@@ -1517,122 +2126,143 @@ class RoslinTrack():
     def resume_job_store(self):
         logger = self.logger
         job_store_path = self.job_store_path
-        read_only_job_store_obj = ReadOnlyFileJobStore(job_store_path)
-        read_only_job_store_obj.resume()
-        read_only_job_store_obj.setJobCache()
-        job_store_cache = read_only_job_store_obj.job_cache
-        try:
-            root_job = read_only_job_store_obj.clean(jobCache=job_store_cache)
-        except:
-            retry_message = "Could not clean job store from jobCache, retrying"
-            root_job = read_only_job_store_obj.clean()
-            log(logger,'debug',retry_message)
+        read_only_job_store_obj = self.job_store_obj
+        if read_only_job_store_obj:
+            # the changes of a poll that failed to load the root job are kept for the next one
+            changed_job_ids = self.pending_job_ids + read_only_job_store_obj.updateJobCache()
+            self.pending_job_ids = changed_job_ids
+            if not changed_job_ids and self.root_job:
+                return {"job_store":read_only_job_store_obj,"root_job":self.root_job,"changed_job_ids":changed_job_ids}
+        else:
+            read_only_job_store_obj = ReadOnlyFileJobStore(job_store_path)
+            read_only_job_store_obj.resume()
+            changed_job_ids = read_only_job_store_obj.setJobCache()
+        # the job store is only read, clean() would edit the cached job graphs
+        root_job = read_only_job_store_obj.loadRootJob()
         self.job_store_obj = read_only_job_store_obj
-        return {"job_store":read_only_job_store_obj,"root_job":root_job}
+        self.root_job = root_job
+        self.pending_job_ids = []
+        return {"job_store":read_only_job_store_obj,"root_job":root_job,"changed_job_ids":changed_job_ids}
 
     def get_file_modification_time(self,file_path):
-        if os.path.exists(file_path):
-            last_modified_epoch = os.path.getmtime(file_path)
-            last_modified = datetime.datetime.fromtimestamp(last_modified_epoch).strftime(time_format)
-        else:
-            last_modified = get_current_time()
-        return last_modified
+        try:
+            return os.path.getmtime(file_path)
+        except OSError:
+            return time.time()
 
     def mark_job_as_failed(self,job_id,job_name):
         failed_job_list = self.failed_jobs
         job_dict = self.jobs
-        current_time = get_current_time()
         if job_id not in failed_job_list:
-            failed_job_list.append(job_id)
+            failed_job_list.add(job_id)
             if job_name not in CWL_INTERNAL_JOBS or self.show_cwl_internal:
-                job_key = self.make_key_from_file(job_name,True)
-                if job_key in job_dict:
-                    tool_dict = job_dict[job_key]
-                    if job_id in tool_dict['submitted']:
-                        tool_dict['exit'][job_id] = current_time
-                        if job_id in tool_dict['done']:
-                            del tool_dict['done'][job_id]
+                if job_id in job_dict:
+                    job_record = job_dict[job_id]
+                    job_record.finished = time.time()
+                    self.set_job_state(job_record,JOB_EXIT)
+
+    def set_job_state(self,job_record,job_state):
+        # only jobs whose state changed since the last poll are looked at when reporting
+        if job_record.state == job_state:
+            return
+        job_record.state = job_state
+        job_id = job_record.job_id
+        self.changed_jobs[job_id] = job_record
+        if job_state == JOB_PENDING or job_state == JOB_RUNNING:
+            self.active_jobs[job_id] = job_record
+        elif job_id in self.active_jobs:
+            del self.active_jobs[job_id]
+
+    def get_job_stream_id(self,job_stream_path):
+        job_stream_parts = job_stream_path.split("/")
+        if len(job_stream_parts) > 2:
+            return job_stream_parts[2]
+        return job_stream_path
+
+    def index_job_stream(self,job_stream_path,job_record):
+        job_stream_id = self.get_job_stream_id(job_stream_path)
+        if job_stream_id not in self.job_stream_index:
+            self.job_stream_index[job_stream_id] = []
+        self.job_stream_index[job_stream_id].append(job_record)
+        if job_stream_id in self.pending_stats:
+            job_memory, job_cpu = self.pending_stats[job_stream_id]
+            self.set_worker_stats(job_stream_id,job_memory,job_cpu)
+
+    def set_worker_stats(self,job_stream_id,job_memory,job_cpu):
+        if job_stream_id not in self.job_stream_index:
+            self.pending_stats[job_stream_id] = (job_memory,job_cpu)
+            return
+        if job_stream_id in self.pending_stats:
+            del self.pending_stats[job_stream_id]
+        for job_record in self.job_stream_index[job_stream_id]:
+            job_record.job_memory = job_memory
+            job_record.job_cpu = job_cpu
+
     def check_stats(self):
-        jobs_path = self.jobs_path
-        job_dict = self.jobs
         logger = self.logger
-        stats_file_list = self.job_store_obj.getStatsFiles()
+        job_store_obj = self.job_store_obj
+        stats_file_list = job_store_obj.getStatsFiles()
         for single_stats_path in stats_file_list:
             try:
                 with open(single_stats_path, 'rb') as single_file:
                     single_stats_data = json.load(single_file)
-                    if 'jobs' in single_stats_data:
-                        for single_job_index, single_job in enumerate(single_stats_data['jobs']):
-                            single_job_worker_log = single_stats_data['workers']['logsToMaster'][single_job_index]['text']
-                            single_job_stream_path = single_job_worker_log.split(" ")[1]
-                            if single_job_stream_path in jobs_path:
-                                tool_key = jobs_path[single_job_stream_path]
-                                if tool_key in job_dict:
-                                    tool_dict = job_dict[tool_key]
-                                    for single_job_key in tool_dict['workers']:
-                                        single_worker_obj = tool_dict['workers'][single_job_key]
-                                        if single_worker_obj["job_stream"]:
-                                            if single_worker_obj["job_stream"].split("/")[2] == single_job_stream_path.split("/")[2]:
-                                                single_worker_obj["job_memory"] = single_job['memory']
-                                                single_worker_obj["job_cpu"] = single_job['clock']
-            except IOError:
+            except (IOError, ValueError):
+                # not fully written yet, read it again on the next poll
+                job_store_obj.forgetStatsFile(single_stats_path)
                 continue
+            if 'jobs' in single_stats_data:
+                for single_job_index, single_job in enumerate(single_stats_data['jobs']):
+                    single_job_worker_log = single_stats_data['workers']['logsToMaster'][single_job_index]['text']
+                    single_job_stream_path = single_job_worker_log.split(" ")[1]
+                    job_stream_id = self.get_job_stream_id(single_job_stream_path)
+                    self.set_worker_stats(job_stream_id,single_job['memory'],single_job['clock'])
 
     def check_jobs(self,track_job_flag):
         logger = self.logger
         job_dict = self.jobs
-        jobs_path = self.jobs_path
+        stream_jobs = self.stream_jobs
         job_info_to_update = self.job_info_to_update
         job_store_resume_attempts = self.job_store_resume_attempts
         retry_job_ids = self.retry_job_ids
-        current_attempt = 0
-        job_store_obj = None
-        while not job_store_obj and track_job_flag.is_set():
-            try:
-                job_store_obj = self.resume_job_store()
-            except:
-                retry_message = "Jobstore not created yet, trying again ( Attempt " +str(current_attempt) + " / " + str(job_store_resume_attempts) + " )"
-                log(logger,"debug",retry_message)
-                if current_attempt < job_store_resume_attempts:
-                    current_attempt = current_attempt + 1
-                    time.sleep(5)
-                else:
-                    error_message = "Jobstore failed to create, check the workflow logs.\n"+traceback.format_exc()
-                    log(logger,"error",error_message)
-                    sys.exit(error_message)
-        if not track_job_flag.is_set() or not job_store_obj:
+        # one attempt per poll, the tracker service threads are shared by every project
+        if time.time() < self.job_store_resume_time:
+            return
+        try:
+            job_store_obj = self.resume_job_store()
+        except:
+            current_attempt = self.job_store_resume_attempt
+            if current_attempt >= job_store_resume_attempts:
+                error_message = "Jobstore failed to create, check the workflow logs.\n"+traceback.format_exc()
+                raise RuntimeError(error_message)
+            retry_message = "Jobstore not created yet, trying again ( Attempt " +str(current_attempt) + " / " + str(job_store_resume_attempts) + " )"
+            log(logger,"debug",retry_message)
+            self.job_store_resume_attempt = current_attempt + 1
+            self.job_store_resume_time = time.time() + JOB_STORE_RESUME_DELAY
+            return
+        self.job_store_resume_attempt = 0
+        if not track_job_flag.is_set():
             return
-        current_jobs = []
+        current_jobs = set()
         job_store = job_store_obj["job_store"]
         root_job = job_store_obj["root_job"]
-        job_store_cache = job_store.job_cache
+        changed_job_ids = job_store_obj["changed_job_ids"]
         self.workflow_id = job_store.config.workflowID
-        toil_state_obj = None
-        current_attempt = 0
-        while not toil_state_obj and track_job_flag.is_set():
-            try:
-                root_job_id = root_job.jobStoreID
-                if not job_store.check_if_job_exists(root_job_id):
-                    return
-                if current_attempt != 0:
-                    job_store.setJobCache()
-                    toil_state(job_store,root_job)
-                else:
-                    job_store_cache = job_store.job_cache
-                    toil_state_obj = toil_state(job_store,root_job,jobCache=job_store_cache)
-            except:
-                retry_message = "Jobstore not loaded properly, trying again ( Attempt " +str(current_attempt) + " / " + str(job_store_resume_attempts) + " )\n"+traceback.format_exc()
-                log(logger,"debug",retry_message)
-                if current_attempt < job_store_resume_attempts:
-                    current_attempt = current_attempt + 1
-                    time.sleep(5)
-                else:
-                    error_message = "Jobstore failed to load, check the workflow logs.\n"+traceback.format_exc()
-                    log(logger,"error",error_message)
-                    sys.exit(error_message)
-        if not track_job_flag.is_set() or not toil_state_obj:
+        if not changed_job_ids and self.toil_state_obj:
+            self.check_job_info_to_update(job_store)
             return
-        current_time = get_current_time()
+        if not self.toil_state_obj:
+            self.toil_state_obj = TrackedToilState()
+        toil_state_obj = self.toil_state_obj
+        try:
+            toil_state_obj.update(root_job,job_store.job_cache,changed_job_ids)
+        except:
+            # a job graph caught mid update by the leader, walk the whole graph on the next poll
+            debug_message = "Jobstore not loaded properly, trying again on the next poll\n"+traceback.format_exc()
+            log(logger,"debug",debug_message)
+            self.toil_state_obj = None
+            self.root_job = None
+            return
+        current_time = time.time()
         for single_job in job_store.getFailedJobs():
             job_name = single_job.jobName
             failed_job_log_file = single_job.logJobStoreFileID
@@ -1664,44 +2294,39 @@ class RoslinTrack():
                 job_id = self.create_job_id(jobstore_id,retry_count)
                 job_stream = None
                 job_info = None
-                if single_job.command:
-                    job_stream = single_job.command.split(" ")[1]
+                job_command = single_job.command
+                if job_command is None:
+                    job_command = single_job.checkpoint
+                if job_command:
+                    job_stream = job_command.split(" ")[1]
                 job_key = self.make_key_from_file(job_name,True)
+                current_jobs.add(job_id)
+                if job_id in job_dict:
+                    continue
                 if job_stream:
-                    jobs_path[job_stream] = job_key
                     job_stream_obj = self.read_job_stream(job_store,job_stream)
                     job_info = job_stream_obj['job_info']
+                job_record = RoslinJobRecord(job_key,job_id,current_time,job_disk,job_memory,job_cores,job_stream,job_info)
+                job_dict[job_id] = job_record
+                if job_stream:
+                    if job_stream not in stream_jobs:
+                        stream_jobs[job_stream] = []
+                    stream_jobs[job_stream].append(job_record)
                     if not job_info:
-                        single_job_info_to_update = {'job_key':job_key,'job_id':job_id}
-                        job_info_to_update[job_stream] = single_job_info_to_update
-                current_jobs.append(job_id)
-                worker_obj = {"disk":job_disk,"memory":job_memory,"cores":job_cores,"job_stream":job_stream,"job_info":job_info,'job_memory':None,'job_cpu':None}
-                if job_key not in job_dict:
-                    job_dict[job_key] = {'submitted':{},'workers':{},'done':{},'exit':{}}
-                tool_dict = job_dict[job_key]
-                if job_id not in tool_dict['submitted']:
-                    tool_dict['submitted'][job_id] = current_time
-                if job_id not in tool_dict['workers']:
-                    tool_dict['workers'][job_id] = worker_obj
-        updated_list = []
-        for single_job_to_update in job_info_to_update.keys():
-            job_stream = single_job_to_update
-            job_key = job_info_to_update[single_job_to_update]['job_key']
-            job_id = job_info_to_update[single_job_to_update]['job_id']
+                        job_info_to_update[job_stream] = job_record
+                    self.index_job_stream(job_stream,job_record)
+                self.set_job_state(job_record,JOB_PENDING)
+        self.current_jobs = current_jobs
+        self.check_job_info_to_update(job_store)
+
+    def check_job_info_to_update(self,job_store):
+        job_info_to_update = self.job_info_to_update
+        for job_stream in list(job_info_to_update.keys()):
             job_stream_obj = self.read_job_stream(job_store,job_stream)
             job_info = job_stream_obj['job_info']
             if job_info:
-                tool_dict = job_dict[job_key]
-                worker_obj = tool_dict['workers'][job_id]
-                worker_obj['job_info'] = job_info
-                tool_dict['workers'][job_id] = worker_obj
-                updated_list.append(single_job_to_update)
-        for single_job_updated in updated_list:
-            if single_job_updated in job_info_to_update:
-                del job_info_to_update[single_job_updated]
-        self.job_info_to_update = job_info_to_update
-        self.jobs_path = jobs_path
-        self.current_jobs = current_jobs
+                job_info_to_update[job_stream].job_info = job_info
+                del job_info_to_update[job_stream]
 
     def make_key_from_file(self,job_name,use_basename):
         work_dir = self.work_dir
@@ -1737,182 +2362,133 @@ class RoslinTrack():
 
         return {"job_id":job_id,"job_info":job_info}
 
-    def read_worker_log(self,worker_log_path):
+    def read_worker_log(self,worker_log_path,worker_event=WORKER_APPEARED):
         worker_jobs = self.worker_jobs
+        unresolved_workers = self.unresolved_workers
         logger = self.logger
-        job_dict = self.jobs
-        jobs_path = self.jobs_path
-        read_only_job_store_obj = self.job_store_obj
-        current_time = get_current_time()
+        stream_jobs = self.stream_jobs
+        current_time = time.time()
+        if worker_event == WORKER_REMOVED:
+            if worker_log_path in unresolved_workers:
+                del unresolved_workers[worker_log_path]
+            return
         worker_log_key = self.make_key_from_file(worker_log_path,False)
         if os.path.isfile(worker_log_path):
             update_worker_jobs = False
             last_modified = self.get_file_modification_time(worker_log_path)
             if worker_log_key not in worker_jobs:
-                worker_info = None
                 worker_directory = os.path.dirname(worker_log_path)
-                list_of_tools = []
-                for root, dirs, files in os.walk(worker_directory):
-                    for single_file in files:
-                        if single_file == '.jobState':
-                            job_state = {}
-                            job_info = {}
-                            job_name = ''
-                            job_state_path = os.path.join(root,single_file)
-                            tool_key = None
-                            job_stream_path = ""
-                            if os.path.exists(job_state_path):
-                                with open(job_state_path,'rb') as job_state_file:
-                                    job_state_contents = dill.load(job_state_file)
-                                    job_state = job_state_contents
-                                    job_stream_path = job_state_contents['jobName']
-                                    if job_stream_path in jobs_path:
-                                        tool_key = jobs_path[job_stream_path]
-                            if tool_key:
-                                if tool_key in job_dict:
-                                    tool_dict = job_dict[tool_key]
-                                    for single_job_key in tool_dict['workers']:
-                                        single_worker_obj = tool_dict['workers'][single_job_key]
-                                        if single_worker_obj["job_stream"] == job_stream_path:
-                                            update_worker_jobs = True
-                                            worker_info = {'job_state':job_state,'log_path':worker_log_path,'started':current_time,'last_modified': last_modified}
-                                            single_worker_obj.update(worker_info)
-                                            tool_info = (tool_key,single_job_key)
-                                            list_of_tools.append(tool_info)
-                            else:
-                                update_worker_jobs = False
+                worker_records = []
+                for job_state_path in find_job_state_files(worker_directory):
+                    job_records = None
+                    if os.path.exists(job_state_path):
+                        with open(job_state_path,'rb') as job_state_file:
+                            job_state_contents = dill.load(job_state_file)
+                            job_stream_path = job_state_contents['jobName']
+                            job_records = stream_jobs.get(job_stream_path)
+                    if job_records:
+                        update_worker_jobs = True
+                        for job_record in job_records:
+                            job_record.log_path = worker_log_path
+                            job_record.started = current_time
+                            job_record.last_modified = last_modified
+                            if job_record.job_id in self.active_jobs:
+                                self.set_job_state(job_record,JOB_RUNNING)
+                            worker_records.append(job_record)
+                    else:
+                        update_worker_jobs = False
                 if update_worker_jobs:
-                    worker_jobs[worker_log_key] = {'list_of_tools':list_of_tools}
+                    worker_jobs[worker_log_key] = worker_records
+                    if worker_log_path in unresolved_workers:
+                        del unresolved_workers[worker_log_path]
+                else:
+                    unresolved_workers[worker_log_path] = worker_log_key
             else:
-                worker_jobs_tool_list = worker_jobs[worker_log_key]['list_of_tools']
-                for single_tool,single_job_key in worker_jobs_tool_list:
-                    worker_info = job_dict[single_tool]['workers'][single_job_key]
-                    worker_info['last_modified'] = last_modified
+                for job_record in worker_jobs[worker_log_key]:
+                    job_record.last_modified = last_modified
 
 
     def check_for_running(self):
-        work_dir = self.work_dir
-        job_dict = self.jobs
-        workflow_id = self.workflow_id
-        for root, dirs, files in os.walk(work_dir):
-            for single_file in files:
-                if single_file == "worker_log.txt":
-                    worker_log_path = os.path.join(root,single_file)
-                    try:
-                        worker_info = self.read_worker_log(worker_log_path)
-                    except:
-                        pass
-
-    def check_for_finished_jobs(self):
-        job_dict = self.jobs
-        current_jobs = self.current_jobs
-        current_time = get_current_time()
-        finished_jobs = False
-        for single_tool_name in job_dict:
-            single_tool = job_dict[single_tool_name]
-            submitted_dict = single_tool['submitted']
-            for single_job in submitted_dict:
-                if single_job not in single_tool['done']:
-                    if single_job not in current_jobs:
-                        finished_jobs = True
-                        self.check_stats()
-                        if single_job not in single_tool['exit']:
-                            single_tool['done'][single_job] = current_time
-    def get_pending_and_running_jobs(self,submitted_dict,done_dict,exit_dict,workers_dict):
         logger = self.logger
-        pending_dict = {}
-        running_dict = {}
-        current_time = get_current_time()
-        for single_job in submitted_dict:
-            if single_job not in done_dict and single_job not in exit_dict:
-                if single_job in workers_dict:
-                    single_worker_obj = workers_dict[single_job]
-                    if 'started' not in single_worker_obj:
-                        pending_dict[single_job] = current_time
-                    else:
-                        started_time = single_worker_obj['started']
-                        last_modified = single_worker_obj['last_modified']
-                        running_obj = {'started':started_time,'last_modified':last_modified}
-                        running_dict[single_job] = running_obj
-                else:
-                    error_message = str(single_job) + " not found in worker dictionary"
-                    log(logger,'error',error_message)
-
-        return {'pending':pending_dict,'running':running_dict}
+        work_dir = self.work_dir
+        if not self.worker_watcher:
+            self.worker_watcher = create_worker_watcher(work_dir)
+        try:
+            worker_events = self.worker_watcher.poll_events()
+        except OSError:
+            debug_message = "Could not watch " + str(work_dir) + ", falling back to scanning.\n" + traceback.format_exc()
+            log(logger,"debug",debug_message)
+            self.worker_watcher.close()
+            self.worker_watcher = ScandirWorkerWatcher(work_dir)
+            worker_events = self.worker_watcher.poll_events()
+        # workers whose job was not tracked yet when they appeared
+        for worker_log_path in list(self.unresolved_workers.keys()):
+            worker_events.append((WORKER_MODIFIED,worker_log_path))
+        for worker_event, worker_log_path in worker_events:
+            try:
+                worker_info = self.read_worker_log(worker_log_path,worker_event)
+            except:
+                pass
 
+    def close(self):
+        if self.worker_watcher:
+            self.worker_watcher.close()
+            self.worker_watcher = None
 
-    def prepare_job_status(self):
-        job_dict = self.jobs
+    def check_for_finished_jobs(self):
         current_jobs = self.current_jobs
-        job_status ={}
-        for single_tool_name in job_dict:
-            single_tool = job_dict[single_tool_name]
-            submitted_dict = single_tool['submitted']
-            workers_dict = single_tool['workers']
-            exit_dict = single_tool['exit']
-            done_dict = single_tool['done']
-            pending_and_running_dict = self.get_pending_and_running_jobs(submitted_dict, done_dict, exit_dict, workers_dict)
-            pending_dict = pending_and_running_dict['pending']
-            running_dict = pending_and_running_dict['running']
-            job_status[single_tool_name] = {'submitted':submitted_dict,'running':running_dict,'exit':exit_dict,'done':done_dict,'pending':pending_dict}
-        return job_status
+        current_time = time.time()
+        for single_job in list(self.active_jobs.keys()):
+            if single_job not in current_jobs:
+                job_record = self.active_jobs[single_job]
+                job_record.finished = current_time
+                self.set_job_state(job_record,JOB_DONE)
 
     def check_status(self, sleep_time, track_job_flag):
         logger = self.logger
         project_uuid = self.project_uuid
-        job_status = None
         while track_job_flag.is_set():
-            new_job_status = self.check_status_change(job_status,track_job_flag)
-            if new_job_status:
-                job_status = copy.deepcopy(new_job_status)
+            self.check_status_change(track_job_flag)
             time.sleep(sleep_time)
+        self.close()
 
-    def check_status_change(self,job_status,track_job_flag):
+    def check_status_change(self,track_job_flag):
         logger = self.logger
         project_uuid = self.project_uuid
         self.check_jobs(track_job_flag)
-        if not track_job_flag.is_set():
+        if not track_job_flag.is_set() or not self.job_store_obj:
             return
         self.check_for_running()
         self.check_stats()
         self.check_for_finished_jobs()
-        new_job_status = self.prepare_job_status()
-        status_change = self.get_change_status(job_status,new_job_status)
-        jobs_dict = self.jobs
+        status_change = self.get_change_status()
         if status_change:
-            update_batch_system_run_results(logger,project_uuid,status_change,jobs_dict)
+            update_batch_system_run_results(logger,project_uuid,status_change)
             self.print_change_status(status_change)
-        return new_job_status
+        return self.jobs
 
-    def get_change_status(self,old_job_status, new_job_status):
+    def get_change_status(self):
         status_format = {'running':{'message':'{} is now running'},
                        'exit':{'message':'{} has exited'},
                        'done':{'message':'{} has finished'},
                        'pending':{'message':'{} is now pending'}}
-        status_type = status_format.keys()
         status_name_dict = get_status_names()
+        changed_jobs = self.changed_jobs
+        self.changed_jobs = OrderedDict()
         status_change = {}
-        for single_tool in new_job_status:
-            single_tool_obj = new_job_status[single_tool]
-            for single_status in status_type:
-                single_tool_status = single_tool_obj[single_status]
-                if single_tool_status:
-                    for single_job_id in single_tool_status.keys():
-                        update_running_last_modified = False
-                        update_status = False
-                        if single_status == 'running':
-                            update_running_last_modied = True
-                        if not old_job_status or single_tool not in old_job_status or single_status not in old_job_status[single_tool] or single_job_id not in old_job_status[single_tool][single_status]:
-                            update_status = True
-                        if update_status or update_running_last_modified:
-                            status_template = status_format[single_status]['message']
-                            message = None
-                            if update_status:
-                                job_name = single_tool + '( ID: ' + single_job_id + ' )'
-                                message = status_template.format(job_name)
-                            status = status_name_dict[single_status]
-                            job_obj = {'single_tool_status':single_tool_status,'job_name':single_tool,'job_id':single_job_id,'status':status}
-                            status_change[single_job_id] = {'message':message,'job_obj':job_obj}
+        for single_job_id in changed_jobs:
+            job_record = changed_jobs[single_job_id]
+            if job_record.reported_state == job_record.state:
+                continue
+            job_record.reported_state = job_record.state
+            single_tool = job_record.tool_key
+            single_status = JOB_STATE_NAMES[job_record.state]
+            status_template = status_format[single_status]['message']
+            job_name = single_tool + '( ID: ' + single_job_id + ' )'
+            message = status_template.format(job_name)
+            status = status_name_dict[single_status]
+            job_obj = {'job_name':single_tool,'job_id':single_job_id,'status':status,'job_record':job_record}
+            status_change[single_job_id] = {'message':message,'job_obj':job_obj}
         return status_change
 
     def print_change_status(self,status_change):
@@ -1923,57 +2499,259 @@ class RoslinTrack():
             if single_job_message:
                 log(logger,'info',single_job_message)
 
-    def print_job_status(self,job_status):
-        logger = self.logger
-        if not job_status:
+class TrackerRegistration(object):
+
+    def __init__(self,roslin_track,poll_interval,track_job_flag):
+        self.roslin_track = roslin_track
+        self.poll_interval = poll_interval
+        self.track_job_flag = track_job_flag
+        self.jobs = None
+        self.next_poll = 0
+        self.busy = False
+        self.failed = False
+
+# polls every registered RoslinTrack from one loop on a bounded thread pool, trackers
+# of the same work directory share a worker watcher and all of them share the mongo writer
+class RoslinTrackerService(object):
+
+    def __init__(self,max_workers=TRACKER_SERVICE_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.registrations = []
+        self.shared_watchers = {}
+        self.condition = threading.Condition()
+        self.pool = None
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
             return
-        overview_status_list = []
-        status_list = []
-        status_dict = {'running':{'header':'Running:','status':'','total':0},
-                       'exit':{'header':'Exit:','status':'','total':0},
-                       'done':{'header':'Done:','status':'','total':0},
-                       'pending':{'header':'Pending:','status':'','total':0}}
-        status_items = status_dict.keys()
-        log(logger,'info',job_status)
-        for single_tool in job_status:
-            single_tool_obj = job_status[single_tool]
-            for single_status_key in status_dict:
-                single_tool_status = single_tool_obj[single_status_key]
-                single_status_dict = status_dict[single_status_key]
-                tool_status_num = 0
-                tool_status_str = single_status_dict['status']
-                if single_status_key == 'running':
-                    if len(single_tool_status) != 0:
-                        tool_status_str = tool_status_str + "\t- " + str(single_tool) + "\n"
-                    for single_running_job_key in single_tool_status:
-                        single_running_job = single_tool_status[single_running_job_key]
-                        last_modified = single_running_job['last_modified']
-                        time_difference = get_time_difference(last_modified)
-                        time_difference_string = time_difference_to_string(time_difference,2)
-                        tool_status_str = tool_status_str + "\t\t- [ last modified: " + time_difference_string + " ago ]\n"
-                        tool_status_num = tool_status_num + 1
-                    if tool_status_num != 0:
-                        tool_status_str = tool_status_str + "\t\t- Total: " + str(tool_status_num) + "\n"
-                else:
-                    tool_status_num = len(single_tool_status)
-                    if tool_status_num != 0:
-                        job_or_jobs_str = "jobs"
-                        if tool_status_num == 1:
-                            job_or_jobs_str = "job"
-                        tool_status_str = tool_status_str + "\t- " + str(single_tool) + " [ "+str(tool_status_num) + " " + job_or_jobs_str + " ]\n"
-                single_status_dict['total'] = single_status_dict['total'] + tool_status_num
-                single_status_dict['status'] = tool_status_str
-        total_jobs = 0
-        for single_status_key in status_dict:
-            single_status_dict = status_dict[single_status_key]
-            status_jobs = single_status_dict["total"]
-            total_jobs = total_jobs + single_status_dict["total"]
-            if status_jobs != 0:
-                status_header = single_status_dict['header']
-                status_str = status_header + "\n" + single_status_dict['status']
-                status_jobs = status_header + " " + str(status_jobs)
-                overview_status_list.append(status_jobs)
-                status_list.append(status_str)
-        overview_status = "Total Job(s): " + str(total_jobs) + " ( " + " ".join(overview_status_list) + " )"
-        status = overview_status + "\n" +"\n".join(status_list)
-        log(logger,'info',status)
\ No newline at end of file
+        if not self.pool:
+            self.pool = ThreadPool(self.max_workers)
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def register(self,roslin_track,poll_interval,track_job_flag):
+        registration = TrackerRegistration(roslin_track,poll_interval,track_job_flag)
+        work_dir = roslin_track.work_dir
+        with self.condition:
+            if work_dir not in self.shared_watchers:
+                self.shared_watchers[work_dir] = SharedWorkerWatcher(work_dir)
+            roslin_track.worker_watcher = self.shared_watchers[work_dir].subscribe()
+            self.registrations.append(registration)
+            self.start()
+            self.condition.notify_all()
+        return registration
+
+    def unregister(self,registration):
+        with self.condition:
+            if registration in self.registrations:
+                self.registrations.remove(registration)
+            while registration.busy:
+                self.condition.wait(1)
+            self.condition.notify_all()
+        registration.roslin_track.close()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.registrations:
+                    self.thread = None
+                    return
+                current_time = time.time()
+                next_poll = current_time + 1
+                for single_registration in self.registrations:
+                    if single_registration.busy:
+                        continue
+                    if single_registration.next_poll <= current_time:
+                        single_registration.busy = True
+                        self.pool.apply_async(self.poll_tracker,(single_registration,))
+                    else:
+                        next_poll = min(next_poll,single_registration.next_poll)
+                self.condition.wait(max(next_poll - time.time(),0.05))
+
+    def poll_tracker(self,registration):
+        roslin_track = registration.roslin_track
+        try:
+            track_job_flag = registration.track_job_flag
+            if track_job_flag.is_set():
+                job_dict = roslin_track.check_status_change(track_job_flag)
+                if job_dict:
+                    registration.jobs = job_dict
+        except:
+            error_message = "Tracker failed for " + str(roslin_track.job_store_path) + "\n" + traceback.format_exc()
+            log(roslin_track.logger,"error",error_message)
+            registration.failed = True
+        finally:
+            with self.condition:
+                registration.busy = False
+                registration.next_poll = time.time() + registration.poll_interval
+                if registration.failed and registration in self.registrations:
+                    self.registrations.remove(registration)
+                self.condition.notify_all()
+
+def get_tracker_service():
+    global tracker_service
+    with tracker_service_lock:
+        if not tracker_service:
+            tracker_service = RoslinTrackerService()
+    return tracker_service
+
+### output publisher ###
+
+def get_publish_state_path(results_dir):
+    return os.path.join(results_dir,COPY_MANIFEST_DIR_NAME,OUTPUT_PUBLISH_STATE_FILE_NAME)
+
+def get_output_publish_groups(params):
+    # a folder under a sub workflow output dir is published once its output-meta.json is written,
+    # everything else ( logs, inputs ) is published when the leader finishes
+    work_dir = params['project_work_dir']
+    output_dir = os.path.abspath(params['output_dir'])
+    out_dir = params['results_dir']
+    output_config = params['copy_outputs_config']
+    publish_groups = []
+    for folder_key in copy_outputs_folders:
+        if folder_key not in output_config:
+            continue
+        for single_folder_elem in output_config[folder_key]:
+            dst_base_dir = os.path.join(out_dir,folder_key)
+            if "input_folder" in single_folder_elem:
+                src_dir = os.path.join(work_dir,single_folder_elem["input_folder"])
+            else:
+                src_dir = work_dir
+            if "output_folder" in single_folder_elem:
+                dst_dir = os.path.join(dst_base_dir,single_folder_elem["output_folder"])
+            else:
+                dst_dir = dst_base_dir
+            marker = None
+            src_relpath = os.path.relpath(os.path.abspath(src_dir),output_dir)
+            if not src_relpath.startswith(os.pardir) and src_relpath != os.curdir:
+                job_folder = src_relpath.split(os.sep)[0]
+                if job_folder != old_jobs_folder:
+                    marker = os.path.join(output_dir,job_folder,'output-meta.json')
+            publish_groups.append({'key':folder_key,'source':src_dir,'destination':dst_dir,'patterns':single_folder_elem["patterns"],'marker':marker})
+    return publish_groups
+
+def publish_output_file(publish_item):
+    src_path, dst_dir, manifest, publish_mode = publish_item
+    try:
+        copied_files = copy_path(src_path,dst_dir,manifest,publish_mode)
+        return {'source':src_path,'destination':dst_dir,'files':copied_files,'error':None}
+    except:
+        return {'source':src_path,'destination':dst_dir,'files':[],'error':traceback.format_exc()}
+
+class OutputPublisher(object):
+
+    def __init__(self,params,logger,poll_interval=OUTPUT_PUBLISH_POLL_INTERVAL):
+        self.params = params
+        self.poll_interval = poll_interval
+        self.results_dir = params['results_dir']
+        self.publish_mode = params.get('results_publish_mode') or PUBLISH_REFLINK
+        self.publish_groups = get_output_publish_groups(params)
+        self.publish_state_path = get_publish_state_path(self.results_dir)
+        self.published = read_json_cache(self.publish_state_path)
+        self.manifest = CopyManifest(self.results_dir,OUTPUT_PUBLISH_MANIFEST_NAME)
+        self.logger = logging.getLogger("roslin_output_publisher")
+        log_file_path = os.path.join(params['log_folder'],ROSLIN_COPY_OUTPUTS_LOG)
+        if params['debug_mode']:
+            self.logger.setLevel(logging.DEBUG)
+            add_file_handler(self.logger,log_file_path,None,logging.DEBUG)
+        else:
+            self.logger.setLevel(logging.INFO)
+            add_file_handler(self.logger,log_file_path,None,logging.INFO)
+        self.leader_logger = logger
+        self.pool = None
+        self.thread = None
+        self.stop_event = Event()
+        self.failed_files = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.pool = ThreadPool(OUTPUT_PUBLISH_MAX_WORKERS)
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll(False)
+            except:
+                error_message = "Output publisher failed\n" + traceback.format_exc()
+                log(self.logger,"error",error_message)
+
+    def stop(self):
+        "stop polling and publish everything that is left, returns the number of files that failed"
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if not self.pool:
+            self.pool = ThreadPool(OUTPUT_PUBLISH_MAX_WORKERS)
+        try:
+            self.poll(True)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        return self.failed_files
+
+    def poll(self,final):
+        ready_groups = {}
+        current_time = time.time()
+        for single_group in self.publish_groups:
+            marker = single_group['marker']
+            if not marker:
+                if final:
+                    ready_groups.setdefault(None,[]).append(single_group)
+                continue
+            marker_mtime = get_modification_time(marker)
+            if marker_mtime is None or self.published.get(marker) == marker_mtime:
+                continue
+            # output-meta.json is written last, give it one poll to settle
+            if not final and current_time - marker_mtime < self.poll_interval:
+                continue
+            ready_groups.setdefault(marker,[]).append(single_group)
+        for single_marker in ready_groups:
+            marker_mtime = None
+            if single_marker:
+                marker_mtime = get_modification_time(single_marker)
+            failed_files = self.publish(ready_groups[single_marker])
+            if single_marker:
+                self.published[single_marker] = marker_mtime
+                update_json_cache(self.publish_state_path,{single_marker:marker_mtime})
+            if failed_files:
+                self.failed_files = self.failed_files + failed_files
+                error_message = "Failed to publish " + str(failed_files) + " output(s) to " + self.results_dir + ", see " + ROSLIN_COPY_OUTPUTS_LOG
+                log(self.leader_logger,"error",error_message)
+
+    def publish(self,publish_groups):
+        publish_items = []
+        for single_group in publish_groups:
+            dst_dir = single_group['destination']
+            if not os.path.isdir(dst_dir):
+                try:
+                    os.makedirs(dst_dir)
+                except:
+                    if not os.path.isdir(dst_dir):
+                        error_message = "Make dir: " + str(dst_dir) + " failed.\n"+traceback.format_exc()
+                        log(self.logger,"error",error_message)
+                        continue
+            for single_file in create_file_list(single_group['source'],single_group['patterns']):
+                publish_items.append((single_file,dst_dir,self.manifest,self.publish_mode))
+        failed_files = 0
+        # each thread takes the next file as soon as it is free, largest files first
+        # so the last copies to finish are the small ones
+        for single_output in self.pool.imap_unordered(publish_output_file,sort_largest_first(publish_items)):
+            if single_output['error']:
+                failed_files = failed_files + 1
+                error_message = "Publish {} to {} Failed\n {}".format(single_output['source'],single_output['destination'],single_output['error'])
+                log(self.logger,"error",error_message)
+                continue
+            for single_file in single_output['files']:
+                if single_file['skipped']:
+                    log(self.logger,"debug","Skipped {}: unchanged since the last copy".format(single_file['destination']))
+                    continue
+                log(self.logger,"info","Published {}: {}".format(single_file['destination'],get_copy_rate(single_file)))
+        return failed_files
@@ -0,0 +1,391 @@
+from __future__ import print_function
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+import time
+import threading
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+WORKER_LOG_FILE_NAME = "worker_log.txt"
+JOB_STATE_FILE_NAME = ".jobState"
+WORKER_APPEARED = "worker_appeared"
+WORKER_MODIFIED = "worker_modified"
+WORKER_REMOVED = "worker_removed"
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+INOTIFY_WATCH_MASK = IN_MODIFY | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 65536
+SHARED_POLL_INTERVAL = 1
+PROC_MOUNTS_PATH = "/proc/mounts"
+# inotify only sees the writes made on this host, workers on other nodes write
+# their logs through these filesystems without any event reaching the leader
+NETWORK_FILESYSTEM_TYPES = ('nfs', 'nfs4', 'gpfs', 'lustre', 'cifs', 'smb3', 'smbfs', 'ceph', 'glusterfs', 'fuse.glusterfs', 'beegfs', 'panfs', 'afs', 'fuse.sshfs')
+
+def list_directory(directory_path):
+    "return a (name, is_dir) tuple for every entry in the directory"
+    entry_list = []
+    try:
+        if scandir:
+            for single_entry in scandir(directory_path):
+                try:
+                    is_dir = single_entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                entry_list.append((single_entry.name,is_dir))
+        else:
+            for single_name in os.listdir(directory_path):
+                single_path = os.path.join(directory_path,single_name)
+                is_dir = os.path.isdir(single_path) and not os.path.islink(single_path)
+                entry_list.append((single_name,is_dir))
+    except OSError:
+        pass
+    return entry_list
+
+def find_job_state_files(worker_directory):
+    "toil writes .jobState one level under the worker directory, so only that level is listed"
+    job_state_list = []
+    for single_name, is_dir in list_directory(worker_directory):
+        if is_dir:
+            job_state_path = os.path.join(worker_directory,single_name,JOB_STATE_FILE_NAME)
+        elif single_name == JOB_STATE_FILE_NAME:
+            job_state_path = os.path.join(worker_directory,single_name)
+        else:
+            continue
+        if os.path.exists(job_state_path):
+            job_state_list.append(job_state_path)
+    return job_state_list
+
+def get_modification_time(file_path):
+    try:
+        return os.stat(file_path).st_mtime
+    except OSError:
+        return None
+
+def get_filesystem_type(directory_path):
+    "the type of the filesystem holding the directory, from its longest mount point in /proc/mounts"
+    real_path = os.path.realpath(directory_path)
+    filesystem_type = None
+    mount_point_length = -1
+    try:
+        with open(PROC_MOUNTS_PATH) as mounts_file:
+            for single_line in mounts_file:
+                mount_fields = single_line.split()
+                if len(mount_fields) < 3:
+                    continue
+                # spaces and tabs in mount points are written as octal escapes
+                mount_point = mount_fields[1].replace('\\040',' ').replace('\\011','\t')
+                mount_prefix = os.path.join(mount_point,'')
+                if real_path != mount_point and not real_path.startswith(mount_prefix):
+                    continue
+                if len(mount_point) > mount_point_length:
+                    mount_point_length = len(mount_point)
+                    filesystem_type = mount_fields[2]
+    except (IOError, OSError):
+        return None
+    return filesystem_type
+
+def is_network_filesystem(directory_path):
+    return get_filesystem_type(directory_path) in NETWORK_FILESYSTEM_TYPES
+
+def create_worker_watcher(work_dir):
+    if sys.platform.startswith('linux') and not is_network_filesystem(work_dir):
+        try:
+            return InotifyWorkerWatcher(work_dir)
+        except (OSError, AttributeError):
+            pass
+    return ScandirWorkerWatcher(work_dir)
+
+class SharedWorkerWatcher(object):
+    "one watcher per work directory, its events are handed to every subscriber"
+
+    def __init__(self,work_dir,poll_interval=SHARED_POLL_INTERVAL):
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.watcher = None
+        self.last_poll = 0
+        self.worker_logs = set()
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = WorkerWatcherSubscriber(self)
+        with self.lock:
+            for worker_log_path in self.worker_logs:
+                subscriber.worker_events.append((WORKER_APPEARED,worker_log_path))
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self,subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers and self.watcher:
+                self.watcher.close()
+                self.watcher = None
+                self.worker_logs = set()
+
+    def poll_events(self):
+        # called with the lock held, subscribers polling within poll_interval share one scan
+        if time.time() - self.last_poll < self.poll_interval:
+            return
+        self.last_poll = time.time()
+        if not self.watcher:
+            self.watcher = create_worker_watcher(self.work_dir)
+        try:
+            worker_events = self.watcher.poll_events()
+        except OSError:
+            self.watcher.close()
+            self.watcher = ScandirWorkerWatcher(self.work_dir)
+            worker_events = self.watcher.poll_events()
+        for worker_event, worker_log_path in worker_events:
+            if worker_event == WORKER_REMOVED:
+                self.worker_logs.discard(worker_log_path)
+            else:
+                self.worker_logs.add(worker_log_path)
+        for single_subscriber in self.subscribers:
+            single_subscriber.worker_events.extend(worker_events)
+
+class WorkerWatcherSubscriber(object):
+
+    def __init__(self,shared_watcher):
+        self.shared_watcher = shared_watcher
+        self.worker_events = []
+
+    def poll_events(self):
+        with self.shared_watcher.lock:
+            self.shared_watcher.poll_events()
+            worker_events = self.worker_events
+            self.worker_events = []
+        return worker_events
+
+    def close(self):
+        self.shared_watcher.unsubscribe(self)
+
+class ScandirWorkerWatcher(object):
+
+    def __init__(self,work_dir):
+        self.work_dir = work_dir
+        self.worker_logs = {}
+
+    def poll_events(self):
+        worker_logs = self.worker_logs
+        worker_events = []
+        found_worker_logs = set()
+        known_worker_directories = {}
+        for single_worker_log in worker_logs:
+            known_worker_directories[os.path.dirname(single_worker_log)] = single_worker_log
+        directory_list = [self.work_dir]
+        while directory_list:
+            directory_path = directory_list.pop()
+            if directory_path in known_worker_directories:
+                worker_log_path = known_worker_directories[directory_path]
+                last_modified = get_modification_time(worker_log_path)
+                if last_modified is None:
+                    continue
+                found_worker_logs.add(worker_log_path)
+                if last_modified != worker_logs[worker_log_path]:
+                    worker_logs[worker_log_path] = last_modified
+                    worker_events.append((WORKER_MODIFIED,worker_log_path))
+                continue
+            entry_list = list_directory(directory_path)
+            if (WORKER_LOG_FILE_NAME,False) in entry_list:
+                worker_log_path = os.path.join(directory_path,WORKER_LOG_FILE_NAME)
+                found_worker_logs.add(worker_log_path)
+                worker_logs[worker_log_path] = get_modification_time(worker_log_path)
+                worker_events.append((WORKER_APPEARED,worker_log_path))
+                continue
+            for single_name, is_dir in entry_list:
+                if is_dir:
+                    directory_list.append(os.path.join(directory_path,single_name))
+        for single_worker_log in list(worker_logs.keys()):
+            if single_worker_log not in found_worker_logs:
+                del worker_logs[single_worker_log]
+                worker_events.append((WORKER_REMOVED,single_worker_log))
+        return worker_events
+
+    def close(self):
+        pass
+
+class InotifyWorkerWatcher(object):
+
+    def __init__(self,work_dir):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_rm_watch = libc.inotify_rm_watch
+        inotify_fd = libc.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+        if inotify_fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        self.inotify_fd = inotify_fd
+        self.work_dir = work_dir
+        self.watch_paths = {}
+        self.path_watches = {}
+        self.worker_directories = set()
+        self.worker_events = []
+        self.scandir_watcher = None
+
+    def add_watch(self,directory_path):
+        if directory_path in self.path_watches:
+            return True
+        encoded_path = directory_path
+        if not isinstance(encoded_path, bytes):
+            encoded_path = encoded_path.encode(sys.getfilesystemencoding())
+        watch_descriptor = self.inotify_add_watch(self.inotify_fd, encoded_path, INOTIFY_WATCH_MASK)
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            if error_number in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(error_number, os.strerror(error_number) + ": " + str(directory_path))
+        self.watch_paths[watch_descriptor] = directory_path
+        self.path_watches[directory_path] = watch_descriptor
+        return True
+
+    def remove_watch(self,directory_path):
+        if directory_path not in self.path_watches:
+            return
+        watch_descriptor = self.path_watches.pop(directory_path)
+        del self.watch_paths[watch_descriptor]
+        self.inotify_rm_watch(self.inotify_fd, watch_descriptor)
+
+    def add_directory(self,directory_path):
+        # watch first, then list, so nothing created in between is missed
+        directory_list = [directory_path]
+        while directory_list:
+            single_directory = directory_list.pop()
+            if single_directory in self.worker_directories:
+                continue
+            if not self.add_watch(single_directory):
+                continue
+            entry_list = list_directory(single_directory)
+            if (WORKER_LOG_FILE_NAME,False) in entry_list:
+                self.add_worker_directory(single_directory)
+                continue
+            for single_name, is_dir in entry_list:
+                if is_dir:
+                    directory_list.append(os.path.join(single_directory,single_name))
+
+    def add_worker_directory(self,directory_path):
+        self.worker_directories.add(directory_path)
+        directory_prefix = os.path.join(directory_path,'')
+        for single_path in list(self.path_watches.keys()):
+            if single_path.startswith(directory_prefix):
+                self.remove_watch(single_path)
+        worker_log_path = os.path.join(directory_path,WORKER_LOG_FILE_NAME)
+        self.worker_events.append((WORKER_APPEARED,worker_log_path))
+
+    def remove_directory(self,directory_path):
+        self.remove_watch(directory_path)
+        if directory_path in self.worker_directories:
+            self.worker_directories.discard(directory_path)
+            worker_log_path = os.path.join(directory_path,WORKER_LOG_FILE_NAME)
+            self.worker_events.append((WORKER_REMOVED,worker_log_path))
+
+    def rescan(self):
+        for single_path in list(self.path_watches.keys()):
+            self.remove_watch(single_path)
+        previous_worker_directories = self.worker_directories
+        self.worker_directories = set()
+        self.add_directory(self.work_dir)
+        for single_directory in previous_worker_directories:
+            if single_directory not in self.worker_directories:
+                worker_log_path = os.path.join(single_directory,WORKER_LOG_FILE_NAME)
+                self.worker_events.append((WORKER_REMOVED,worker_log_path))
+
+    def read_events(self):
+        event_list = []
+        while True:
+            try:
+                event_buffer = os.read(self.inotify_fd, INOTIFY_READ_SIZE)
+            except OSError as read_error:
+                if read_error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not event_buffer:
+                break
+            buffer_offset = 0
+            while buffer_offset + INOTIFY_EVENT_HEADER.size <= len(event_buffer):
+                watch_descriptor, event_mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(event_buffer, buffer_offset)
+                name_start = buffer_offset + INOTIFY_EVENT_HEADER.size
+                event_name = event_buffer[name_start:name_start + name_length].rstrip(b'\0')
+                if not isinstance(event_name, str):
+                    event_name = event_name.decode(sys.getfilesystemencoding())
+                event_list.append((watch_descriptor, event_mask, event_name))
+                buffer_offset = name_start + name_length
+        return event_list
+
+    def fall_back_to_scandir(self):
+        # out of inotify watches ( fs.inotify.max_user_watches ), scan from now on
+        scandir_watcher = ScandirWorkerWatcher(self.work_dir)
+        for single_directory in self.worker_directories:
+            # reported as modified on the first scan, changes since the last event are not lost
+            scandir_watcher.worker_logs[os.path.join(single_directory,WORKER_LOG_FILE_NAME)] = None
+        self.scandir_watcher = scandir_watcher
+        self.close()
+        self.watch_paths = {}
+        self.path_watches = {}
+        self.worker_directories = set()
+
+    def poll_events(self):
+        if not self.scandir_watcher:
+            try:
+                self.read_worker_events()
+            except OSError as watch_error:
+                if watch_error.errno not in (errno.ENOSPC, errno.ENOMEM):
+                    raise
+                self.fall_back_to_scandir()
+        worker_events = self.worker_events
+        self.worker_events = []
+        if self.scandir_watcher:
+            worker_events.extend(self.scandir_watcher.poll_events())
+        return worker_events
+
+    def read_worker_events(self):
+        if self.work_dir not in self.path_watches:
+            self.add_directory(self.work_dir)
+        modified_worker_logs = set()
+        for watch_descriptor, event_mask, event_name in self.read_events():
+            if event_mask & IN_Q_OVERFLOW:
+                self.rescan()
+                continue
+            if watch_descriptor not in self.watch_paths:
+                continue
+            directory_path = self.watch_paths[watch_descriptor]
+            if event_mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                self.remove_directory(directory_path)
+                continue
+            if directory_path in self.worker_directories:
+                if event_name == WORKER_LOG_FILE_NAME and event_mask & IN_MODIFY:
+                    worker_log_path = os.path.join(directory_path,event_name)
+                    if worker_log_path not in modified_worker_logs:
+                        modified_worker_logs.add(worker_log_path)
+                        self.worker_events.append((WORKER_MODIFIED,worker_log_path))
+                continue
+            if event_name == WORKER_LOG_FILE_NAME and event_mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_worker_directory(directory_path)
+            elif event_mask & IN_ISDIR and event_mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_directory(os.path.join(directory_path,event_name))
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None